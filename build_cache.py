@@ -0,0 +1,150 @@
+# build_cache.py
+
+"""
+Make-style build manifest for the report steps.
+
+After a step succeeds, ``record()`` stores a SHA-256 of every file it
+read and wrote in ``BUILD_MANIFEST`` (JSON). The next time the step runs
+for the same month, ``lookup()`` returns the recorded output paths if
+every input still hashes the same and the outputs are still exactly what
+the step left behind. The step is then skipped. Fixing one source file
+therefore only rebuilds the steps that read it, plus the later months
+that carry that step's workbook forward.
+
+Hashes are cached by (size, mtime) like git's index. Given a
+``file_catalog.Catalog``, sizes, mtimes and glob matches come from it,
+after one ``rescan()`` of the folders involved, so an unchanged tree
+costs one listing per folder rather than a ``stat`` per file; without
+one they come from the filesystem. Inputs may be glob patterns; the
+pattern's current matches are fingerprinted, so adding a file counts as
+a change as well. ``BUILD_CACHE=False`` turns the cache off; the
+dashboard's "force" option bypasses it for one run.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+BUILD_CACHE    = os.environ.get("BUILD_CACHE", "True").lower() in ("1", "true", "yes")
+_here          = os.path.dirname(os.path.abspath(__file__))
+BUILD_MANIFEST = os.environ.get("BUILD_MANIFEST", os.path.join(_here, "build_manifest.json"))
+
+
+class BuildManifest:
+    def __init__(self, path: str = BUILD_MANIFEST, catalog=None):
+        self.path    = path
+        self.catalog = catalog
+        self._lock   = threading.Lock()
+        self._data: dict | None = None
+
+    def _expand(self, paths: list[str]) -> list[str]:
+        """``paths`` with glob patterns replaced by their (sorted) matches."""
+        out = []
+        for p in paths:
+            if glob.has_magic(p):
+                matches = self.catalog.glob(p) if self.catalog else glob.glob(p)
+                out.extend(sorted(matches) or [p])
+            else:
+                out.append(p)
+        return out
+
+    def _stat(self, path: str) -> tuple[int, int] | None:
+        if self.catalog is not None:
+            return self.catalog.stat(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _load(self) -> dict:
+        # Caller holds the lock
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+            self._data.setdefault("steps", {})
+            self._data.setdefault("files", {})
+        return self._data
+
+    def _save(self) -> None:
+        # Caller holds the lock
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def digest(self, path: str) -> str | None:
+        """SHA-256 of ``path`` (None if missing), reusing it while size and mtime match."""
+        st = self._stat(path)
+        if st is None:
+            return None
+        key = os.path.normcase(os.path.abspath(path))
+        with self._lock:
+            known = self._load()["files"].get(key)
+        if known and known[0] == st[0] and known[1] == st[1]:
+            return known[2]
+
+        h = hashlib.sha256()
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        except FileNotFoundError:
+            # Removed since the catalog listed it
+            return None
+        with self._lock:
+            self._load()["files"][key] = [st[0], st[1], h.hexdigest()]
+        return h.hexdigest()
+
+    def fingerprint(self, paths: list[str]) -> dict[str, str | None]:
+        """{path: digest} for ``paths``, with glob patterns expanded."""
+        if self.catalog is not None:
+            self.catalog.rescan(paths)
+        return {p: self.digest(p) for p in self._expand(paths)}
+
+    # ─────────── Steps ───────────
+
+    def lookup(self, key: str, inputs: dict[str, str | None], outputs: list[str]) -> list[str] | None:
+        """
+        The recorded result of step ``key`` if ``inputs`` (a ``fingerprint()``)
+        matches the last build and its outputs are untouched, else None.
+        """
+        with self._lock:
+            entry = self._load()["steps"].get(key)
+        if entry is None:
+            return None
+        if inputs != entry["inputs"]:
+            return None
+        current = self.fingerprint(outputs)
+        if None in current.values() or current != entry["outputs"]:
+            return None
+        return entry["result"]
+
+    def record(self, key: str, inputs: dict[str, str | None], outputs: list[str],
+               result: list[str]) -> None:
+        """
+        Remember that step ``key`` built ``result`` from ``inputs``, the
+        ``fingerprint()`` taken before it ran (so edits made meanwhile
+        still trigger a rebuild).
+        """
+        entry = {
+            "inputs":   inputs,
+            "outputs":  self.fingerprint(outputs),
+            "result":   list(result),
+            "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self._lock:
+            self._load()["steps"][key] = entry
+            self._save()
+
+    def forget(self, key: str) -> None:
+        """Drop step ``key`` so its next run rebuilds."""
+        with self._lock:
+            if self._load()["steps"].pop(key, None) is not None:
+                self._save()
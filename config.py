@@ -24,6 +24,10 @@ SQLALCHEMY_DATABASE_URI = os.environ.get(
     "sqlite:///" + os.path.join(basedir, "dashboard.sqlite")
 )
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# SQLite connection setup (dashboard.models): write-ahead logging lets readers run alongside
+# a writer, and writers wait up to SQLITE_BUSY_TIMEOUT_MS for the lock instead of failing
+SQLITE_WAL             = os.environ.get("SQLITE_WAL", "True").lower() in ("1", "true", "yes")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "10000"))
 
 # — APScheduler timezone —
 APP_TIMEZONE_STR = os.environ.get("APP_TIMEZONE", "Asia/Manila")
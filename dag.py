@@ -0,0 +1,179 @@
+# dag.py
+
+"""
+Dependency-aware step runner.
+
+Each ``Node`` declares the files it reads (``inputs``) and writes
+(``outputs``). A node waits for the nodes that produce any of its inputs;
+everything else runs at once. The five monthly reports only read their
+own previous-month workbook and supporting files, so a Run All takes
+about as long as its slowest step instead of the sum of all five.
+
+Nodes run on named thread pools so workbook-bound steps don't compete
+with the OCR steps for slots: ``excel`` (``DAG_EXCEL_WORKERS``) and
+``cpu`` (``DAG_CPU_WORKERS``). The pools live as long as the process and
+are shared by every run, so concurrent jobs queue for the same slots. With
+the xlwings backend every ``excel`` worker thread drives its own Excel
+instance, which it keeps between runs (see excel_session.py) instead of
+leaving one behind per run.
+
+A node that raises is reported as FAILED; the nodes depending on it are
+SKIPPED and never called.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+DAG_EXCEL_WORKERS = int(os.environ.get("DAG_EXCEL_WORKERS", "3"))
+DAG_CPU_WORKERS   = int(os.environ.get("DAG_CPU_WORKERS", "2"))
+
+POOLS = {"excel": DAG_EXCEL_WORKERS, "cpu": DAG_CPU_WORKERS}
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+@dataclass
+class Node:
+    name: str
+    fn: Callable[[], Any]
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    pool: str = "cpu"
+
+
+@dataclass
+class NodeResult:
+    name: str
+    status: str                      # "SUCCESS", "FAILED" or "SKIPPED"
+    value: Any = None
+    error: BaseException | None = None
+    seconds: float = 0.0
+
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+def dependencies(nodes: list[Node]) -> dict[str, set[str]]:
+    """
+    Return {node name: names of the nodes it waits for}. Raises
+    ValueError for duplicate names, a file written by two nodes, or a cycle.
+    """
+    producers: dict[str, str] = {}
+    names = set()
+    for node in nodes:
+        if node.name in names:
+            raise ValueError(f"Duplicate step name: {node.name}")
+        names.add(node.name)
+        for out in node.outputs:
+            other = producers.setdefault(_norm(out), node.name)
+            if other != node.name:
+                raise ValueError(f"{out} is written by both '{other}' and '{node.name}'")
+
+    deps = {
+        node.name: {producers[_norm(p)] for p in node.inputs if _norm(p) in producers} - {node.name}
+        for node in nodes
+    }
+
+    # Kahn's algorithm, only to reject cycles up front
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise ValueError("Steps depend on each other in a cycle: " + ", ".join(sorted(remaining)))
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return deps
+
+
+def _call(node: Node) -> NodeResult:
+    start = time.perf_counter()
+    try:
+        value = node.fn()
+    except Exception as e:
+        return NodeResult(node.name, "FAILED", error=e, seconds=time.perf_counter() - start)
+    return NodeResult(node.name, "SUCCESS", value=value, seconds=time.perf_counter() - start)
+
+def _executor(name: str) -> ThreadPoolExecutor:
+    """The long-lived pool of lane ``name``, started on first use."""
+    with _executors_lock:
+        pool = _executors.get(name)
+        if pool is None:
+            pool = _executors[name] = ThreadPoolExecutor(
+                max_workers=max(1, POOLS.get(name, 1)), thread_name_prefix=f"dag-{name}"
+            )
+        return pool
+
+def run(
+    nodes: list[Node],
+    workers: dict[str, int] | None = None,
+    on_result: Callable[[NodeResult], None] | None = None,
+) -> dict[str, NodeResult]:
+    """
+    Run every node once its dependencies have succeeded, on the shared
+    lane pools. ``workers`` overrides the pool sizes in ``POOLS`` with
+    pools of this run's own, as does calling ``run`` from inside a node
+    (which would otherwise wait on the slot it holds); those are shut
+    down afterwards. ``on_result`` is called in the calling thread as
+    each node finishes. Returns {name: NodeResult} in the order the
+    nodes were given.
+    """
+    deps    = dependencies(nodes)
+    by_name = {node.name: node for node in nodes}
+    nested  = threading.current_thread().name.startswith("dag-")
+    pools   = {}
+    own     = []
+    for name in {node.pool for node in nodes}:
+        if nested or name in (workers or {}):
+            size = (workers or {}).get(name, POOLS.get(name, 1))
+            pools[name] = ThreadPoolExecutor(max_workers=max(1, size), thread_name_prefix=f"dag-{name}")
+            own.append(pools[name])
+        else:
+            pools[name] = _executor(name)
+
+    results: dict[str, NodeResult] = {}
+    waiting = dict(deps)
+    running = {}
+
+    def finish(result: NodeResult) -> None:
+        results[result.name] = result
+        if on_result is not None:
+            on_result(result)
+
+    try:
+        while waiting or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name in [n for n, d in waiting.items() if d <= results.keys()]:
+                    del waiting[name]
+                    failed = sorted(d for d in deps[name] if results[d].status != "SUCCESS")
+                    if failed:
+                        finish(NodeResult(name, "SKIPPED",
+                                          error=RuntimeError(f"skipped, '{failed[0]}' did not succeed")))
+                        progressed = True
+                    else:
+                        node = by_name[name]
+                        # A context copy per node carries the caller's run_stats collector along
+                        fut = pools[node.pool].submit(contextvars.copy_context().run, _call, node)
+                        running[fut] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                del running[fut]
+                finish(fut.result())
+    finally:
+        # e.g. on_result raised: let the started nodes finish, as a pool shutdown used to
+        wait(running)
+        for pool in own:
+            pool.shutdown(wait=True)
+
+    return {node.name: results[node.name] for node in nodes}
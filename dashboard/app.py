@@ -1,9 +1,11 @@
 # dashboard/app.py
 
 from flask import Flask
-from dashboard.models import db
+from dashboard.models import db, upgrade_schema
 from dashboard.scheduler import schedule_all_tasks, sched
 from dashboard.views import main_bp
+from dashboard import jobs, retention, triggers
+from nea_reports import OUTBOX
 import config
 import os
 
@@ -18,11 +20,22 @@ def create_app():
 
     with app.app_context():
         db.create_all()
+        # Columns added to existing tables since they were created
+        upgrade_schema()
         app.config["SCHEDULER"] = sched
 
         # Build all jobs, then start the scheduler exactly once:
         schedule_all_tasks()
         sched.start()
 
+    # Background queue for "Run now" / "Run All"
+    jobs.init_app(app)
+    # Input checks for tasks that run when their files arrive
+    triggers.init_app(app)
+    # Daily roll-up of old task logs
+    retention.init_app(app)
+    # Deliver mail a previous run left in the outbox
+    OUTBOX.start()
+
     app.register_blueprint(main_bp)
     return app
@@ -0,0 +1,285 @@
+# dashboard/jobs.py
+
+"""
+Background job queue for "Run now", "Run All" and backfills.
+
+Routes call ``enqueue()``, which stores a ``Job`` row and hands its id to
+a pool of ``JOB_WORKERS`` threads, then return straight away. The worker
+updates the row's status, progress (``done``/``total``) and message as
+the job goes, which ``/jobs/<id>`` and ``/jobs/<id>/events`` expose to
+the browser. A Run All that asks for approval ends its turn on the
+worker as WAITING and is finished by a callback when the reply (or the
+``POLL_TIMEOUT_MIN`` timeout) comes in. Jobs that were still active when
+the server stopped are marked FAILED on the next start.
+"""
+
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+import dag
+from config import APP_TIMEZONE
+from dashboard import status as status_cache
+from dashboard.models import db, now_local, Job, Task, TaskLog
+from dashboard.scheduler import run_task_by_id
+from nea_reports import (
+    send_email, send_simple, target_date, APPROVALS, OUTBOX, POLL_FOR_REPLY, POLL_TIMEOUT_MIN,
+    STEPS_BY_FUNCTION
+)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+# WAITING: the work is done and an approval reply is pending
+ACTIVE = ("QUEUED", "RUNNING", "WAITING")
+
+_app      = None
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+
+def init_app(app) -> None:
+    """Remember the app for worker threads and close out jobs from a previous run."""
+    global _app
+    _app = app
+    with app.app_context():
+        stale = Job.query.filter(Job.status.in_(ACTIVE)).all()
+        for job in stale:
+            job.status      = "FAILED"
+            job.message     = "Interrupted by a server restart."
+            job.finished_at = now_local()
+        db.session.commit()
+
+def enqueue(kind: str, task_id: int | None = None, offset: int = 1, force: bool = False,
+            months: int = 1) -> Job:
+    """Store a new job and start it in the background ('force' rebuilds unchanged steps)."""
+    job = Job(kind=kind, task_id=task_id, offset=offset, months=months, status="QUEUED")
+    db.session.add(job)
+    db.session.commit()
+    status_cache.invalidate()
+    _executor.submit(_run, _app or current_app._get_current_object(), job.id, force)
+    return job
+
+def active_jobs(task_id: int | None = None) -> list[Job]:
+    """Queued or running jobs, optionally only those touching ``task_id``."""
+    query = Job.query.filter(Job.status.in_(ACTIVE))
+    if task_id is not None:
+        query = query.filter((Job.task_id == task_id) | Job.kind.in_(("run_all", "backfill")))
+    return query.order_by(Job.id).all()
+
+
+# ─────────── Worker ───────────
+
+def _run(app, job_id: int, force: bool = False) -> None:
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        job.status     = "RUNNING"
+        job.started_at = now_local()
+        db.session.commit()
+        status_cache.invalidate()
+
+        def progress(done: int | None = None, total: int | None = None,
+                     message: str | None = None) -> None:
+            if done is not None:
+                job.done = done
+            if total is not None:
+                job.total = total
+            if message is not None:
+                job.message = message
+            db.session.commit()
+            status_cache.invalidate()
+
+        try:
+            status, message = HANDLERS[job.kind](job, progress, force)
+        except Exception:
+            db.session.rollback()
+            tb = traceback.format_exc().strip().splitlines()
+            status, message = "FAILED", f"Unexpected error: {tb[-1] if tb else 'Unknown error.'}"
+
+        job.status  = status
+        job.message = message
+        if status != "WAITING":
+            job.done        = job.total if status == "SUCCESS" else job.done
+            job.finished_at = now_local()
+        db.session.commit()
+        status_cache.invalidate()
+        db.session.remove()
+
+
+def _run_task(job: Job, progress, force: bool) -> tuple[str, str]:
+    progress(0, 1, f"Running {job.task.name}")
+    result = run_task_by_id(job.task_id, offset=job.offset, force=force)
+    if result[0] is None:
+        return "FAILED", result[1]
+    status, message, _ = result
+    return status, message
+
+
+def _task_node(app, name: str, task: Task, offset: int, force: bool) -> dag.Node:
+    """
+    DAG node ``name`` that runs ``task`` through ``run_task_by_id`` (which
+    writes its TaskLog row) in the worker thread. Tasks backed by a report
+    step carry that step's inputs, outputs and pool.
+    """
+    # Plain values only: the Task belongs to the job thread's session, whose
+    # commits expire it; reading it in call() would refresh it from a DAG worker thread
+    task_id = task.id
+    step    = STEPS_BY_FUNCTION.get(task.function_name)
+
+    def call():
+        with app.app_context():
+            result = run_task_by_id(task_id, offset=offset, force=force)
+        if result[0] is None:
+            # Disabled or deleted since the job started
+            raise RuntimeError(result[1])
+        status, message, files = result
+        if status != "SUCCESS":
+            raise RuntimeError(message)
+        return files
+
+    if step is None:
+        return dag.Node(name=name, fn=call)
+    return step.node(offset, name=name, fn=call)
+
+def _run_dag(runs: list[tuple[str, Task, int]], progress, force: bool) -> tuple[list[str], list[str]]:
+    """
+    Run (node name, task, offset) triples as one DAG, advancing the job's
+    progress as each finishes and logging the ones that were skipped.
+    Returns (generated files in run order, names of the runs that didn't succeed).
+    """
+    progress(0, len(runs) or 1, "Running tasks")
+
+    finished = []
+    def on_result(res: dag.NodeResult) -> None:
+        finished.append(res.name)
+        progress(len(finished), message=f"{res.name}: {res.status}")
+
+    app     = current_app._get_current_object()
+    results = dag.run([_task_node(app, name, task, offset, force) for name, task, offset in runs],
+                      on_result=on_result)
+
+    files  = []
+    failed = []
+    for name, task, _ in runs:
+        res = results[name]
+        if res.status == "SUCCESS" and res.value:
+            files.extend(res.value)
+        elif res.status == "SKIPPED":
+            # Never started, so run_task_by_id wrote no row for it
+            db.session.add(TaskLog(task_id=task.id, run_time=now_local(),
+                                   status="SKIPPED", message=str(res.error)))
+        if res.status != "SUCCESS":
+            failed.append(name)
+    db.session.commit()
+    return files, failed
+
+def _run_all(job: Job, progress, force: bool) -> tuple[str, str]:
+    """
+    Run every enabled task as a DAG, then send one consolidated email if
+    any files were generated and, with POLL_FOR_REPLY, wait for approval.
+    """
+    tasks = Task.query.filter_by(enabled=True).order_by(Task.id).all()
+    all_generated_files, failed = _run_dag([(task.name, task, job.offset) for task in tasks],
+                                           progress, force)
+    summary = f"{len(tasks) - len(failed)} of {len(tasks)} tasks succeeded"
+    if failed:
+        summary += " (failed: " + ", ".join(failed) + ")"
+
+    if not all_generated_files:
+        return "FAILED" if failed else "SUCCESS", summary + "; no files were generated, so no email was sent."
+
+    d = datetime.now(APP_TIMEZONE).replace(day=1) - timedelta(days=1)
+    mmyy = d.strftime("%B %Y")
+    subject = f"Monthly NEA Reports – {mmyy}"
+    body = (
+        f"Attached are all updated NEA workbooks for {mmyy}.\n\n"
+        "May I proceed with submission? Reply with yes/no."
+    )
+
+    progress(message=f"Queueing email with {len(all_generated_files)} attachments")
+    try:
+        send_time = datetime.now(APP_TIMEZONE)
+        msgid = send_email(subject, body, all_generated_files)
+    except Exception as e:
+        return "FAILED", f"{summary}; email could not be queued: {e}"
+    # Raw/zipped/encoded sizes and any duplicates left out, as recorded by the outbox
+    sent = OUTBOX.status(msgid) or {}
+    summary += f"; email queued ({sent.get('attachments') or f'{len(all_generated_files)} attachments'})"
+
+    status = "FAILED" if failed else "SUCCESS"
+    if not POLL_FOR_REPLY:
+        return status, summary + "."
+
+    # The reply is handled by _approval_done when it arrives; the worker is free meanwhile
+    future = APPROVALS.watch(
+        ["yes", "approved", "proceed", "go", "go ahead"],
+        ["no", "abort", "cancel", "stop"],
+        after=send_time,
+        thread_msgid=msgid,
+    )
+    app, job_id = current_app._get_current_object(), job.id
+    future.add_done_callback(
+        lambda fut: _executor.submit(_approval_done, app, job_id, fut, subject, msgid, status, summary)
+    )
+    return "WAITING", summary + f"; waiting up to {POLL_TIMEOUT_MIN} min for an approval reply."
+
+def _run_backfill(job: Job, progress, force: bool) -> tuple[str, str]:
+    """
+    Run every enabled task for each month of the backfill, oldest first,
+    as one DAG: a report's months chain through the workbook each copies
+    forward, and everything else runs side by side. No email is sent.
+    """
+    tasks   = Task.query.filter_by(enabled=True).order_by(Task.id).all()
+    offsets = range(job.offset + job.months - 1, job.offset - 1, -1)
+    runs    = [
+        (f"{task.name} {target_date(offset):%Y-%m}", task, offset)
+        for offset in offsets
+        for task in tasks
+    ]
+    files, failed = _run_dag(runs, progress, force)
+    summary = (f"{len(runs) - len(failed)} of {len(runs)} runs over {job.months} months "
+               f"succeeded, {len(files)} files generated")
+    if failed:
+        summary += " (failed: " + ", ".join(failed) + ")"
+    return "FAILED" if failed else "SUCCESS", summary + "."
+
+def _approval_done(app, job_id: int, future, subject: str, msgid: str,
+                   status: str, summary: str) -> None:
+    """Send the follow-up for a Run All approval reply and close the job."""
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        try:
+            result = None if future.cancelled() else future.result()
+            if result == "yes":
+                send_simple(
+                    f"Re: {subject}",
+                    "Approval received. Proceeding with submission of the files.",
+                    reply_to_msgid=msgid,
+                )
+                summary += "; approval received"
+            elif result == "no":
+                send_simple(
+                    f"Re: {subject}",
+                    "Process aborted per reply.",
+                    reply_to_msgid=msgid,
+                )
+                summary += "; aborted per reply"
+            else:
+                summary += f"; no reply within {POLL_TIMEOUT_MIN} min"
+        except Exception as e:
+            status, summary = "FAILED", f"{summary}; approval follow-up failed: {e}"
+        job.status      = status
+        job.message     = summary + "."
+        job.done        = job.total if status == "SUCCESS" else job.done
+        job.finished_at = now_local()
+        db.session.commit()
+        status_cache.invalidate()
+        db.session.remove()
+
+
+HANDLERS = {
+    "task":    _run_task,
+    "run_all": _run_all,
+    "backfill": _run_backfill,
+}
@@ -1,12 +1,68 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from config import APP_TIMEZONE
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import APP_TIMEZONE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_WAL
 
 def now_local():
     return datetime.now(APP_TIMEZONE).replace(tzinfo=None)
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    """
+    The scheduler, job workers and request threads all write to the same
+    file. WAL keeps readers off the writer's lock, synchronous=NORMAL is
+    safe with WAL and skips an fsync per commit, and busy_timeout makes a
+    writer wait for the lock rather than raise "database is locked".
+    """
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+
+def upgrade_schema() -> list[str]:
+    """
+    Add columns and indexes the models gained since their tables were
+    created, since ``db.create_all()`` only creates missing tables.
+    Columns are added with their server default, so existing rows get a
+    value. Returns the "table.column" and index names that were added.
+    """
+    inspector = db.inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(db.engine)
+                added.append(index.name)
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(db.engine.dialect)}"
+            if col.server_default is not None:
+                default = col.server_default.arg
+                if not isinstance(default, str):
+                    default = str(default.compile(dialect=db.engine.dialect))
+                ddl += f" DEFAULT {default}"
+                if not col.nullable:
+                    ddl += " NOT NULL"
+            with db.engine.begin() as conn:
+                conn.execute(db.text(ddl))
+            added.append(f"{table.name}.{col.name}")
+    return added
+
 class Task(db.Model):
     __tablename__ = "tasks"
     id             = db.Column(db.Integer, primary_key=True)
@@ -18,6 +74,8 @@ class Task(db.Model):
     last_run       = db.Column(db.DateTime, nullable=True)
     last_status    = db.Column(db.String(10), nullable=True)  # "SUCCESS" or "FAILED"
     enabled        = db.Column(db.Boolean, default=True)
+    # Also run as soon as the inputs for the target month are on the share (dashboard.triggers)
+    watch_inputs   = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
     created_at     = db.Column(db.DateTime, default=now_local)
     updated_at     = db.Column(db.DateTime, default=now_local, onupdate=now_local)
 
@@ -28,5 +86,78 @@ class TaskLog(db.Model):
     id       = db.Column(db.Integer, primary_key=True)
     task_id  = db.Column(db.Integer, db.ForeignKey("tasks.id"), nullable=False)
     run_time = db.Column(db.DateTime, default=now_local)
-    status   = db.Column(db.String(10), nullable=False)  # "SUCCESS" or "FAILED"
-    message  = db.Column(db.Text, nullable=True)
\ No newline at end of file
+    status   = db.Column(db.String(10), nullable=False)  # "SUCCESS", "FAILED" or "SKIPPED"
+    message  = db.Column(db.Text, nullable=True)
+    duration = db.Column(db.Float, nullable=True)      # seconds, start to recorded
+
+    phases = db.relationship("TaskLogPhase", backref="log", order_by="TaskLogPhase.seconds.desc()",
+                             cascade="all, delete-orphan")
+
+    # The detail page pages through one task's logs newest first
+    __table_args__ = (db.Index("ix_task_logs_task_id_run_time", "task_id", "run_time"),)
+
+class TaskLogPhase(db.Model):
+    """Time a run spent in one phase (run_stats.span), e.g. "ocr" or "save"."""
+    __tablename__ = "task_log_phases"
+    id      = db.Column(db.Integer, primary_key=True)
+    log_id  = db.Column(db.Integer, db.ForeignKey("task_logs.id"), nullable=False, index=True)
+    phase   = db.Column(db.String(50), nullable=False)
+    seconds = db.Column(db.Float, nullable=False)
+    calls   = db.Column(db.Integer, default=1, nullable=False)
+
+class TaskLogDay(db.Model):
+    """One task's runs on one day, kept after dashboard.retention prunes the TaskLog rows."""
+    __tablename__ = "task_log_days"
+    id           = db.Column(db.Integer, primary_key=True)
+    task_id      = db.Column(db.Integer, db.ForeignKey("tasks.id"), nullable=False)
+    day          = db.Column(db.Date, nullable=False)
+    runs         = db.Column(db.Integer, default=0, nullable=False)
+    succeeded    = db.Column(db.Integer, default=0, nullable=False)
+    failed       = db.Column(db.Integer, default=0, nullable=False)
+    skipped      = db.Column(db.Integer, default=0, nullable=False)
+    last_run     = db.Column(db.DateTime, nullable=True)
+    last_message = db.Column(db.Text, nullable=True)   # of the day's last failed run
+
+    task = db.relationship("Task")
+
+    __table_args__ = (db.UniqueConstraint("task_id", "day"),)
+
+class Job(db.Model):
+    """A queued "Run now" or "Run All" request, executed by dashboard.jobs."""
+    __tablename__ = "jobs"
+    id          = db.Column(db.Integer, primary_key=True)
+    kind        = db.Column(db.String(20), nullable=False)   # "task", "run_all" or "backfill"
+    task_id     = db.Column(db.Integer, db.ForeignKey("tasks.id"), nullable=True)
+    offset      = db.Column(db.Integer, default=1, nullable=False)
+    # A backfill covers offsets offset .. offset + months - 1
+    months      = db.Column(db.Integer, default=1, server_default="1", nullable=False)
+    status      = db.Column(db.String(10), default="QUEUED", nullable=False)  # QUEUED, RUNNING, WAITING, SUCCESS, FAILED
+    done        = db.Column(db.Integer, default=0, nullable=False)  # steps finished
+    total       = db.Column(db.Integer, default=1, nullable=False)
+    message     = db.Column(db.Text, nullable=True)             # current phase or final result
+    created_at  = db.Column(db.DateTime, default=now_local)
+    started_at  = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    task = db.relationship("Task")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("SUCCESS", "FAILED")
+
+    def to_dict(self) -> dict:
+        return {
+            "id":          self.id,
+            "kind":        self.kind,
+            "task_id":     self.task_id,
+            "offset":      self.offset,
+            "months":      self.months,
+            "status":      self.status,
+            "done":        self.done,
+            "total":       self.total,
+            "progress":    round(self.done / self.total, 3) if self.total else 0,
+            "message":     self.message,
+            "created_at":  self.created_at.isoformat() if self.created_at else None,
+            "started_at":  self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
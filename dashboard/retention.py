@@ -0,0 +1,91 @@
+# dashboard/retention.py
+
+"""
+TaskLog retention.
+
+Every scheduled, triggered and manual run adds a TaskLog row, and nothing
+removed them except "Clear Logs". ``prune()`` rolls the rows older than
+``LOG_RETENTION_DAYS`` up into one ``TaskLogDay`` per task and day (run,
+success, failure and skip counts, plus the day's last failure message)
+and deletes them. Recent history keeps its full messages; older history
+stays visible as daily totals on the task page.
+
+It runs every ``LOG_PRUNE_INTERVAL_HOURS`` from ``schedule_all_tasks``
+(``dashboard.retention:prune``), in ``LOG_PRUNE_BATCH``-row
+transactions per task so the database is never locked for long, and
+needs ``init_app()`` to have run. ``LOG_RETENTION_DAYS=0`` keeps every
+row.
+"""
+
+import os
+import threading
+from datetime import timedelta
+
+from dashboard.models import db, now_local, Task, TaskLog, TaskLogDay, TaskLogPhase
+
+LOG_RETENTION_DAYS       = int(os.environ.get("LOG_RETENTION_DAYS", "90"))
+LOG_PRUNE_INTERVAL_HOURS = float(os.environ.get("LOG_PRUNE_INTERVAL_HOURS", "24"))
+LOG_PRUNE_BATCH          = int(os.environ.get("LOG_PRUNE_BATCH", "500"))
+
+_app  = None
+_lock = threading.Lock()
+
+
+def init_app(app) -> None:
+    """Remember the app; pruning runs in a scheduler thread."""
+    global _app
+    _app = app
+
+def _roll_up(logs: list[TaskLog]) -> None:
+    """Add ``logs`` (oldest first) to their TaskLogDay rows."""
+    days: dict[tuple[int, object], TaskLogDay] = {}
+    for log in logs:
+        key = (log.task_id, log.run_time.date())
+        day = days.get(key)
+        if day is None:
+            day = TaskLogDay.query.filter_by(task_id=key[0], day=key[1]).first()
+            if day is None:
+                day = TaskLogDay(task_id=key[0], day=key[1], runs=0, succeeded=0, failed=0, skipped=0)
+                db.session.add(day)
+            days[key] = day
+        day.runs += 1
+        if log.status == "SUCCESS":
+            day.succeeded += 1
+        elif log.status == "SKIPPED":
+            day.skipped += 1
+        else:
+            day.failed += 1
+            day.last_message = log.message
+        if day.last_run is None or log.run_time > day.last_run:
+            day.last_run = log.run_time
+
+def prune(days: int | None = None) -> int:
+    """
+    Roll up and delete TaskLog rows from before midnight ``days``
+    (default ``LOG_RETENTION_DAYS``) days ago. Returns how many were pruned.
+    """
+    days = LOG_RETENTION_DAYS if days is None else days
+    if _app is None or days <= 0:
+        return 0
+    with _app.app_context(), _lock:
+        cutoff = (now_local() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        pruned = 0
+        for (task_id,) in db.session.query(Task.id).all():
+            while True:
+                # Oldest first through ix_task_logs_task_id_run_time
+                logs = (TaskLog.query
+                        .filter(TaskLog.task_id == task_id, TaskLog.run_time < cutoff)
+                        .order_by(TaskLog.run_time, TaskLog.id)
+                        .limit(LOG_PRUNE_BATCH)
+                        .all())
+                if not logs:
+                    break
+                _roll_up(logs)
+                ids = [log.id for log in logs]
+                TaskLogPhase.query.filter(TaskLogPhase.log_id.in_(ids)).delete(synchronize_session=False)
+                TaskLog.query.filter(TaskLog.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                pruned += len(logs)
+        if pruned:
+            print(f"Rolled {pruned} task log rows from before {cutoff:%Y-%m-%d} up into daily totals")
+        return pruned
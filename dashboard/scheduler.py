@@ -3,23 +3,65 @@
 import importlib
 import os
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from config import SCHEDULER_TIMEZONE, APP_TIMEZONE
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from pywintypes import com_error
+from apscheduler.triggers.interval import IntervalTrigger
+try:
+    from pywintypes import com_error
+except ImportError:
+    # pywin32 only exists on Windows; the headless workbook backend never raises this
+    class com_error(Exception):
+        pass
 from pandas.errors import EmptyDataError
 
 from flask import current_app
-from dashboard.models import db, Task, TaskLog
+from dashboard.models import db, Task, TaskLog, TaskLogPhase
+from dashboard import status as status_cache
+import metrics
+import run_stats
 sched = BackgroundScheduler(timezone=SCHEDULER_TIMEZONE)
 
 
-def run_task_by_id(task_id: int, offset: int = 1):
+def record_run(task: Task, start: datetime, status: str, message: str,
+               stats: run_stats.RunStats | None = None) -> None:
+    """
+    Record a run's outcome: Task.last_run/last_status, its TaskLog row
+    and the time it spent in each phase (from ``stats``), committed
+    together so none is written without the others.
+    """
+    duration = (datetime.now(APP_TIMEZONE).replace(tzinfo=None) - start).total_seconds()
+    task.last_run    = start
+    task.last_status = status
+    db.session.add(task)
+    log = TaskLog(
+        task_id=task.id,
+        run_time=start,
+        status=status,
+        message=message,
+        duration=duration
+    )
+    if stats is not None:
+        log.phases = [TaskLogPhase(phase=phase, seconds=seconds, calls=calls)
+                      for phase, (seconds, calls) in stats.timings.items()]
+    db.session.add(log)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    status_cache.invalidate()
+    metrics.inc("nea_task_runs_total", {"task": task.name, "status": status})
+    metrics.observe("nea_task_run_seconds", duration, {"task": task.name})
+
+
+def run_task_by_id(task_id: int, offset: int = 1, force: bool = False):
     """
     Called by APScheduler or manually via the UI.
-    Imports the task’s module + function, runs it with the given offset,
-    then writes one TaskLog entry, updates Task.last_run/status,
+    Imports the task’s module + function, runs it with the given offset
+    (and force=True, to rebuild even if its inputs are unchanged),
+    then records the outcome (one TaskLog entry plus Task.last_run/status),
     and returns (status, message, files) so that callers can flash alerts
     and optionally use the generated file paths.
     """
@@ -28,129 +70,112 @@ def run_task_by_id(task_id: int, offset: int = 1):
         return None, "Task is disabled or does not exist."
 
     start = datetime.now(APP_TIMEZONE).replace(tzinfo=None)
+    stats = None
     try:
         module = importlib.import_module(task.module_path)
         fn     = getattr(module, task.function_name)
 
         # Attempt to run the actual task function
-        generated_files = fn(offset=offset)
-
-        # Mark SUCCESS on Task
-        task.last_run    = start
-        task.last_status = "SUCCESS"
-        db.session.add(task)
-        db.session.commit()
-
-        # Build a friendly message
-        if generated_files:
-            # Assume generated_files is a list of filepaths
-            filenames = [os.path.basename(f) for f in generated_files]
-            user_message = "Generated: " + ", ".join(filenames)
-        else:
-            user_message = "No files were generated (check templates or source files)."
-
-        # Write one TaskLog row
-        log = TaskLog(
-            task_id=task.id,
-            run_time=start,
-            status="SUCCESS",
-            message=user_message
-        )
-        db.session.add(log)
-        db.session.commit()
-
-        return "SUCCESS", user_message, generated_files
+        with run_stats.collect() as stats:
+            # Only report steps take 'force', so leave it out unless asked
+            generated_files = fn(offset=offset, force=True) if force else fn(offset=offset)
 
     except com_error:
         # Excel COM error (e.g. Excel not installed, hung instance)
-        task.last_run    = start
-        task.last_status = "FAILED"
-        db.session.add(task)
-        db.session.commit()
-
         user_message = (
             "Error: Excel could not start. "
             "Make sure Microsoft Excel is installed and no hung instance is open."
         )
-        log = TaskLog(
-            task_id=task.id,
-            run_time=start,
-            status="FAILED",
-            message=user_message
-        )
-        db.session.add(log)
-        db.session.commit()
-        return "FAILED", user_message, []
 
     except FileNotFoundError as fnf:
         # Missing PDF, Excel, or other file
-        task.last_run    = start
-        task.last_status = "FAILED"
-        db.session.add(task)
-        db.session.commit()
-
         user_message = (
             f"Error: A required file was not found: {fnf.filename}. "
             "Please check that all source files and templates exist."
         )
-        log = TaskLog(
-            task_id=task.id,
-            run_time=start,
-            status="FAILED",
-            message=user_message
-        )
-        db.session.add(log)
-        db.session.commit()
-        return "FAILED", user_message, []
 
     except EmptyDataError:
         # Pandas read_excel or similar found empty/malformed data
-        task.last_run    = start
-        task.last_status = "FAILED"
-        db.session.add(task)
-        db.session.commit()
-
         user_message = "Error: One of the data sheets was empty or malformed."
-        log = TaskLog(
-            task_id=task.id,
-            run_time=start,
-            status="FAILED",
-            message=user_message
-        )
-        db.session.add(log)
-        db.session.commit()
-        return "FAILED", user_message, []
 
     except Exception:
         # Catch-all for any other unhandled exception
-        task.last_run    = start
-        task.last_status = "FAILED"
-        db.session.add(task)
-        db.session.commit()
-
         tb = traceback.format_exc().strip().splitlines()
         brief = tb[-1] if tb else "Unknown error."
         user_message = f"Unexpected error: {brief}"
 
-        log = TaskLog(
-            task_id=task.id,
-            run_time=start,
-            status="FAILED",
-            message=user_message
-        )
-        db.session.add(log)
-        db.session.commit()
-        return "FAILED", user_message, []
+    else:
+        # Build a friendly message
+        if generated_files:
+            # Assume generated_files is a list of filepaths
+            filenames = [os.path.basename(f) for f in generated_files]
+            user_message = "Generated: " + ", ".join(filenames)
+        else:
+            user_message = "No files were generated (check templates or source files)."
+        if stats:
+            # e.g. "render cache hits: 2, render cache misses: 1"
+            user_message += "\n" + stats.summary()
+
+        record_run(task, start, "SUCCESS", user_message, stats)
+        return "SUCCESS", user_message, generated_files
+
+    # Anything the task left half-written in the session isn't ours to commit
+    db.session.rollback()
+    record_run(task, start, "FAILED", user_message, stats)
+    return "FAILED", user_message, []
 
 
 def schedule_all_tasks():
     """
-    Rebuild APScheduler’s job list from the database’s enabled tasks.
+    Rebuild APScheduler’s job list from the database’s enabled tasks:
+    their cron schedules, plus an input check for tasks with watch_inputs,
+    plus the TaskLog pruning (dashboard.retention) and the OCR cache purge.
     We do NOT call sched.start() here, since that belongs in app.py’s create_app().
     """
+    # Imported here: dashboard.triggers imports dashboard.jobs, which imports this module
+    from dashboard import retention, triggers
+    import ocr_cache
+
     sched.remove_all_jobs()
 
+    if ocr_cache.OCR_CACHE:
+        sched.add_job(
+            func=ocr_cache.purge_expired,
+            trigger=IntervalTrigger(hours=ocr_cache.OCR_CACHE_PURGE_INTERVAL_HOURS, timezone=SCHEDULER_TIMEZONE),
+            id="ocr-cache-purge",
+            name="Purge OCR cache",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            next_run_time=datetime.now(APP_TIMEZONE) + timedelta(minutes=1),
+        )
+
+    if retention.LOG_RETENTION_DAYS > 0:
+        sched.add_job(
+            func=retention.prune,
+            trigger=IntervalTrigger(hours=retention.LOG_PRUNE_INTERVAL_HOURS, timezone=SCHEDULER_TIMEZONE),
+            id="log-retention",
+            name="Prune task logs",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+            # First pass shortly after startup rather than a full interval later
+            next_run_time=datetime.now(APP_TIMEZONE) + timedelta(minutes=1),
+        )
+
     for task in Task.query.filter_by(enabled=True).all():
+        if task.watch_inputs:
+            sched.add_job(
+                func=triggers.check,
+                trigger=IntervalTrigger(seconds=triggers.FILE_TRIGGER_POLL_SEC, timezone=SCHEDULER_TIMEZONE),
+                args=[task.id],
+                id=f"{task.id}-inputs",
+                name=f"{task.name} (inputs)",
+                replace_existing=True,
+                coalesce=True,
+                max_instances=1,
+            )
+
         if not task.schedule:
             continue
 
@@ -178,6 +203,9 @@ def schedule_all_tasks():
             replace_existing=True
         )
 
+    # Next fire times changed
+    status_cache.invalidate()
+
     # Note: We do NOT call sched.start() here.
     # The Flask app’s create_app() should call sched.start() exactly once.
 
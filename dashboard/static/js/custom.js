@@ -8,3 +8,80 @@ document.addEventListener("DOMContentLoaded", () => {
     }, idx * 100); // 100ms stagger between cards
   });
 });
+
+// Live job progress: each .job-progress card follows its job's event stream
+// and reloads the page once the job has finished, so the new log shows up.
+document.addEventListener("DOMContentLoaded", () => {
+  document.querySelectorAll(".job-progress").forEach((card) => {
+    const status = card.querySelector(".job-status");
+    const bar = card.querySelector(".job-bar");
+    const message = card.querySelector(".job-message");
+    const source = new EventSource(card.dataset.eventsUrl);
+
+    source.onmessage = (event) => {
+      const job = JSON.parse(event.data);
+      status.textContent = job.status;
+      bar.style.width = `${Math.round(job.progress * 100)}%`;
+      message.textContent = job.message || "";
+      if (job.status === "SUCCESS" || job.status === "FAILED") {
+        source.close();
+        status.className = `badge job-status badge-${job.status === "SUCCESS" ? "success" : "danger"}`;
+        bar.classList.remove("progress-bar-animated");
+        setTimeout(() => window.location.reload(), 1500);
+      }
+    };
+    // The stream ends when the job finishes; don't let EventSource reconnect
+    source.onerror = () => source.close();
+  });
+});
+
+// Task list: poll /api/status with the last ETag. Unchanged status costs a 304;
+// a change updates the cards in place, and a new or finished job (or a task
+// added or removed) reloads the page so the progress cards follow it.
+document.addEventListener("DOMContentLoaded", () => {
+  const container = document.getElementById("taskStatus");
+  if (!container) return;
+
+  const shown = (iso) => (iso ? iso.slice(0, 16).replace("T", " ") : "—");
+  const badges = {
+    SUCCESS: '<span class="badge badge-success animate__animated animate__fadeIn">OK</span>',
+    FAILED: '<span class="badge badge-danger animate__animated animate__shakeX">ERR</span>',
+  };
+  const renderedJobs = Array.from(document.querySelectorAll(".job-progress"))
+    .map((card) => card.dataset.jobId)
+    .join(",");
+  let etag = container.dataset.etag;
+
+  const poll = async () => {
+    try {
+      const response = await fetch(container.dataset.statusUrl, {
+        cache: "no-store",
+        headers: etag ? { "If-None-Match": `"${etag}"` } : {},
+      });
+      if (response.status !== 200) return;
+      etag = (response.headers.get("ETag") || "").replace(/"/g, "");
+      const status = await response.json();
+
+      const cards = container.querySelectorAll(".task-card");
+      const jobs = status.jobs.map((job) => job.id).join(",");
+      if (cards.length !== status.tasks.length || jobs !== renderedJobs) {
+        window.location.reload();
+        return;
+      }
+      status.tasks.forEach((task) => {
+        const card = container.querySelector(`.task-card[data-task-id="${task.id}"]`);
+        if (!card) return;
+        card.querySelector(".task-last-run").textContent = shown(task.last_run);
+        card.querySelector(".task-next-run").textContent = shown(task.next_run);
+        const badge = card.querySelector(".task-status");
+        if (badge.dataset.status !== (task.last_status || "")) {
+          badge.dataset.status = task.last_status || "";
+          badge.innerHTML = badges[task.last_status] || '<span class="badge badge-secondary">—</span>';
+        }
+      });
+    } catch (e) {
+      // Server restarting or offline: try again on the next tick
+    }
+  };
+  setInterval(poll, parseFloat(container.dataset.pollSec) * 1000);
+});
@@ -0,0 +1,82 @@
+# dashboard/status.py
+
+"""
+Cached dashboard status for ``/api/status`` and the task list.
+
+``snapshot()`` returns every task's last run, last status and next fire
+time, plus the active jobs. The result is serialised once and tagged
+with a hash of its content. It is rebuilt only after ``invalidate()``,
+which recorded runs, job updates and ``schedule_all_tasks`` call, or
+once it is older than ``STATUS_CACHE_SEC``. That catches changes made by
+another process, such as populate_tasks.py. Status screens that poll
+with ``If-None-Match`` get a 304 without touching the database.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from dashboard.models import now_local, Job, Task
+
+STATUS_CACHE_SEC = float(os.environ.get("STATUS_CACHE_SEC", "60"))
+
+_lock     = threading.Lock()
+_version  = 0          # bumped by invalidate()
+_snapshot = None       # (version it was built at, monotonic build time, Snapshot)
+
+
+class Snapshot(NamedTuple):
+    data: dict          # {"tasks": [...], "jobs": [...], "generated_at": ...}
+    body: bytes         # data as JSON
+    etag: str           # hash of the tasks and jobs, without generated_at
+
+
+def invalidate() -> None:
+    """Mark the snapshot stale; the next request rebuilds it."""
+    global _version
+    with _lock:
+        _version += 1
+
+def _iso(value) -> str | None:
+    return value.isoformat() if value else None
+
+def _build(scheduler) -> Snapshot:
+    tasks = []
+    for task in Task.query.order_by(Task.name).all():
+        job = scheduler.get_job(str(task.id))
+        tasks.append({
+            "id":           task.id,
+            "name":         task.name,
+            "enabled":      bool(task.enabled),
+            "schedule":     task.schedule,
+            "watch_inputs": bool(task.watch_inputs),
+            "last_run":     _iso(task.last_run),
+            "last_status":  task.last_status,
+            "next_run":     _iso(job.next_run_time) if job else None,
+        })
+    # Job.finished: SUCCESS or FAILED; everything else is still active
+    active = Job.query.filter(Job.status.notin_(("SUCCESS", "FAILED"))).order_by(Job.id).all()
+    content = {"tasks": tasks, "jobs": [job.to_dict() for job in active]}
+
+    etag = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:32]
+    data = {**content, "generated_at": now_local().isoformat()}
+    return Snapshot(data, json.dumps(data).encode(), etag)
+
+def snapshot(scheduler) -> Snapshot:
+    """The current status, rebuilt if it was invalidated or has expired."""
+    global _snapshot
+    with _lock:
+        version = _version
+        cached  = _snapshot
+    if cached and cached[0] == version and time.monotonic() - cached[1] < STATUS_CACHE_SEC:
+        return cached[2]
+
+    snap = _build(scheduler)
+    with _lock:
+        # A newer build may have finished meanwhile; keep whichever saw the later version
+        if _snapshot is None or _snapshot[0] <= version:
+            _snapshot = (version, time.monotonic(), snap)
+    return snap
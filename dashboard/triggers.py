@@ -0,0 +1,93 @@
+# dashboard/triggers.py
+
+"""
+File-arrival triggers.
+
+Tasks with ``watch_inputs`` set are checked every ``FILE_TRIGGER_POLL_SEC``
+in addition to their cron schedule. A check refreshes the file catalog
+and looks up the task's report step inputs for its default offset. Once
+every required input is on the share it queues a "Run now" job, so a
+bill that lands on the 5th is processed on the 5th rather than the 28th.
+
+Inputs are debounced. Their size and mtime have to stay the same for
+``FILE_TRIGGER_SETTLE_SEC``, so a PDF still being copied isn't picked up
+half-written. A set of inputs is run once: nothing is queued again until
+a file changes, the target month moves on, or the step's build cache
+entry (see build_cache.py) is stale. Checks are scheduled by name from
+``schedule_all_tasks`` (``dashboard.triggers:check``) and need
+``init_app()`` to have run.
+"""
+
+import os
+import threading
+import time
+
+from dashboard import jobs
+from dashboard.models import db, Task
+from nea_reports import CATALOG, STEPS_BY_FUNCTION, missing_inputs, target_date
+
+FILE_TRIGGER_POLL_SEC   = float(os.environ.get("FILE_TRIGGER_POLL_SEC", "60"))
+FILE_TRIGGER_SETTLE_SEC = float(os.environ.get("FILE_TRIGGER_SETTLE_SEC", "120"))
+
+_app   = None
+_lock  = threading.Lock()
+_seen: dict[int, tuple[tuple, float]] = {}   # task id -> (input signature, when first seen)
+_fired: dict[int, tuple] = {}                # task id -> signature last queued
+
+
+def init_app(app) -> None:
+    """Remember the app; checks run in scheduler threads."""
+    global _app
+    _app = app
+
+def _signature(paths: list[str]) -> tuple:
+    """(path, size, mtime) of each input, from a fresh listing: a copy in progress doesn't touch its folder."""
+    CATALOG.rescan(paths)
+    sig = []
+    for pattern in paths:
+        for p in CATALOG.glob(pattern):
+            st = CATALOG.stat(p)
+            if st is not None:
+                sig.append((p, *st))
+    return tuple(sorted(sig))
+
+def check(task_id: int) -> str:
+    """
+    Queue a run of ``task_id`` if its inputs are complete, settled and
+    not yet built. Returns what happened, for logging and tests.
+    """
+    if _app is None:
+        return "not initialised"
+    with _app.app_context(), _lock:
+        task = db.session.get(Task, task_id)
+        step = STEPS_BY_FUNCTION.get(task.function_name) if task else None
+        if task is None or not task.enabled or not task.watch_inputs or step is None:
+            return "not watched"
+
+        CATALOG.refresh()
+        offset = task.default_offset
+        if any(required for _, required in missing_inputs(offset, [step]).get(step.name, [])):
+            _seen.pop(task_id, None)
+            return "waiting for inputs"
+
+        inputs, _ = step.io(target_date(offset))
+        sig  = _signature(inputs)
+        now  = time.monotonic()
+        seen = _seen.get(task_id)
+        if seen is None or seen[0] != sig:
+            _seen[task_id] = (sig, now)
+            return "settling"
+        if now - seen[1] < FILE_TRIGGER_SETTLE_SEC:
+            return "settling"
+        if _fired.get(task_id) == sig:
+            return "already queued"
+        if jobs.active_jobs(task_id):
+            return "job active"
+
+        _fired[task_id] = sig
+        if step.up_to_date(offset):
+            return "up to date"
+
+        job = jobs.enqueue("task", task_id=task.id, offset=offset)
+        print(f"Inputs for '{task.name}' arrived; queued job #{job.id}")
+        return "queued"
@@ -1,28 +1,87 @@
 # dashboard/views.py
 
+import json
+import os
+import time
+from datetime import datetime
+
 from flask import (
     Blueprint, render_template, redirect,
-    url_for, request, flash, current_app
+    url_for, request, flash, current_app,
+    jsonify, Response, stream_with_context
 )
-from dashboard.models import db, Task, TaskLog
-from dashboard.scheduler import run_task_by_id, schedule_all_tasks
-from nea_reports import run_all, send_email, send_simple, wait_reply, POLL_FOR_REPLY
+import metrics
+from dashboard import jobs
+from dashboard import status as status_cache
+from dashboard.models import db, Task, TaskLog, TaskLogDay, TaskLogPhase, Job
+from dashboard.scheduler import schedule_all_tasks
+from nea_reports import missing_inputs, offset_for, target_date, STEPS_BY_FUNCTION
+
+# How often the event stream re-reads a running job
+JOB_EVENTS_INTERVAL_SEC = float(os.environ.get("JOB_EVENTS_INTERVAL_SEC", "1"))
+# Longest month range a single backfill may cover
+BACKFILL_MAX_MONTHS     = int(os.environ.get("BACKFILL_MAX_MONTHS", "24"))
+# How often the task list polls /api/status
+STATUS_POLL_SEC         = float(os.environ.get("STATUS_POLL_SEC", "15"))
+# Log rows per page on the task page
+TASK_LOG_PAGE_SIZE      = int(os.environ.get("TASK_LOG_PAGE_SIZE", "20"))
 
 main_bp = Blueprint("main", __name__)
 
 
+@main_bp.app_template_filter("timestamp")
+def format_timestamp(value: str | None) -> str:
+    """"YYYY-MM-DD HH:MM" of an ISO timestamp from the status snapshot, or "—"."""
+    return value[:16].replace("T", " ") if value else "—"
+
+
 @main_bp.route("/")
 def index():
-    tasks = Task.query.order_by(Task.name).all()
-    scheduler = current_app.config["SCHEDULER"]
-    return render_template("task_list.html", tasks=tasks, scheduler=scheduler)
+    # Tasks and next run times come from the cached snapshot that /api/status serves
+    snap = status_cache.snapshot(current_app.config["SCHEDULER"])
+    return render_template("task_list.html", tasks=snap.data["tasks"], status_etag=snap.etag,
+                           status_poll_sec=STATUS_POLL_SEC,
+                           active_jobs=jobs.active_jobs(),
+                           missing=missing_inputs(1),
+                           missing_month=target_date(1).strftime("%B %Y"),
+                           last_month=target_date(1).strftime("%Y-%m"))
+
+
+def _log_cursor(value: str) -> tuple[datetime, int] | None:
+    """(run time, id) from a "before" cursor, or None if it is missing or malformed."""
+    run_time, _, log_id = value.rpartition("_")
+    try:
+        return datetime.fromisoformat(run_time), int(log_id)
+    except ValueError:
+        return None
 
 
 @main_bp.route("/task/<int:task_id>")
 def task_detail(task_id):
     task = Task.query.get_or_404(task_id)
-    logs = task.logs.order_by(TaskLog.run_time.desc()).limit(20).all()
-    return render_template("task_detail.html", task=task, logs=logs)
+    # Keyset pagination: "?before=<run time>_<id>" continues after that row
+    query = (task.logs.options(db.selectinload(TaskLog.phases))
+             .order_by(TaskLog.run_time.desc(), TaskLog.id.desc()))
+    before = _log_cursor(request.args.get("before", ""))
+    if before:
+        run_time, log_id = before
+        query = query.filter(db.or_(TaskLog.run_time < run_time,
+                                    db.and_(TaskLog.run_time == run_time, TaskLog.id < log_id)))
+    logs = query.limit(TASK_LOG_PAGE_SIZE + 1).all()
+    older = None
+    if len(logs) > TASK_LOG_PAGE_SIZE:
+        logs  = logs[:TASK_LOG_PAGE_SIZE]
+        older = f"{logs[-1].run_time.isoformat()}_{logs[-1].id}"
+    # Daily totals of the runs dashboard.retention pruned
+    days = (TaskLogDay.query.filter_by(task_id=task.id)
+            .order_by(TaskLogDay.day.desc()).limit(TASK_LOG_PAGE_SIZE).all())
+    # Only the inputs of this task's report step, for its default offset
+    step = STEPS_BY_FUNCTION.get(task.function_name)
+    return render_template("task_detail.html", task=task, logs=logs,
+                           older=older, paged=bool(before), days=days,
+                           active_jobs=jobs.active_jobs(task.id),
+                           missing=missing_inputs(task.default_offset, [step]) if step else {},
+                           missing_month=target_date(task.default_offset).strftime("%B %Y"))
 
 
 @main_bp.route("/task/<int:task_id>/run", methods=["POST"])
@@ -35,8 +94,10 @@ def task_run_now(task_id):
     except ValueError:
         offset = task.default_offset
 
-    status, message, _ = run_task_by_id(task.id, offset=offset)
-    flash(f"“{task.name}” has been queued (offset={offset}).", "success")
+    force = bool(request.form.get("force"))
+    job = jobs.enqueue("task", task_id=task.id, offset=offset, force=force)
+    flash(f"“{task.name}” has been queued as job #{job.id} "
+          f"(offset={offset}{', forced rebuild' if force else ''}).", "success")
     return redirect(url_for("main.task_detail", task_id=task.id))
 
 
@@ -51,13 +112,30 @@ def task_toggle_enabled(task_id):
     return redirect(url_for("main.index"))
 
 
+@main_bp.route("/task/<int:task_id>/watch", methods=["POST"])
+def task_toggle_watch(task_id):
+    """Turn the file-arrival trigger (dashboard.triggers) on or off."""
+    task = Task.query.get_or_404(task_id)
+    task.watch_inputs = not task.watch_inputs
+    db.session.commit()
+    schedule_all_tasks()
+    if task.watch_inputs:
+        flash(f"“{task.name}” will also run as soon as its inputs are on the share.", "info")
+    else:
+        flash(f"“{task.name}” now only runs on its schedule.", "info")
+    return redirect(url_for("main.task_detail", task_id=task.id))
+
+
 # ← Make sure this exact route exists:
 @main_bp.route("/task/<int:task_id>/clear_logs", methods=["POST"])
 def task_clear_logs(task_id):
     """
-    Delete all logs for a given task, but keep the task itself.
+    Delete all logs (and daily totals) for a given task, but keep the task itself.
     """
+    logs = db.select(TaskLog.id).where(TaskLog.task_id == task_id)
+    TaskLogPhase.query.filter(TaskLogPhase.log_id.in_(logs)).delete(synchronize_session=False)
     TaskLog.query.filter_by(task_id=task_id).delete()
+    TaskLogDay.query.filter_by(task_id=task_id).delete()
     db.session.commit()
     flash("Logs cleared for this task.", "warning")
     return redirect(url_for("main.task_detail", task_id=task_id))
@@ -66,12 +144,11 @@ def task_clear_logs(task_id):
 @main_bp.route("/run_all", methods=["POST"])
 def run_all_tasks():
     """
-    Trigger every enabled task sequentially. Each task is executed via
-    ``run_task_by_id`` so individual results are logged in the database.
-    After all tasks finish, send one consolidated email if any files were
-    generated.
+    Queue a job that runs every enabled task (see dashboard.jobs), sends
+    one consolidated email if any files were generated and, with
+    POLL_FOR_REPLY, waits for the approval reply.
     """
-    # 1) Determine offset from form
+    # Determine offset from form
     try:
         offset = int(request.form.get("offset", 1))
         if offset < 1:
@@ -79,57 +156,107 @@ def run_all_tasks():
     except ValueError:
         offset = 1
 
-    # 2) Run each enabled task and collect generated file paths
-    all_generated_files = []
-    for task in Task.query.filter_by(enabled=True).order_by(Task.id).all():
-        status, message, files = run_task_by_id(task.id, offset=offset)
-        if files:
-            all_generated_files.extend(files)
-
-    # 3) If any files came back, send one email with all attachments
-    if all_generated_files:
-        # Build subject/body exactly as you did in your original script
-        from datetime import datetime, timedelta
-        from config import APP_TIMEZONE
-
-        d = datetime.now(APP_TIMEZONE).replace(day=1) - timedelta(days=1)
-        mmyy = d.strftime("%B %Y")
-        subject = f"Monthly NEA Reports – {mmyy}"
-        body = (
-            f"Attached are all updated NEA workbooks for {mmyy}.\n\n"
-            "May I proceed with submission? Reply with yes/no."
-        )
-
-        try:
-            send_time = datetime.now(APP_TIMEZONE)
-            msgid = send_email(subject, body, all_generated_files)
-            flash(
-                f"Run All complete—email sent with {len(all_generated_files)} attachments.",
-                "success"
-            )
-            if POLL_FOR_REPLY:
-                result = wait_reply(
-                    ["yes", "approved", "proceed", "go", "go ahead"],
-                    ["no", "abort", "cancel", "stop"],
-                    after=send_time,
-                    thread_msgid=msgid,
-                )
-                if result == "yes":
-                    send_simple(
-                        f"Re: {subject}",
-                        "Approval received. Proceeding with submission of the files.",
-                        reply_to_msgid=msgid,
-                    )
-                elif result == "no":
-                    send_simple(
-                        f"Re: {subject}",
-                        "Process aborted per reply.",
-                        reply_to_msgid=msgid,
-                    )
-        except Exception as e:
-            flash(f"Email sending failed: {e}", "danger")
-    else:
-        # No files were generated by any of the individual tasks
-        flash("Run All complete—no files were generated, so no email was sent.", "warning")
+    force = bool(request.form.get("force"))
+    job = jobs.enqueue("run_all", offset=offset, force=force)
+    flash(f"Run All has been queued as job #{job.id} "
+          f"(offset={offset}{', forced rebuild' if force else ''}).", "success")
+    return redirect(url_for("main.index"))
+
+
+def _backfill_range(first: str, last: str) -> tuple[int, int]:
+    """
+    (offset of the newest month, number of months) for the "YYYY-MM"
+    range first..last. Raises ValueError for a bad or future range.
+    """
+    try:
+        oldest = offset_for(*map(int, first.split("-")))
+        newest = offset_for(*map(int, last.split("-")))
+    except (TypeError, ValueError):
+        raise ValueError("Months must be given as YYYY-MM.")
+    if newest < 1:
+        raise ValueError(f"The newest month can be {target_date(1):%Y-%m} at the latest.")
+    if oldest < newest:
+        raise ValueError("The first month must not be after the last one.")
+    if oldest - newest + 1 > BACKFILL_MAX_MONTHS:
+        raise ValueError(f"A backfill covers at most {BACKFILL_MAX_MONTHS} months.")
+    return newest, oldest - newest + 1
+
+@main_bp.route("/backfill", methods=["POST"])
+def backfill():
+    """
+    Queue a job that regenerates every enabled task for a month range,
+    oldest first (see dashboard.jobs).
+    """
+    try:
+        offset, months = _backfill_range(request.form.get("first", ""), request.form.get("last", ""))
+    except ValueError as e:
+        flash(str(e), "danger")
+        return redirect(url_for("main.index"))
+
+    force = bool(request.form.get("force"))
+    job = jobs.enqueue("backfill", offset=offset, months=months, force=force)
+    flash(f"Backfill of {months} month(s) from {request.form['first']} to {request.form['last']} "
+          f"has been queued as job #{job.id}{' (forced rebuild)' if force else ''}.", "success")
+    return redirect(url_for("main.index"))
+
+@main_bp.route("/api/backfill", methods=["POST"])
+def api_backfill():
+    """JSON version of /backfill: {"first": "YYYY-MM", "last": "YYYY-MM", "force": false}."""
+    data = request.get_json(silent=True) or {}
+    try:
+        offset, months = _backfill_range(str(data.get("first", "")), str(data.get("last", "")))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    job = jobs.enqueue("backfill", offset=offset, months=months, force=bool(data.get("force")))
+    return jsonify(job.to_dict()), 202, {"Location": url_for("main.job_status", job_id=job.id)}
+
+
+@main_bp.route("/api/status")
+def api_status():
+    """
+    Tasks (last run, last status, next run) and active jobs as JSON,
+    from the status cache. Answers 304 when ``If-None-Match`` has the
+    current ETag.
+    """
+    snap = status_cache.snapshot(current_app.config["SCHEDULER"])
+    response = current_app.response_class(snap.body, mimetype="application/json")
+    response.set_etag(snap.etag)
+    # Browsers may keep it, but must revalidate every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@main_bp.route("/metrics")
+def prometheus_metrics():
+    """Run event counters and phase/run duration histograms (see metrics.py) for Prometheus."""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@main_bp.route("/jobs/<int:job_id>")
+def job_status(job_id):
+    return jsonify(Job.query.get_or_404(job_id).to_dict())
+
+
+@main_bp.route("/jobs/<int:job_id>/events")
+def job_events(job_id):
+    """
+    Server-sent events: one ``data:`` line with the job as JSON whenever
+    it changes, until it finishes.
+    """
+    Job.query.get_or_404(job_id)
+
+    def stream():
+        last = None
+        while True:
+            db.session.expire_all()
+            job = db.session.get(Job, job_id)
+            state = job.to_dict()
+            if state != last:
+                last = state
+                yield f"data: {json.dumps(state)}\n\n"
+            if job.finished:
+                return
+            time.sleep(JOB_EVENTS_INTERVAL_SEC)
 
-    return redirect(url_for("main.index"))
\ No newline at end of file
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,128 @@
+# erc_ingest.py
+
+"""
+Ingest stage for the ERC PLANNED/UNPLANNED interruption workbooks.
+
+``load(path)`` returns one file's cleaned interruption rows: "Totals"
+rows are removed, incomplete rows are dropped, and the first column is
+parsed as a ``%m/%d/%y`` date. The first time a file is seen it is
+parsed and cleaned. The result is stored in ``ERC_CACHE_DIR`` under the
+file's SHA-256. Later runs, other offsets and retries reading the same
+file load the stored frame instead, which takes milliseconds.
+
+Frames are stored as Parquet (columnar; pyarrow is in requirements.txt)
+and fall back to a pickle when pyarrow isn't installed or a column has
+mixed types. Parsing uses the Rust ``calamine`` engine when
+python-calamine is installed (``ERC_EXCEL_ENGINE=auto``), otherwise
+openpyxl. The banner rows above the headers are skipped
+(``ERC_SKIPROWS``) and only the table's columns are read
+(``ERC_USECOLS``, ``A:K`` by default), every one as ``object`` so values
+keep the type the workbook stored; a file narrower than that range is
+rejected rather than silently shifting the report's columns.
+
+Each file is cleaned on its own, before the PLANNED and UNPLANNED frames
+are concatenated; ``nea_reports.process_interruption`` checks that both
+have the same columns, which makes that the same as cleaning the concat.
+"""
+
+import hashlib
+import importlib.util
+import os
+import pickle
+
+import pandas as pd
+
+import run_stats
+from pdf_render import file_digest
+
+ERC_CACHE_DIR    = os.environ.get(
+    "ERC_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "erc_cache"),
+)
+ERC_EXCEL_ENGINE = os.environ.get("ERC_EXCEL_ENGINE", "auto").lower()
+# Rows above the column headers in the ERC export
+ERC_SKIPROWS     = int(os.environ.get("ERC_SKIPROWS", "11"))
+# Excel column range of the interruption table: the 11 columns written to
+# B:G and I:M of the report's "interruption" sheet ("" reads every column)
+ERC_USECOLS      = os.environ.get("ERC_USECOLS", "A:K") or None
+
+# Bump when parse() or clean() changes, so frames cached by an older version are rebuilt
+VERSION = 3
+# Cache entries are also keyed by the settings that shape the frame
+_SETTINGS = hashlib.sha256(repr((VERSION, ERC_SKIPROWS, ERC_USECOLS)).encode()).hexdigest()[:12]
+
+_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+
+def engine() -> str | None:
+    """The read_excel engine: "calamine" if available (or asked for), else pandas' default."""
+    if ERC_EXCEL_ENGINE == "auto":
+        return "calamine" if importlib.util.find_spec("python_calamine") else None
+    return None if ERC_EXCEL_ENGINE in ("", "default") else ERC_EXCEL_ENGINE
+
+def parse(path: str) -> pd.DataFrame:
+    """Read the interruption table of one ERC workbook, as exported."""
+    try:
+        # Every column is kept as read (object): the date column reaches clean() as
+        # text or Excel dates, and the others are written to the report unchanged,
+        # without pandas guessing a numeric or string dtype per file
+        return pd.read_excel(path, skiprows=ERC_SKIPROWS, usecols=ERC_USECOLS,
+                             dtype=object, engine=engine())
+    except pd.errors.ParserError as e:
+        raise ValueError(f"{os.path.basename(path)} doesn't have the columns "
+                         f"{ERC_USECOLS} (ERC_USECOLS): {e}") from e
+
+def clean(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop "Totals" and incomplete rows and parse the date column."""
+    df = df[~df.iloc[:,0].astype(str).str.contains("Totals", na=False)].dropna()
+    # Replace the column rather than assign into it, which pandas 3's str dtype rejects
+    date = df.columns[0]
+    df[date] = pd.to_datetime(df[date], format="%m/%d/%y", errors="coerce")
+    return df
+
+
+def _cache_path(digest: str) -> str:
+    return os.path.join(ERC_CACHE_DIR, f"{digest}-{_SETTINGS}")
+
+def _read_cached(base: str) -> pd.DataFrame | None:
+    if _PARQUET and os.path.exists(base + ".parquet"):
+        return pd.read_parquet(base + ".parquet")
+    if os.path.exists(base + ".pkl"):
+        with open(base + ".pkl", "rb") as f:
+            return pickle.load(f)
+    return None
+
+def _write_cached(base: str, df: pd.DataFrame) -> None:
+    os.makedirs(ERC_CACHE_DIR, exist_ok=True)
+    if _PARQUET:
+        try:
+            df.to_parquet(base + ".parquet.tmp", index=True)
+            os.replace(base + ".parquet.tmp", base + ".parquet")
+            return
+        except (TypeError, ValueError, ImportError) as e:
+            # e.g. a column mixing numbers and text, which Arrow won't store
+            print(f"Storing {os.path.basename(base)} as a pickle: {e}")
+            if os.path.exists(base + ".parquet.tmp"):
+                os.remove(base + ".parquet.tmp")
+    with open(base + ".pkl.tmp", "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(base + ".pkl.tmp", base + ".pkl")
+
+
+@run_stats.timed("source read")
+def load(path: str) -> pd.DataFrame:
+    """The cleaned interruption rows of the ERC workbook at ``path``."""
+    base = _cache_path(file_digest(path))
+    try:
+        df = _read_cached(base)
+    except Exception as e:
+        print(f"Ignoring unreadable ERC cache entry for {os.path.basename(path)}: {e}")
+        df = None
+    if df is not None:
+        run_stats.incr("erc cache hits")
+        return df
+
+    run_stats.incr("erc cache misses")
+    df = clean(parse(path))
+    _write_cached(base, df)
+    return df
@@ -0,0 +1,489 @@
+# excel_session.py
+
+"""
+Pooled Excel sessions for the report steps.
+
+Starting Excel is the slowest part of a report run, so instead of every
+open/save creating its own ``xw.App`` the steps borrow an ``ExcelSession``
+from ``POOL``.  Nested borrows (e.g. the open/save calls of one step)
+reuse the session that is already active in the current context.
+
+Sessions are tied to the thread that started them (COM apartments are
+per-thread), so idle ones are kept per owning thread and a thread only
+gets its own back; the DAG's long-lived ``excel`` workers therefore keep
+one instance each across runs. They are recycled after
+``EXCEL_RECYCLE_AFTER`` workbooks, and a reaper thread quits the ones
+idle for ``EXCEL_IDLE_SEC`` or whose thread has ended. A session is
+discarded instead of returned to the pool when Excel itself failed
+(a COM error or ``ExcelError``) while it was borrowed, so a hung
+instance never gets handed out twice; errors in the caller's own code
+return it as usual.
+
+Set ``EXCEL_BACKEND=fake`` to use the in-process ``FakeApp`` instead of
+Excel, which makes the pool usable on machines without Office.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import run_stats
+
+try:
+    from pywintypes import com_error as _com_error
+except ImportError:
+    _com_error = None
+
+EXCEL_BACKEND        = os.environ.get("EXCEL_BACKEND", "xlwings")
+EXCEL_RECYCLE_AFTER  = int(os.environ.get("EXCEL_RECYCLE_AFTER", "25"))
+EXCEL_IDLE_SEC       = int(os.environ.get("EXCEL_IDLE_SEC", "300"))
+
+class ExcelError(RuntimeError):
+    """Excel itself failed (the fake backend's stand-in for a COM error)."""
+
+# Failures that leave an instance unusable, so its session is discarded
+EXCEL_ERRORS = (ExcelError,) if _com_error is None else (ExcelError, _com_error)
+
+_current: contextvars.ContextVar["ExcelSession | None"] = contextvars.ContextVar(
+    "excel_session", default=None
+)
+
+
+# ─────────── Cell references ───────────
+
+_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
+
+def col_to_index(letters: str) -> int:
+    """Convert a column name such as 'C' or 'AB' to a 1-based index."""
+    n = 0
+    for ch in letters.upper():
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def index_to_col(n: int) -> str:
+    """Convert a 1-based column index to its column name."""
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def parse_ref(ref: str | tuple[int, int]) -> tuple[int, int]:
+    """Return (row, col) for 'C3' or an existing (row, col) tuple."""
+    if isinstance(ref, tuple):
+        return ref
+    m = _REF_RE.match(ref.strip().upper())
+    if not m:
+        raise ValueError(f"Invalid cell reference: {ref!r}")
+    return int(m.group(2)), col_to_index(m.group(1))
+
+
+# ─────────── Fake in-process backend ───────────
+
+class _FakeRange:
+    def __init__(self, sheet: "_FakeSheet", first: tuple[int, int], last: tuple[int, int]):
+        self.sheet, self.first, self.last = sheet, first, last
+
+    @property
+    def value(self):
+        (r1, c1), (r2, c2) = self.first, self.last
+        if (r1, c1) == (r2, c2):
+            return self.sheet.cells.get((r1, c1))
+        return [[self.sheet.cells.get((r, c)) for c in range(c1, c2 + 1)]
+                for r in range(r1, r2 + 1)]
+
+    @value.setter
+    def value(self, val):
+        r1, c1 = self.first
+        if isinstance(val, (list, tuple)):
+            rows = val if val and isinstance(val[0], (list, tuple)) else [val]
+            for i, row in enumerate(rows):
+                for j, v in enumerate(row):
+                    self.sheet.cells[(r1 + i, c1 + j)] = v
+        else:
+            self.sheet.cells[(r1, c1)] = val
+
+    @property
+    def row(self) -> int:
+        return self.first[0]
+
+    @property
+    def column(self) -> int:
+        return self.first[1]
+
+    @property
+    def last_cell(self) -> "_FakeRange":
+        return _FakeRange(self.sheet, self.last, self.last)
+
+    def clear_contents(self):
+        (r1, c1), (r2, c2) = self.first, self.last
+        for key in [k for k in self.sheet.cells if r1 <= k[0] <= r2 and c1 <= k[1] <= c2]:
+            del self.sheet.cells[key]
+
+
+class _FakeSheet:
+    def __init__(self, name: str):
+        self.name  = name
+        self.cells: dict[tuple[int, int], object] = {}
+
+    @property
+    def used_range(self) -> _FakeRange:
+        rows = [r for r, _ in self.cells] or [1]
+        cols = [c for _, c in self.cells] or [1]
+        return _FakeRange(self, (1, 1), (max(rows), max(cols)))
+
+    def range(self, first, last=None) -> _FakeRange:
+        if isinstance(first, str) and ":" in first:
+            first, last = first.split(":")
+        start = parse_ref(first)
+        return _FakeRange(self, start, parse_ref(last) if last else start)
+
+
+class _FakeSheets:
+    def __init__(self, book: "_FakeBook"):
+        self._book = book
+
+    def __getitem__(self, key) -> _FakeSheet:
+        if isinstance(key, int):
+            return self._book._sheets[key]
+        for sh in self._book._sheets:
+            if sh.name == key:
+                return sh
+        raise KeyError(key)
+
+    def __len__(self):
+        return len(self._book._sheets)
+
+    def add(self, name: str, after: _FakeSheet | None = None) -> _FakeSheet:
+        sh  = _FakeSheet(name)
+        idx = self._book._sheets.index(after) + 1 if after else 0
+        self._book._sheets.insert(idx, sh)
+        return sh
+
+
+class _FakeBook:
+    def __init__(self, app: "FakeApp", path: str | None = None):
+        self.app      = app
+        self.fullname = path
+        self._sheets: list[_FakeSheet] = []
+        self.sheets   = _FakeSheets(self)
+        if path:
+            with open(path, "r", encoding="utf-8") as f:
+                for name, cells in json.load(f).items():
+                    sh = _FakeSheet(name)
+                    sh.cells = {parse_ref(ref): v for ref, v in cells.items()}
+                    self._sheets.append(sh)
+        else:
+            self._sheets.append(_FakeSheet("Sheet1"))
+
+    def save(self, path: str | None = None):
+        path = path or self.fullname
+        data = {
+            sh.name: {f"{index_to_col(c)}{r}": v for (r, c), v in sorted(sh.cells.items())}
+            for sh in self._sheets
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=str, indent=1)
+        self.fullname = path
+
+    def close(self):
+        if self in self.app.books._open:
+            self.app.books._open.remove(self)
+
+
+class _FakeBooks:
+    def __init__(self, app: "FakeApp"):
+        self._app  = app
+        self._open: list[_FakeBook] = []
+
+    def add(self) -> _FakeBook:
+        wb = _FakeBook(self._app)
+        self._open.append(wb)
+        return wb
+
+    def open(self, path: str) -> _FakeBook:
+        if not self._app.alive:
+            raise ExcelError("Excel is not running")
+        if not os.path.exists(path):
+            raise FileNotFoundError(2, "No such file", path)
+        wb = _FakeBook(self._app, path)
+        self._open.append(wb)
+        return wb
+
+    def __len__(self):
+        return len(self._open)
+
+
+class FakeApp:
+    """
+    Minimal stand-in for ``xlwings.App``. Workbooks are kept in memory and
+    saved as JSON, which is enough to exercise the pool and the report
+    steps without Excel.
+    """
+    started = 0
+
+    def __init__(self):
+        FakeApp.started += 1
+        self.books           = _FakeBooks(self)
+        self.display_alerts  = True
+        self.screen_updating = True
+        self.calculation     = "automatic"
+        self.alive           = True
+
+    def quit(self):
+        self.alive = False
+
+    def kill(self):
+        self.alive = False
+
+
+# CoInitialize calls made on this thread by _xlwings_app and not yet undone
+_com = threading.local()
+
+def _xlwings_app():
+    import xlwings as xw
+    try:
+        import pythoncom
+    except ImportError:
+        return xw.App(visible=False, add_book=False)
+    pythoncom.CoInitialize()
+    try:
+        app = xw.App(visible=False, add_book=False)
+    except BaseException:
+        pythoncom.CoUninitialize()
+        raise
+    _com.depth = getattr(_com, "depth", 0) + 1
+    return app
+
+def _com_release() -> None:
+    """Balance one CoInitialize made by ``_xlwings_app`` on this thread."""
+    if getattr(_com, "depth", 0):
+        import pythoncom
+        _com.depth -= 1
+        pythoncom.CoUninitialize()
+
+def _default_factory():
+    return FakeApp() if EXCEL_BACKEND == "fake" else _xlwings_app()
+
+
+# ─────────── Sessions & pool ───────────
+
+class ExcelSession:
+    """
+    One Excel instance that opens workbooks with screen updating and
+    automatic recalculation switched off, and restarts itself after
+    ``recycle_after`` workbooks.
+    """
+
+    def __init__(self, factory, recycle_after: int = EXCEL_RECYCLE_AFTER):
+        self._factory      = factory
+        self.recycle_after = recycle_after
+        self.thread        = threading.current_thread()
+        self.books_opened  = 0
+        self.last_used     = time.monotonic()
+        self._app          = None
+
+    @property
+    def app(self):
+        if self._app is None:
+            with run_stats.span("excel startup"):
+                self._app = self._factory()
+            self._app.display_alerts  = False
+            self._app.screen_updating = False
+            self.books_opened = 0
+        return self._app
+
+    @contextmanager
+    def open(self, path: str, save: bool = True):
+        """
+        Open ``path`` and yield the workbook. Calculation is manual while
+        the caller writes and is switched back on right before saving.
+        With ``save=False`` the workbook is closed without saving.
+        """
+        app = self.app
+        with run_stats.span("workbook open"):
+            wb = app.books.open(path)
+        try:
+            app.calculation = "manual"
+            with run_stats.span("workbook write"):
+                yield wb
+            if save:
+                with run_stats.span("save"):
+                    app.calculation = "automatic"
+                    wb.save()
+            else:
+                app.calculation = "automatic"
+        finally:
+            wb.close()
+            self._book_done()
+
+    def create(self, path: str, sheet_names: list[str]) -> None:
+        """Create a new workbook at ``path`` containing ``sheet_names``."""
+        wb = self.app.books.add()
+        try:
+            wb.sheets[0].name = sheet_names[0]
+            prev = wb.sheets[0]
+            for name in sheet_names[1:]:
+                prev = wb.sheets.add(name, after=prev)
+            wb.save(path)
+        finally:
+            wb.close()
+            self._book_done()
+
+    def _book_done(self):
+        self.last_used = time.monotonic()
+        self.books_opened += 1
+        if self.books_opened >= self.recycle_after:
+            self.close()
+
+    def close(self, kill: bool = False):
+        """
+        Quit the Excel instance (if one is running). From any thread but
+        the owner, only ``kill`` works: COM calls can't cross apartments.
+        """
+        app, self._app = self._app, None
+        self.books_opened = 0
+        if app is None:
+            return
+        try:
+            app.kill() if kill else app.quit()
+        except Exception:
+            try:
+                app.kill()
+            except Exception:
+                pass
+        if self.thread is threading.current_thread():
+            _com_release()
+
+
+class ExcelPool:
+    """
+    Hands out ``ExcelSession`` objects. Idle sessions are kept per owning
+    thread; a reaper thread quits them once they have been idle for
+    ``idle_sec`` seconds or their thread has ended.
+    """
+
+    def __init__(self, factory=None, recycle_after: int = EXCEL_RECYCLE_AFTER,
+                 idle_sec: int = EXCEL_IDLE_SEC):
+        self.factory       = factory or _default_factory
+        self.recycle_after = recycle_after
+        self.idle_sec      = idle_sec
+        self._lock         = threading.Lock()
+        self._idle: dict[threading.Thread, list[ExcelSession]] = {}
+        self._live: list[ExcelSession] = []
+        self._stop         = threading.Event()
+        self._reaper: threading.Thread | None = None
+
+    def _acquire(self) -> ExcelSession:
+        thread = threading.current_thread()
+        with self._lock:
+            self._start_reaper()
+            idle = self._idle.get(thread)
+            if idle:
+                sess = idle.pop()
+                if not idle:
+                    del self._idle[thread]
+                return sess
+            sess = ExcelSession(self.factory, self.recycle_after)
+            self._live.append(sess)
+            return sess
+
+    def _release(self, sess: ExcelSession):
+        with self._lock:
+            if sess in self._live:
+                self._idle.setdefault(sess.thread, []).append(sess)
+
+    def _discard(self, sess: ExcelSession, kill: bool = False):
+        sess.close(kill=kill)
+        with self._lock:
+            if sess in self._live:
+                self._live.remove(sess)
+
+    @contextmanager
+    def borrow(self):
+        """
+        Yield an ``ExcelSession``. If one is already borrowed in this
+        context and thread it is reused, so a step's open and save calls
+        share one instance.
+        """
+        active = _current.get()
+        if active is not None and active.thread is threading.current_thread():
+            yield active
+            return
+
+        sess   = self._acquire()
+        token  = _current.set(sess)
+        broken = False
+        try:
+            yield sess
+        except EXCEL_ERRORS:
+            broken = True
+            self._discard(sess, kill=True)
+            raise
+        finally:
+            _current.reset(token)
+            if not broken:
+                self._release(sess)
+
+    def reap(self) -> int:
+        """
+        Quit the idle sessions that have been unused for ``idle_sec`` or
+        whose thread has ended. Returns how many were quit.
+        """
+        now   = time.monotonic()
+        stale = []
+        with self._lock:
+            for thread, idle in list(self._idle.items()):
+                alive = thread.is_alive()
+                keep  = [s for s in idle if alive and now - s.last_used <= self.idle_sec]
+                stale.extend(s for s in idle if s not in keep)
+                if keep:
+                    self._idle[thread] = keep
+                else:
+                    del self._idle[thread]
+        for sess in stale:
+            # Never on the owning thread, so kill rather than quit over COM
+            self._discard(sess, kill=True)
+        return len(stale)
+
+    def _start_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._stop.clear()
+            self._reaper = threading.Thread(target=self._reap_loop, name="excel-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(max(self.idle_sec / 4, 0.05)):
+            try:
+                self.reap()
+            except Exception:
+                traceback.print_exc()
+
+    def live_count(self) -> int:
+        """Sessions started by this pool and not yet quit (borrowed or idle)."""
+        with self._lock:
+            return len(self._live)
+
+    def shutdown(self):
+        """Quit every Excel instance started by this pool and stop the reaper."""
+        self._stop.set()
+        with self._lock:
+            live, self._live = self._live, []
+            self._idle = {}
+        for sess in live:
+            # Sessions owned by other threads can't be quit over COM
+            sess.close(kill=sess.thread is not threading.current_thread())
+
+
+POOL = ExcelPool()
+atexit.register(POOL.shutdown)
+
+def excel_session():
+    """Borrow a session from the shared ``POOL``."""
+    return POOL.borrow()
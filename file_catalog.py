@@ -0,0 +1,261 @@
+# file_catalog.py
+
+"""
+In-memory catalog of the BASE_NEA and BASE_ERC trees.
+
+The report steps used to probe the network share for every file, with
+``os.path.exists`` and ``glob.glob``. Each probe is an SMB round-trip.
+``Catalog`` instead lists each directory once (``os.scandir`` returns
+sizes and mtimes with the listing, so no per-file ``stat`` is needed)
+and answers ``exists()``, ``glob()`` and ``lookup()`` from memory.
+
+``refresh()`` keeps it current incrementally. It stats each known
+directory and re-lists only the ones whose mtime changed, because adding,
+removing or renaming a file updates its folder's mtime. The steps
+refresh once at their start. Other lookups refresh when the last refresh
+is older than ``CATALOG_REFRESH_SEC``. Files the steps write themselves
+are added with ``add()`` straight away. A file rewritten in place (or
+still being copied) changes its size and mtime but not its folder's, so
+callers that need current sizes and mtimes, the build manifest and the
+file triggers, ``rescan()`` the folders of those files first: one
+listing per folder instead of one ``stat`` per file.
+
+Files are also indexed by (kind, year, month), where kind is a report
+prefix ("NGCP Bill"), a supporting document name ("17MW.pdf") or
+"ERC PLANNED"/"ERC UNPLANNED"; the interruption step finds its ERC
+files with ``lookup()``. Directories are scanned at most
+``CATALOG_MAX_DEPTH`` levels below each root. Paths outside the roots
+fall through to the filesystem.
+"""
+
+import fnmatch
+import glob as _glob
+import os
+import re
+import threading
+import time
+
+CATALOG_REFRESH_SEC = float(os.environ.get("CATALOG_REFRESH_SEC", "30"))
+CATALOG_MAX_DEPTH   = int(os.environ.get("CATALOG_MAX_DEPTH", "3"))
+
+_MONTH_FOLDER = re.compile(r"^(\d{2})\. [A-Za-z]{3} (\d{4})$")          # "09. SEP 2025"
+_REPORT       = re.compile(r"^(.+)-(\d{4})(\d{2})01-V1\.xlsx?$", re.I)  # "<prefix>-20250901-V1.xls"
+_ERC_FOLDER   = re.compile(r"^(\d{4}) POWER INTERRUPTIONS$", re.I)
+_ERC_MONTH    = re.compile(r"(\d{2})_[A-Za-z]+")
+
+
+def _key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class Catalog:
+    def __init__(self, nea_root: str, erc_root: str):
+        self.nea_root = os.path.abspath(nea_root)
+        self.erc_root = os.path.abspath(erc_root)
+        self._lock    = threading.RLock()
+        # dir key -> (dir path, dir mtime_ns, {name: (path, size, mtime_ns) for files})
+        self._dirs: dict[str, tuple[str, int, dict[str, tuple[str, int, int]]]] = {}
+        self._index: dict[tuple[str, int, int], set[str]] = {}
+        self._refreshed = 0.0
+
+    # ─────────── Scanning ───────────
+
+    def _roots(self) -> list[str]:
+        return [self.nea_root, self.erc_root]
+
+    def _depth(self, path: str) -> int | None:
+        """Levels below the root containing ``path``, or None outside both roots."""
+        k = _key(path)
+        for root in self._roots():
+            r = _key(root)
+            if k == r:
+                return 0
+            if k.startswith(r.rstrip(os.sep) + os.sep):
+                return k[len(r):].strip(os.sep).count(os.sep) + 1
+        return None
+
+    def _classify(self, path: str) -> tuple[str, int, int] | None:
+        """(kind, year, month) of a file, if it is one the steps read or write."""
+        name = os.path.basename(path)
+        for root in self._roots():
+            rel = os.path.relpath(path, root)
+            if rel.startswith(".."):
+                continue
+            parts = rel.split(os.sep)
+            if root == self.erc_root and len(parts) == 2 and _ERC_FOLDER.match(parts[0]):
+                m = _ERC_MONTH.search(name)
+                if m and name.lower().endswith(".xlsx"):
+                    kind = "ERC UNPLANNED" if "UNPLANNED" in name.upper() else "ERC PLANNED"
+                    return kind, int(_ERC_FOLDER.match(parts[0]).group(1)), int(m.group(1))
+            if root == self.nea_root and len(parts) >= 3:
+                folder = _MONTH_FOLDER.match(parts[1])
+                if not folder:
+                    continue
+                month, year = int(folder.group(1)), int(folder.group(2))
+                if len(parts) == 3:
+                    m = _REPORT.match(name)
+                    if m:
+                        return m.group(1), int(m.group(2)), int(m.group(3))
+                elif len(parts) == 4 and parts[2].upper() == "SUPPORTING DOCS":
+                    return name, year, month
+        return None
+
+    def _index_file(self, path: str, add: bool) -> None:
+        cls = self._classify(path)
+        if cls is None:
+            return
+        paths = self._index.setdefault(cls, set())
+        if add:
+            paths.add(path)
+        else:
+            paths.discard(path)
+
+    def _list(self, path: str) -> None:
+        """(Re-)list one directory, recursing into subdirectories within the depth limit."""
+        key   = _key(path)
+        depth = self._depth(path) or 0
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            self._forget(key)
+            return
+
+        old = self._dirs.get(key, (path, 0, {}))[2]
+        files, subdirs = {}, []
+        for e in entries:
+            try:
+                if e.is_dir():
+                    subdirs.append(e.path)
+                elif e.is_file():
+                    st = e.stat()
+                    files[e.name] = (e.path, st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        for name, (p, _, _) in old.items():
+            if name not in files:
+                self._index_file(p, add=False)
+        for name, (p, _, _) in files.items():
+            if name not in old:
+                self._index_file(p, add=True)
+        self._dirs[key] = (path, mtime, files)
+
+        # Subdirectories that disappeared
+        prefix = key.rstrip(os.sep) + os.sep
+        gone = {k for k in self._dirs if k.startswith(prefix) and k[len(prefix):].count(os.sep) == 0}
+        gone -= {_key(p) for p in subdirs}
+        for k in gone:
+            self._forget(k)
+        if depth < CATALOG_MAX_DEPTH:
+            for p in subdirs:
+                if _key(p) not in self._dirs:
+                    self._list(p)
+
+    def _forget(self, key: str) -> None:
+        prefix = key.rstrip(os.sep) + os.sep
+        for k in [k for k in self._dirs if k == key or k.startswith(prefix)]:
+            for p, _, _ in self._dirs.pop(k)[2].values():
+                self._index_file(p, add=False)
+
+    def refresh(self, max_age: float = 0.0) -> None:
+        """
+        Re-list every directory whose mtime changed (one ``stat`` each),
+        unless the last refresh is younger than ``max_age`` seconds.
+        """
+        with self._lock:
+            if max_age and time.monotonic() - self._refreshed < max_age:
+                return
+            for root in self._roots():
+                if _key(root) not in self._dirs:
+                    self._list(root)
+            for key, (path, mtime, _) in list(self._dirs.items()):
+                if key not in self._dirs:
+                    continue   # dropped with a parent re-listed earlier in this pass
+                try:
+                    changed = os.stat(path).st_mtime_ns != mtime
+                except OSError:
+                    self._forget(key)
+                    continue
+                if changed:
+                    self._list(path)
+            self._refreshed = time.monotonic()
+
+    def rescan(self, paths: list[str]) -> None:
+        """
+        Re-list the folders holding ``paths`` (wildcards allowed in the
+        file name) now, whether or not their mtime changed.
+        """
+        with self._lock:
+            for directory in {os.path.dirname(os.path.abspath(p)) for p in paths}:
+                depth = None if _glob.has_magic(directory) else self._depth(directory)
+                if depth is not None and depth <= CATALOG_MAX_DEPTH:
+                    self._list(directory)
+
+    def add(self, path: str) -> None:
+        """Record a file the caller just wrote, without waiting for a refresh."""
+        if self._depth(path) is None:
+            return
+        path = os.path.abspath(path)
+        with self._lock:
+            parent = _key(os.path.dirname(path))
+            if parent not in self._dirs:
+                # A new folder: the refresh sees its parent's mtime change and lists it
+                self.refresh()
+                return
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            files = self._dirs[parent][2]
+            if os.path.basename(path) not in files:
+                self._index_file(path, add=True)
+            files[os.path.basename(path)] = (path, st.st_size, st.st_mtime_ns)
+
+    # ─────────── Lookups ───────────
+
+    def _listing(self, directory: str) -> dict[str, tuple[str, int, int]] | None:
+        """Files of ``directory`` from memory, or None if it isn't covered by the catalog."""
+        if self._depth(directory) is None:
+            return None
+        self.refresh(max_age=CATALOG_REFRESH_SEC)
+        with self._lock:
+            entry = self._dirs.get(_key(directory))
+        if entry is not None:
+            return entry[2]
+        # Inside a root but not listed: missing, or deeper than CATALOG_MAX_DEPTH
+        return {} if (self._depth(directory) or 0) <= CATALOG_MAX_DEPTH else None
+
+    def exists(self, path: str) -> bool:
+        """Whether the file ``path`` exists."""
+        files = self._listing(os.path.dirname(os.path.abspath(path)))
+        if files is None:
+            return os.path.exists(path)
+        return os.path.normcase(os.path.basename(path)) in {os.path.normcase(n) for n in files}
+
+    def stat(self, path: str) -> tuple[int, int] | None:
+        """(size, mtime_ns) of the file ``path`` as last listed, or None if missing."""
+        files = self._listing(os.path.dirname(os.path.abspath(path)))
+        if files is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            return st.st_size, st.st_mtime_ns
+        for name, (_, size, mtime) in files.items():
+            if os.path.normcase(name) == os.path.normcase(os.path.basename(path)):
+                return size, mtime
+        return None
+
+    def glob(self, pattern: str) -> list[str]:
+        """``glob.glob`` for a pattern whose wildcards are in the file name only."""
+        directory, name = os.path.split(os.path.abspath(pattern))
+        files = None if _glob.has_magic(directory) else self._listing(directory)
+        if files is None:
+            return _glob.glob(pattern)
+        return sorted(p for n, (p, _, _) in files.items() if fnmatch.fnmatch(n, name))
+
+    def lookup(self, kind: str, year: int, month: int) -> list[str]:
+        """Paths of the files of ``kind`` for a month, e.g. ("NGCP BILL.pdf", 2025, 9)."""
+        self.refresh(max_age=CATALOG_REFRESH_SEC)
+        with self._lock:
+            return sorted(self._index.get((kind, year, month), ()))
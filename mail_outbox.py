@@ -0,0 +1,470 @@
+# mail_outbox.py
+
+"""
+Outbound mail queue.
+
+``Outbox.enqueue()`` writes the message to a spool file, records it in
+the ``outbox`` table (SQLite, ``MAIL_OUTBOX_DB``) and returns its
+Message-ID straight away, so callers can thread replies before the mail
+has actually left. A background sender thread delivers queued messages
+over one authenticated SMTP connection, which stays open for
+``SMTP_IDLE_SEC`` so a Run All's report and follow-up mails share it.
+
+Attachments are never held in memory: ``enqueue()`` writes the MIME
+skeleton, then base64-encodes each file into the spool file chunk by
+chunk, and the sender streams the spool file into SMTP DATA line by line
+(dot-stuffed). A file listed twice (same name, same content) is attached
+once; files that only share their content keep their own names. With
+``MAIL_ZIP_ATTACHMENTS`` the files are deflated into one zip attachment
+instead. The raw, zipped and encoded sizes, and any files left out as
+duplicates, are stored with the message (``status()["attachments"]``) so
+callers can report them.
+
+Transient failures are retried with exponential backoff (``SMTP_RETRY_BASE_SEC``
+doubling, capped at 10 minutes) up to ``SMTP_MAX_ATTEMPTS``; permanent
+5xx replies fail the message at once, as does every recipient being
+refused with a 5xx (4xx refusals, e.g. greylisting, are retried). Other
+errors in the sender thread, such as a locked outbox database, are
+logged and retried after a backoff, so the thread keeps running.
+Messages still queued when the process stops are sent on the next start.
+
+``SMTP_HOST``/``SMTP_PORT``/``SMTP_SSL`` point it at another server, e.g.
+``python -m aiosmtpd -n -l localhost:1025`` with ``SMTP_SSL=False``.
+Login is skipped when the server doesn't offer AUTH.
+"""
+
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+import traceback
+import uuid
+import zipfile
+from email.message import EmailMessage, MIMEPart
+from email.generator import BytesGenerator
+from email.utils import getaddresses, make_msgid
+
+SMTP_HOST           = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_SSL            = os.environ.get("SMTP_SSL", "True").lower() in ("1", "true", "yes")
+SMTP_PORT           = int(os.environ.get("SMTP_PORT", "465" if SMTP_SSL else "25"))
+SMTP_MAX_ATTEMPTS   = int(os.environ.get("SMTP_MAX_ATTEMPTS", "8"))
+SMTP_RETRY_BASE_SEC = float(os.environ.get("SMTP_RETRY_BASE_SEC", "5"))
+# Keep the connection open this long after the last queued message
+SMTP_IDLE_SEC       = float(os.environ.get("SMTP_IDLE_SEC", "60"))
+# Send attachments as one deflated zip instead of separate files
+MAIL_ZIP_ATTACHMENTS = os.environ.get("MAIL_ZIP_ATTACHMENTS", "False").lower() in ("1", "true", "yes")
+
+_here          = os.path.dirname(os.path.abspath(__file__))
+MAIL_OUTBOX_DB = os.environ.get("MAIL_OUTBOX_DB", os.path.join(_here, "mail_outbox.sqlite"))
+MAIL_SPOOL_DIR = os.environ.get("MAIL_SPOOL_DIR", os.path.join(_here, "mail_spool"))
+
+# base64 turns every 57 input bytes into one 76-character line
+CHUNK = 57 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id      TEXT NOT NULL UNIQUE,
+    sender          TEXT NOT NULL,
+    recipients      TEXT NOT NULL,
+    subject         TEXT,
+    path            TEXT NOT NULL,
+    size            INTEGER NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'QUEUED',   -- QUEUED, SENT or FAILED
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error      TEXT,
+    attachments     TEXT,                             -- sizes and duplicates left out
+    created_at      REAL NOT NULL,
+    sent_at         REAL
+)
+"""
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def dedupe(paths: list[str]) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    ``paths`` without files that have the same name and content as an
+    earlier one, and the (dropped, kept) pairs that were left out. Equal
+    content under another name is kept: the recipient expects that name.
+    """
+    seen: dict[tuple[str, str], str] = {}
+    unique, dropped = [], []
+    for p in paths:
+        key = (os.path.normcase(os.path.basename(p)), file_digest(p))
+        if key in seen:
+            dropped.append((p, seen[key]))
+            continue
+        seen[key] = p
+        unique.append(p)
+    return unique, dropped
+
+def bundle(paths: list[str], dest: str) -> tuple[int, int]:
+    """
+    Deflate ``paths`` into the zip file ``dest`` (clashing names get a
+    numeric suffix). Returns (uncompressed, compressed) sizes in bytes.
+    """
+    names = set()
+    with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for p in paths:
+            stem, ext = os.path.splitext(os.path.basename(p))
+            name, n = stem + ext, 1
+            while name.lower() in names:
+                n += 1
+                name = f"{stem} ({n}){ext}"
+            names.add(name.lower())
+            zf.write(p, arcname=name)    # copies in chunks
+        infos = zf.infolist()
+    return sum(i.file_size for i in infos), sum(i.compress_size for i in infos)
+
+def write_message(msg: EmailMessage, attachments: list[tuple[str, str]], f) -> None:
+    """
+    Write ``msg`` with ``attachments`` ((path, filename) pairs) to the binary file ``f`` using CRLF
+    line endings. Each attachment part is flattened with a placeholder
+    body that is then replaced by the file's base64, encoded chunk by
+    chunk, so memory use doesn't grow with the attachment sizes.
+    """
+    markers = {}
+    if attachments:
+        msg.make_mixed()
+        for p, filename in attachments:
+            mime, _ = mimetypes.guess_type(filename)
+            part = MIMEPart(policy=msg.policy)
+            part["Content-Type"] = mime or "application/octet-stream"
+            part.add_header("Content-Disposition", "attachment", filename=filename)
+            part["Content-Transfer-Encoding"] = "base64"
+            marker = f"attachment-{uuid.uuid4().hex}"
+            part.set_payload(marker)
+            msg.attach(part)
+            markers[marker.encode()] = p
+
+    skeleton = io.BytesIO()
+    BytesGenerator(skeleton, policy=msg.policy.clone(linesep="\r\n")).flatten(msg)
+    rest = skeleton.getvalue()
+    for marker, p in markers.items():
+        head, rest = rest.split(marker, 1)
+        f.write(head)
+        with open(p, "rb") as src:
+            pending = b""
+            for chunk in iter(lambda: src.read(CHUNK), b""):
+                f.write(pending)
+                pending = base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+            # The skeleton already ends the placeholder line
+            f.write(pending[:-2])
+    f.write(rest)
+
+
+class Outbox:
+    def __init__(
+        self,
+        user: str,
+        password: str,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        use_ssl: bool = SMTP_SSL,
+        db_path: str = MAIL_OUTBOX_DB,
+        spool_dir: str = MAIL_SPOOL_DIR,
+    ):
+        self.user      = user
+        self.password  = password
+        self.host      = host
+        self.port      = port
+        self.use_ssl   = use_ssl
+        self.db_path   = db_path
+        self.spool_dir = spool_dir
+
+        self._lock   = threading.Lock()
+        self._wake   = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._ready  = False
+
+    def _connect_db(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute(_SCHEMA)
+                    # Outboxes created before the attachments column
+                    columns = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+                    if "attachments" not in columns:
+                        conn.execute("ALTER TABLE outbox ADD COLUMN attachments TEXT")
+                    conn.commit()
+                    self._ready = True
+        return conn
+
+    # ─────────── Public API ───────────
+
+    def enqueue(self, msg: EmailMessage, attachments: list[str] | None = None,
+                zip_name: str | None = None) -> str:
+        """
+        Spool ``msg`` for delivery and return its Message-ID. Files in
+        ``attachments`` are de-duplicated by name and content and streamed
+        into the message; with ``zip_name`` they go in one deflated zip of
+        that name.
+        The sizes and left-out duplicates are in ``status()["attachments"]``.
+        """
+        if not msg["Message-ID"]:
+            msg["Message-ID"] = make_msgid()
+        msg_id     = msg["Message-ID"]
+        recipients = [addr for _, addr in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", [])
+                                                      + msg.get_all("Bcc", []))]
+        del msg["Bcc"]
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, msg_id.strip("<>").replace("@", "_") + ".eml")
+        files, dropped = dedupe(attachments or [])
+        parts = [(p, os.path.basename(p)) for p in files]
+        sizes = f"{len(files)} attachments, {sum(os.path.getsize(p) for p in files)} bytes"
+        zipped = path + ".zip" if files and zip_name else None
+        try:
+            if zipped:
+                raw, packed = bundle(files, zipped)
+                parts = [(zipped, zip_name)]
+                sizes = f"{len(files)} attachments, {raw} bytes, {packed} bytes zipped"
+            with open(path + ".tmp", "wb") as f:
+                write_message(msg, parts, f)
+            os.replace(path + ".tmp", path)
+        finally:
+            if zipped and os.path.exists(zipped):
+                os.remove(zipped)
+        size = os.path.getsize(path)
+        report = None
+        if files:
+            report = f"{sizes}, {size} bytes encoded"
+            if dropped:
+                report += "; not attached, listed twice: " + ", ".join(
+                    f"{os.path.basename(p)} (= {os.path.basename(kept)})" for p, kept in dropped
+                )
+            print(f"Email '{msg['Subject']}': {report}")
+
+        now  = time.time()
+        conn = self._connect_db()
+        try:
+            conn.execute(
+                "INSERT INTO outbox (message_id, sender, recipients, subject, path, size, "
+                "attachments, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (msg_id, msg["From"], ",".join(recipients), msg["Subject"], path,
+                 size, report, now, now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.start()
+        return msg_id
+
+    def start(self) -> None:
+        """Start the sender thread (also picks up mail left from a previous run)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._serve, name="mail-outbox", daemon=True)
+                self._thread.start()
+            # Under the lock: _serve checks _wake under it before exiting, so a
+            # sender that is about to stop either sees this or wasn't running
+            self._wake.set()
+
+    def status(self, msg_id: str) -> dict | None:
+        """The outbox row for ``msg_id`` as a dict, or None."""
+        conn = self._connect_db()
+        try:
+            row = conn.execute("SELECT * FROM outbox WHERE message_id = ?", (msg_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def wait(self, msg_id: str, timeout: float | None = None) -> dict | None:
+        """Block until ``msg_id`` is SENT or FAILED (or ``timeout``); returns its row."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            row = self.status(msg_id)
+            if row is None or row["status"] != "QUEUED":
+                return row
+            if end is not None and time.monotonic() >= end:
+                return row
+            time.sleep(0.2)
+
+    # ─────────── Sender thread ───────────
+
+    def _smtp(self) -> smtplib.SMTP:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, context=ssl.create_default_context(),
+                                    timeout=60)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=60)
+        smtp.ehlo()
+        if smtp.has_extn("auth") and self.password:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    @staticmethod
+    def _quit(smtp: smtplib.SMTP | None) -> None:
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _due(self) -> tuple[sqlite3.Row | None, float | None]:
+        """The next message that is due now, and when the next retry is due."""
+        conn = self._connect_db()
+        try:
+            row = conn.execute(
+                "SELECT * FROM outbox WHERE status = 'QUEUED' AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT 1", (time.time(),)
+            ).fetchone()
+            later = conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'QUEUED'"
+            ).fetchone()[0]
+        finally:
+            conn.close()
+        return row, later
+
+    def _update(self, msg_id: str, **fields) -> None:
+        conn = self._connect_db()
+        try:
+            conn.execute(
+                f"UPDATE outbox SET {', '.join(f'{k} = ?' for k in fields)} WHERE message_id = ?",
+                (*fields.values(), msg_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _serve(self) -> None:
+        smtp      = None
+        last_used = time.monotonic()
+        backoff   = 1
+        while True:
+            try:
+                self._wake.clear()
+                row, next_at = self._due()
+                if row is None:
+                    idle = time.monotonic() - last_used
+                    if smtp is not None and idle >= SMTP_IDLE_SEC:
+                        self._quit(smtp)
+                        smtp = None
+                    if next_at is None and smtp is None:
+                        with self._lock:
+                            if not self._wake.is_set():
+                                self._thread = None
+                                return
+                        continue
+                    waits = [SMTP_IDLE_SEC - idle] if smtp is not None else []
+                    if next_at is not None:
+                        waits.append(next_at - time.time())
+                    self._wake.wait(max(0.05, min(waits)))
+                    continue
+
+                try:
+                    if smtp is not None and time.monotonic() - last_used > 10:
+                        # The server may have dropped an idle connection
+                        try:
+                            smtp.noop()
+                        except (smtplib.SMTPException, OSError):
+                            self._quit(smtp)
+                            smtp = None
+                    if smtp is None:
+                        smtp = self._smtp()
+                    self._send_file(smtp, row)
+                except Exception as e:
+                    if not isinstance(e, (smtplib.SMTPException, OSError)):
+                        # Not a delivery error, but it still counts as an attempt
+                        print(traceback.format_exc().rstrip())
+                    self._quit(smtp)
+                    smtp = None
+                    self._failed(row, e)
+                else:
+                    last_used = time.monotonic()
+                    self._update(row["message_id"], status="SENT", sent_at=time.time(),
+                                 attempts=row["attempts"] + 1, last_error=None)
+                    print(f"Sent email '{row['subject']}' ({row['size']} bytes)")
+                    try:
+                        os.remove(row["path"])
+                    except OSError:
+                        pass
+                backoff = 1
+            except Exception as e:
+                # e.g. sqlite3.OperationalError on a locked outbox. If the thread died here,
+                # spooled mail would wait for the next enqueue to start it again
+                tb = traceback.format_exc().strip().splitlines()
+                print(f"Mail outbox: unexpected error ({tb[-1] if tb else e}); retrying in {backoff}s")
+                self._quit(smtp)
+                smtp = None
+                self._wake.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+    @staticmethod
+    def _send_file(smtp: smtplib.SMTP, row: sqlite3.Row) -> None:
+        """
+        ``sendmail()`` for a spool file without reading it into memory:
+        the DATA phase streams it in 64 KiB writes, dot-stuffing lines
+        that start with ".".
+        """
+        recipients = row["recipients"].split(",")
+        options    = [f"SIZE={row['size']}"] if smtp.has_extn("size") else []
+        code, resp = smtp.mail(row["sender"], options)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, row["sender"])
+        refused = {}
+        for rcpt in recipients:
+            code, resp = smtp.rcpt(rcpt)
+            if code not in (250, 251):
+                refused[rcpt] = (code, resp)
+        if len(refused) == len(recipients):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, resp = smtp.docmd("data")
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        buf = bytearray()
+        with open(row["path"], "rb") as f:
+            for line in f:
+                if not line.endswith(b"\r\n"):
+                    line = line.rstrip(b"\r\n") + b"\r\n"
+                if line.startswith(b"."):
+                    buf += b"."
+                buf += line
+                if len(buf) >= 1 << 16:
+                    smtp.send(bytes(buf))
+                    buf.clear()
+        smtp.send(bytes(buf) + b".\r\n")
+        code, resp = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        if refused:
+            print(f"Email '{row['subject']}' was not accepted for: {', '.join(refused)}")
+
+    def _failed(self, row: sqlite3.Row, error: Exception) -> None:
+        attempts  = row["attempts"] + 1
+        code      = getattr(error, "smtp_code", 0)
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            # Every recipient was refused; a 4xx among them (greylisting, full mailbox) may pass later
+            permanent = all(c >= 500 for c, _ in error.recipients.values())
+        else:
+            permanent = isinstance(error, FileNotFoundError) or 500 <= code < 600
+        if permanent or attempts >= SMTP_MAX_ATTEMPTS:
+            print(f"Giving up on email '{row['subject']}' after {attempts} attempts: {error}")
+            self._update(row["message_id"], status="FAILED", attempts=attempts,
+                         last_error=str(error))
+            return
+        delay = min(SMTP_RETRY_BASE_SEC * 2 ** (attempts - 1), 600)
+        print(f"Email '{row['subject']}' failed ({error}); retrying in {delay:.0f}s")
+        self._update(row["message_id"], attempts=attempts, last_error=str(error),
+                     next_attempt_at=time.time() + delay)
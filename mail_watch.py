@@ -0,0 +1,553 @@
+# mail_watch.py
+
+"""
+Push-based approval replies.
+
+``ApprovalWatcher.watch()`` registers a pending approval and returns a
+``Future`` that resolves to ``"yes"``, ``"no"`` or ``None`` (no matching
+reply within the timeout). One background thread serves every pending
+approval over a single authenticated IMAP connection: it waits for new
+mail with IDLE instead of reconnecting every few seconds, fetches only
+messages with a UID above the last one it has seen, and resumes from
+that UID after a dropped connection. The thread logs out once nothing is
+pending.
+
+Candidates are narrowed by the server: the sender whitelist, the date
+and the thread's message-id all go into the UID SEARCH. For the few hits
+only a handful of header fields, the BODYSTRUCTURE and the start of the
+text/plain part are fetched, with BODY.PEEK, so attachments are never
+downloaded and unrelated mail stays unread.
+
+``IMAP_HOST``/``IMAP_PORT``/``IMAP_SSL`` point it at another server, e.g.
+a plain-text IMAP stand-in on localhost for testing. Servers without
+IDLE are polled every ``POLL_INTERVAL_SEC`` on the same connection.
+"""
+
+import base64
+import email
+import email.message
+import email.utils
+import imaplib
+import itertools
+import os
+import quopri
+import re
+import select
+import ssl
+import threading
+import time
+import traceback
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+IMAP_HOST         = os.environ.get("IMAP_HOST", "imap.gmail.com")
+IMAP_SSL          = os.environ.get("IMAP_SSL", "True").lower() in ("1", "true", "yes")
+IMAP_PORT         = int(os.environ.get("IMAP_PORT", "993" if IMAP_SSL else "143"))
+IMAP_MAILBOX      = os.environ.get("IMAP_MAILBOX", "INBOX")
+# Servers drop IDLE after 30 minutes; re-issue it well before that
+IMAP_IDLE_SEC     = int(os.environ.get("IMAP_IDLE_SEC", "600"))
+POLL_INTERVAL_SEC = int(os.environ.get("POLL_INTERVAL_SEC", "5"))
+POLL_TIMEOUT_MIN  = int(os.environ.get("POLL_TIMEOUT_MIN", "30"))
+
+# Bytes of the reply's text part that are read; the keywords sit at the top
+REPLY_MAX_BYTES   = int(os.environ.get("REPLY_MAX_BYTES", "65536"))
+# Unexpected (non-IMAP) errors in a row after which pending approvals are failed
+APPROVAL_MAX_ERRORS = int(os.environ.get("APPROVAL_MAX_ERRORS", "5"))
+
+HEADER_FIELDS = "FROM DATE SUBJECT IN-REPLY-TO REFERENCES"
+_NEW_MAIL = re.compile(rb"^\* \d+ (EXISTS|RECENT)", re.I)
+
+
+@dataclass
+class Approval:
+    yes_keys: set[str]
+    no_keys: set[str]
+    after: datetime | None
+    thread_msgid: str | None
+    deadline: float
+    future: Future = field(default_factory=Future)
+    scanned: bool = False    # mail that arrived before the watch started has been checked
+
+    def search_keys(self, whitelist: set[str]) -> str:
+        """
+        IMAP SEARCH keys that narrow the candidates server-side: a
+        whitelisted sender, SINCE the day before ``after`` (SINCE compares
+        the server's arrival date), and the thread's message-id.
+        """
+        keys = []
+        if whitelist:
+            keys.append("(" + _or([f"FROM {_quote(a)}" for a in sorted(whitelist)]) + ")")
+        if self.after:
+            keys.append("SINCE " + _imap_date(self.after - timedelta(days=1)))
+        if self.thread_msgid:
+            msgid = _quote(self.thread_msgid)
+            keys.append(f"(OR HEADER In-Reply-To {msgid} HEADER References {msgid})")
+        return " ".join(keys) or "ALL"
+
+    def accepts(self, headers: email.message.Message) -> bool:
+        """Exact thread and date checks on the fetched header fields."""
+        if self.thread_msgid:
+            refs = " ".join(filter(None, [headers.get("In-Reply-To"), headers.get("References")]))
+            if self.thread_msgid not in refs:
+                return False
+        if self.after:
+            try:
+                msg_dt = email.utils.parsedate_to_datetime(headers["Date"])
+                if msg_dt <= self.after.astimezone(msg_dt.tzinfo):
+                    return False
+            except Exception:
+                pass
+        return True
+
+    def verdict(self, text: str) -> str | None:
+        """Return "yes"/"no" if ``text`` contains one of the keywords, else None."""
+        words = set(w.strip(".,!?;:()[]\"'") for w in text.lower().split())
+        if words & self.yes_keys:
+            return "yes"
+        if self.no_keys and (words & self.no_keys):
+            return "no"
+        return None
+
+
+# ─────────── IMAP helpers ───────────
+
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def _imap_date(d: datetime) -> str:
+    """'1-Feb-2025'; strftime's %b would follow the locale."""
+    return f"{d.day}-{_MONTHS[d.month - 1]}-{d.year}"
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _or(keys: list[str]) -> str:
+    """Chain search keys with IMAP's prefix OR: [a, b, c] -> 'OR a OR b c'."""
+    if len(keys) == 1:
+        return keys[0]
+    return f"OR {keys[0]} {_or(keys[1:])}"
+
+def _fetch_bytes(data: list) -> bytes:
+    """Flatten an imaplib FETCH response back into one byte string, literals inline."""
+    out = b""
+    for item in data:
+        if isinstance(item, tuple):
+            out += item[0] + b"\r\n" + item[1]
+        elif item:
+            out += item
+    return out
+
+_ATOM = re.compile(rb"[^ ()]+")
+
+def _parse(buf: bytes, i: int = 0):
+    """Parse one IMAP value (list, string, literal, NIL or atom) at ``buf[i:]``."""
+    while buf[i:i + 1] == b" ":
+        i += 1
+    c = buf[i:i + 1]
+    if c == b"(":
+        items, i = [], i + 1
+        while True:
+            while buf[i:i + 1] == b" ":
+                i += 1
+            if buf[i:i + 1] in (b")", b""):
+                return items, i + 1
+            item, i = _parse(buf, i)
+            items.append(item)
+    if c == b'"':
+        out, i = bytearray(), i + 1
+        while buf[i:i + 1] not in (b'"', b""):
+            if buf[i:i + 1] == b"\\":
+                i += 1
+            out += buf[i:i + 1]
+            i += 1
+        return bytes(out), i + 1
+    if c == b"{":
+        end   = buf.index(b"}", i)
+        n     = int(buf[i + 1:end])
+        start = end + 3  # skip "}\r\n"
+        return buf[start:start + n], start + n
+    m = _ATOM.match(buf, i)
+    if m is None:
+        raise imaplib.IMAP4.error(f"Unparseable FETCH response at {buf[i:i + 20]!r}")
+    atom = m.group(0)
+    return (None if atom.upper() == b"NIL" else atom), m.end()
+
+def text_part(structure: list, section: str = "") -> tuple[str, str, str] | None:
+    """
+    Find the first text/plain part in a parsed BODYSTRUCTURE. Returns
+    (section, transfer encoding, charset), e.g. ("1.1", "base64", "utf-8").
+    """
+    if structure and isinstance(structure[0], list):
+        # Multipart: the child parts come first, then the subtype
+        children = []
+        for item in structure:
+            if not isinstance(item, list):
+                break
+            children.append(item)
+        for n, child in enumerate(children, 1):
+            found = text_part(child, f"{section}.{n}" if section else str(n))
+            if found:
+                return found
+        return None
+    if len(structure) < 6:
+        return None
+    ctype = b"/".join(x or b"" for x in structure[:2]).decode(errors="ignore").lower()
+    if ctype != "text/plain":
+        return None
+    params  = structure[2] if isinstance(structure[2], list) else []
+    charset = "utf-8"
+    for key, value in zip(params[::2], params[1::2]):
+        if key and key.lower() == b"charset" and value:
+            charset = value.decode(errors="ignore")
+    encoding = (structure[5] or b"7bit").decode(errors="ignore").lower()
+    return section or "1", encoding, charset
+
+def decode_part(raw: bytes, encoding: str, charset: str) -> str:
+    """Undo the transfer encoding of a (possibly truncated) body part."""
+    if encoding == "base64":
+        clean = re.sub(rb"[^A-Za-z0-9+/=]", b"", raw)
+        raw   = base64.b64decode(clean[:len(clean) // 4 * 4])
+    elif encoding == "quoted-printable":
+        raw = quopri.decodestring(raw)
+    try:
+        return raw.decode(charset, errors="ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="ignore")
+
+
+def _buffered(imap: imaplib.IMAP4) -> bytes:
+    """What imaplib's reader holds but hasn't returned yet, without blocking."""
+    sock    = imap.sock
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        # Reads the socket only if the buffer is empty, and then only what is already there
+        return imap.file.peek()
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return b""
+    finally:
+        sock.settimeout(timeout)
+
+def _readline(imap: imaplib.IMAP4, timeout: float) -> bytes | None:
+    """
+    The next response line through imaplib's buffered reader, or None if
+    none has started to arrive within ``timeout``. Lines imaplib already
+    buffered are returned first; select() only waits on an empty buffer.
+    Raises ``IMAP4.abort`` once the server has closed the connection.
+    """
+    if b"\n" not in _buffered(imap):
+        sock    = imap.sock
+        pending = isinstance(sock, ssl.SSLSocket) and sock.pending()
+        if not pending and not select.select([sock], [], [], max(timeout, 0))[0]:
+            return None
+    # A line cut off mid-way hits the socket timeout set by _idle
+    line = imap.readline()
+    if not line:
+        # imaplib.readline() returns b"" at EOF rather than raising like its own reads
+        raise imaplib.IMAP4.abort("connection closed by the server")
+    return line
+
+
+class ApprovalWatcher:
+    def __init__(
+        self,
+        user: str,
+        password: str,
+        whitelist: list[str],
+        host: str = IMAP_HOST,
+        port: int = IMAP_PORT,
+        use_ssl: bool = IMAP_SSL,
+        mailbox: str = IMAP_MAILBOX,
+        idle_sec: int = IMAP_IDLE_SEC,
+    ):
+        self.user      = user
+        self.password  = password
+        self.whitelist = set(e.strip().lower() for e in whitelist)
+        self.host      = host
+        self.port      = port
+        self.use_ssl   = use_ssl
+        self.mailbox   = mailbox
+        self.idle_sec  = idle_sec
+
+        self._lock        = threading.Lock()
+        self._wake        = threading.Event()
+        self._pending: list[Approval] = []
+        self._thread: threading.Thread | None = None
+        self._stopping    = False
+        self._idle_tags   = itertools.count(1)
+        self.last_uid: int | None = None
+        self.uidvalidity: int | None = None
+
+    # ─────────── Public API ───────────
+
+    def watch(
+        self,
+        pos_keywords: list[str],
+        neg_keywords: list[str] | None = None,
+        *,
+        after: datetime | None = None,
+        thread_msgid: str | None = None,
+        timeout_min: float | None = None,
+    ) -> Future:
+        """
+        Start waiting for a reply containing one of ``pos_keywords`` or
+        ``neg_keywords`` (case-insensitive) from a whitelisted sender. The
+        ``after`` and ``thread_msgid`` filters work as in
+        ``nea_reports.wait_reply``. The future resolves to "yes", "no", or
+        None once ``timeout_min`` (default ``POLL_TIMEOUT_MIN``) has passed.
+        """
+        minutes  = POLL_TIMEOUT_MIN if timeout_min is None else timeout_min
+        approval = Approval(
+            yes_keys=set(k.lower() for k in pos_keywords),
+            no_keys=set(k.lower() for k in (neg_keywords or [])),
+            after=after,
+            thread_msgid=thread_msgid,
+            deadline=time.monotonic() + minutes * 60,
+        )
+        with self._lock:
+            self._pending.append(approval)
+            self._stopping = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._serve, name="approval-watcher",
+                                                daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return approval.future
+
+    def stop(self) -> None:
+        """Cancel every pending approval and stop the watcher thread."""
+        with self._lock:
+            self._stopping = True
+            pending, self._pending = self._pending, []
+        for approval in pending:
+            approval.future.cancel()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=10)
+
+    # ─────────── Watcher thread ───────────
+
+    def _connect(self) -> imaplib.IMAP4:
+        if self.use_ssl:
+            imap = imaplib.IMAP4_SSL(self.host, self.port, ssl_context=ssl.create_default_context())
+        else:
+            imap = imaplib.IMAP4(self.host, self.port)
+        imap.login(self.user, self.password)
+        imap.select(self.mailbox)
+
+        uidvalidity = int(imap.response("UIDVALIDITY")[1][0] or 0)
+        uidnext     = imap.response("UIDNEXT")[1][0]
+        if uidnext is None:
+            _, data = imap.uid("SEARCH", "ALL")
+            uids    = [int(u) for u in data[0].split()]
+            uidnext = (max(uids) if uids else 0) + 1
+        if self.last_uid is None or uidvalidity != self.uidvalidity:
+            # First connection, or the mailbox was rebuilt and old UIDs mean nothing:
+            # start at the current end and let every pending approval re-scan
+            self.last_uid    = int(uidnext) - 1
+            self.uidvalidity = uidvalidity
+            with self._lock:
+                for approval in self._pending:
+                    approval.scanned = False
+        return imap
+
+    def _serve(self) -> None:
+        imap    = None
+        backoff = 1
+        errors  = 0     # unexpected errors in a row
+        while True:
+            self._expire()
+            with self._lock:
+                if self._stopping or not self._pending:
+                    self._thread = None
+                    break
+            # Anything that wakes us from here on is handled on the next pass
+            self._wake.clear()
+            try:
+                if imap is None:
+                    imap = self._connect()
+                self._backscan(imap)
+                self._check_new(imap)
+                self._wait(imap)
+                # Only a clean pass resets the backoff; a connect that fails right after doesn't
+                backoff = 1
+                errors  = 0
+            except (OSError, imaplib.IMAP4.error) as e:
+                print(f"Approval watcher: IMAP error ({e}); reconnecting in {backoff}s")
+            except Exception as e:
+                # e.g. an unparsable server response; the thread must survive so deadlines still fire
+                errors += 1
+                tb = traceback.format_exc().strip().splitlines()
+                print(f"Approval watcher: unexpected error ({tb[-1] if tb else e}); "
+                      f"reconnecting in {backoff}s ({errors}/{APPROVAL_MAX_ERRORS})")
+                if errors >= APPROVAL_MAX_ERRORS:
+                    self._fail_pending(e)
+                    errors = 0
+            else:
+                continue
+            self._close(imap)
+            imap = None
+            self._wake.wait(backoff)
+            backoff = min(backoff * 2, 60)
+        self._close(imap)
+
+    @staticmethod
+    def _close(imap: imaplib.IMAP4 | None) -> None:
+        if imap is None:
+            return
+        try:
+            imap.logout()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error: BaseException | None = None) -> None:
+        """Settle ``future`` unless it already is (stop() may cancel it at any time)."""
+        if future.done():
+            return
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _expire(self) -> None:
+        """Resolve approvals past their deadline to None, outside the lock (callbacks run inline)."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [a for a in self._pending if a.deadline <= now or a.future.done()]
+            self._pending = [a for a in self._pending if not (a.deadline <= now or a.future.done())]
+        for approval in expired:
+            self._resolve(approval.future)
+
+    def _fail_pending(self, error: Exception) -> None:
+        """Give up on every pending approval after repeated unexpected errors."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for approval in pending:
+            self._resolve(approval.future, error=RuntimeError(f"approval watcher failed: {error}"))
+
+    def _search(self, imap: imaplib.IMAP4, uid_range: str, approval: Approval) -> list[int]:
+        _, data = imap.uid("SEARCH", f"UID {uid_range} {approval.search_keys(self.whitelist)}")
+        return [int(u) for u in (data[0] or b"").split()]
+
+    def _backscan(self, imap: imaplib.IMAP4) -> None:
+        """Check mail that arrived between ``after`` and the start of a watch."""
+        with self._lock:
+            todo = [a for a in self._pending if not a.scanned]
+        for approval in todo:
+            if self.last_uid > 0:
+                self._check(imap, self._search(imap, f"1:{self.last_uid}", approval), approval)
+            approval.scanned = True
+
+    def _check_new(self, imap: imaplib.IMAP4) -> None:
+        _, data = imap.uid("SEARCH", f"UID {self.last_uid + 1}:*")
+        # "n:*" always includes the newest message, even if its UID is below n
+        uids = [int(u) for u in data[0].split() if int(u) > self.last_uid]
+        if not uids:
+            return
+        with self._lock:
+            pending = list(self._pending)
+        uid_range = f"{self.last_uid + 1}:{max(uids)}"
+        for approval in pending:
+            self._check(imap, self._search(imap, uid_range, approval), approval)
+        self.last_uid = max(uids)
+
+    def _check(self, imap: imaplib.IMAP4, uids: list[int], approval: Approval) -> None:
+        """
+        Look for ``approval``'s reply among the SEARCH hits. Only the header
+        fields, the BODYSTRUCTURE and the first REPLY_MAX_BYTES of the
+        text/plain part are fetched, all with PEEK, so unrelated mail keeps
+        its read state; only the matching reply is marked \\Seen.
+        """
+        for uid in sorted(uids):
+            if approval.future.done():
+                return
+            _, data = imap.uid("FETCH", str(uid), f"(BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])")
+            literals = [item[1] for item in data if isinstance(item, tuple)]
+            if not literals:
+                continue
+            headers = email.message_from_bytes(literals[0])
+            frm = email.utils.parseaddr(headers["From"])[1].lower()
+            if frm not in self.whitelist or not approval.accepts(headers):
+                continue
+
+            _, data = imap.uid("FETCH", str(uid), "(BODYSTRUCTURE)")
+            raw  = _fetch_bytes(data)
+            pos  = raw.upper().find(b"BODYSTRUCTURE ")
+            part = text_part(_parse(raw, pos + len(b"BODYSTRUCTURE "))[0]) if pos >= 0 else None
+            text = headers.get("Subject", "")
+            if part:
+                section, encoding, charset = part
+                _, data = imap.uid("FETCH", str(uid), f"(BODY.PEEK[{section}]<0.{REPLY_MAX_BYTES}>)")
+                literals = [item[1] for item in data if isinstance(item, tuple)]
+                if literals:
+                    text += " " + decode_part(literals[0], encoding, charset)
+
+            result = approval.verdict(text)
+            if result:
+                print(f"{'Positive' if result == 'yes' else 'Negative'} reply received:",
+                      headers.get("Subject", ""))
+                imap.uid("STORE", str(uid), "+FLAGS", "(\\Seen)")
+                with self._lock:
+                    if approval in self._pending:
+                        self._pending.remove(approval)
+                self._resolve(approval.future, result)
+
+    def _wait(self, imap: imaplib.IMAP4) -> None:
+        """Block until new mail, a new watch, the next deadline or the IDLE refresh."""
+        with self._lock:
+            if not self._pending:
+                return
+            deadline = min(a.deadline for a in self._pending)
+        timeout = max(0.0, min(self.idle_sec, deadline - time.monotonic()))
+        # New mail announced during the last commands was queued by imaplib
+        announced = [imap.response(kind)[1][0] for kind in ("EXISTS", "RECENT")]
+        if any(announced):
+            return
+        if "IDLE" in imap.capabilities:
+            self._idle(imap, timeout)
+        else:
+            self._wake.wait(min(timeout, POLL_INTERVAL_SEC))
+            imap.noop()
+
+    def _idle(self, imap: imaplib.IMAP4, timeout: float) -> bool:
+        """IDLE for up to ``timeout`` seconds; True if the server announced new mail."""
+        # A tag of our own: imaplib doesn't track IDLE, so its responses are read here
+        tag = b"W%d" % next(self._idle_tags)
+        saved = imap.sock.gettimeout()
+        imap.sock.settimeout(30)
+        try:
+            imap.send(tag + b" IDLE\r\n")
+            new_mail = False
+            while True:
+                line = _readline(imap, 30)
+                if line and line.startswith(b"+"):
+                    break
+                if not line or not line.startswith(b"*"):
+                    raise imaplib.IMAP4.abort(f"IDLE refused: {line!r}")
+                # Untagged data can still arrive before the continuation
+                new_mail = new_mail or bool(_NEW_MAIL.match(line))
+
+            end = time.monotonic() + timeout
+            # Wake up once a second to notice new watches and stop()
+            while not new_mail and not self._wake.is_set():
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                line = _readline(imap, min(remaining, 1.0))
+                if line and _NEW_MAIL.match(line):
+                    new_mail = True
+
+            imap.send(b"DONE\r\n")
+            while True:
+                line = _readline(imap, 30)
+                if line is None:
+                    raise imaplib.IMAP4.abort("no reply to IDLE DONE")
+                if line.startswith(tag + b" "):
+                    return new_mail
+        finally:
+            imap.sock.settimeout(saved)
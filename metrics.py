@@ -0,0 +1,115 @@
+# metrics.py
+
+"""
+Process-wide counters and histograms, rendered in the Prometheus text
+format for the dashboard's ``/metrics`` endpoint.
+
+``run_stats`` feeds them: every ``incr()`` also bumps
+``nea_run_events_total{event=...}``, and every ``span()`` is observed in
+``nea_phase_seconds{phase=...}``, whether or not a run is collecting.
+``dashboard.scheduler.record_run`` adds ``nea_task_runs_total`` and
+``nea_task_run_seconds`` per task. Values live in memory and start from
+zero when the process starts, which Prometheus' ``rate()`` expects.
+Gauges that are costly to keep current (e.g. the OCR cache's size) are
+set by functions registered with ``collect()``, which ``render()`` calls
+on every scrape.
+"""
+
+import threading
+import traceback
+from collections import defaultdict
+from typing import Callable
+
+# Upper bounds in seconds: cache hits take milliseconds, OCR and Excel runs minutes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_help: dict[str, tuple[str, str]] = {}                       # name -> (type, help)
+_counters: dict[str, dict[tuple, float]] = defaultdict(dict)  # name -> {labels: value}
+_gauges: dict[str, dict[tuple, float]] = defaultdict(dict)    # name -> {labels: value}
+# name -> {labels: [bucket counts..., sum, count]}
+_histograms: dict[str, dict[tuple, list[float]]] = defaultdict(dict)
+_collectors: list[Callable[[], None]] = []
+
+
+def describe(name: str, kind: str, text: str) -> None:
+    """Register the # TYPE ("counter", "gauge" or "histogram") and # HELP lines of ``name``."""
+    _help[name] = (kind, text)
+
+def inc(name: str, labels: dict[str, str] | None = None, n: float = 1) -> None:
+    key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        series = _counters[name]
+        series[key] = series.get(key, 0) + n
+
+def set_gauge(name: str, value: float, labels: dict[str, str] | None = None) -> None:
+    key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        _gauges[name][key] = value
+
+def collect(fn: Callable[[], None]) -> Callable[[], None]:
+    """Call ``fn`` (which sets gauges) before every ``render()``; usable as a decorator."""
+    _collectors.append(fn)
+    return fn
+
+def observe(name: str, value: float, labels: dict[str, str] | None = None) -> None:
+    key = tuple(sorted((labels or {}).items()))
+    with _lock:
+        series = _histograms[name]
+        state  = series.get(key)
+        if state is None:
+            state = series[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    for fn in _collectors:
+        try:
+            fn()
+        except Exception:
+            # A failing collector leaves its gauges at their last value
+            traceback.print_exc()
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            kind, text = _help.get(name, ("counter", ""))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for key, value in sorted(_counters[name].items()):
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+        for name in sorted(_gauges):
+            kind, text = _help.get(name, ("gauge", ""))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for key, value in sorted(_gauges[name].items()):
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+        for name in sorted(_histograms):
+            kind, text = _help.get(name, ("histogram", ""))
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for key, state in sorted(_histograms[name].items()):
+                for bound, count in zip(BUCKETS, state):
+                    lines.append(f"{name}_bucket{_labels(key + (('le', repr(float(bound))),))} {count}")
+                lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {state[-1]}")
+                lines.append(f"{name}_sum{_labels(key)} {_number(state[-2])}")
+                lines.append(f"{name}_count{_labels(key)} {state[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+describe("nea_run_events_total", "counter", "run_stats events, e.g. render cache hits.")
+describe("nea_phase_seconds", "histogram", "Time spent in a phase of a report step.")
+describe("nea_task_runs_total", "counter", "Task runs recorded, by task and status.")
+describe("nea_task_run_seconds", "histogram", "Wall time of a task run.")
@@ -1,23 +1,28 @@
 import os
-import glob
 import shutil
 import math
-import mimetypes
-import time
-import smtplib
-import ssl
-import imaplib
-import email
+import re
 from email.message import EmailMessage
 from email.utils import make_msgid
 from datetime import datetime, timedelta
+from dataclasses import dataclass
 from decimal import Decimal
+from functools import partial, wraps
+from typing import Callable
 from dotenv import load_dotenv
 import pandas as pd
-import xlwings as xw
-from pdf2image import convert_from_path
-from PIL import Image, ImageFilter
 import pytesseract
+from workbooks import get_backend, write_frame
+from pdf_render import page_count, render_regions
+from ocr import ocr_batch
+from xlsx_cells import read_cells
+from file_catalog import Catalog
+from mail_outbox import MAIL_ZIP_ATTACHMENTS, Outbox
+from mail_watch import ApprovalWatcher
+import dag
+import erc_ingest
+import run_stats
+from build_cache import BUILD_CACHE, BuildManifest
 
 # ─────────── Configuration ───────────
 
@@ -30,8 +35,6 @@ RECIPIENT_EMAILS = os.environ["RECIPIENT_EMAILS"].split(",")
 # booleans & numbers need casting
 POLL_FOR_REPLY    = os.environ.get("POLL_FOR_REPLY", "True").lower() in ("1","true","yes")
 POLL_TIMEOUT_MIN  = int(os.environ.get("POLL_TIMEOUT_MIN", "30"))
-# Poll interval defaults to 5 seconds
-POLL_INTERVAL_SEC = int(os.environ.get("POLL_INTERVAL_SEC", "5"))
 
 BASE_NEA = os.environ["BASE_NEA"]
 BASE_ERC = os.environ["BASE_ERC"]
@@ -41,6 +44,21 @@ JPG_DPI         = int(os.environ.get("JPG_DPI", "600"))
 TESSERACT_CMD   = os.environ["TESSERACT_CMD"]
 pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
 
+# Workbook backend ("python" or "xlwings"), see workbooks.py
+BOOKS = get_backend()
+
+# Outgoing mail is spooled and sent over one SMTP connection, see mail_outbox.py
+OUTBOX = Outbox(SENDER_EMAIL, SENDER_PASSWORD)
+
+# One IMAP IDLE connection shared by every pending approval, see mail_watch.py
+APPROVALS = ApprovalWatcher(SENDER_EMAIL, SENDER_PASSWORD, RECIPIENT_EMAILS)
+
+# Directory listings of the shares, so existence checks don't go over SMB, see file_catalog.py
+CATALOG = Catalog(BASE_NEA, BASE_ERC)
+
+# Input/output hashes of the last build of each step and month, see build_cache.py
+BUILD = BuildManifest(catalog=CATALOG)
+
 # ─────────── Helpers ───────────
 def target_date(offset: int = 1) -> datetime:
     """
@@ -52,6 +70,11 @@ def target_date(offset: int = 1) -> datetime:
         d = d.replace(day=1) - timedelta(days=1)
     return d
 
+def offset_for(year: int, month: int) -> int:
+    """The 'offset' whose target_date() falls in year/month (1 = last month)."""
+    last = target_date(1)
+    return (last.year - year) * 12 + (last.month - month) + 1
+
 def prev_month(d: datetime) -> datetime:
     """Return the month immediately before the given date 'd'."""
     return d.replace(day=1) - timedelta(days=1)
@@ -60,12 +83,40 @@ def month_folder(d: datetime) -> str:
     """Format a folder name as 'MM. MON YYYY' for the given date 'd'."""
     return f"{d.month:02d}. {d.strftime('%b').upper()} {d.year}"
 
+def report_path(prefix: str, d: datetime) -> str:
+    """Path of the '<prefix>-YYYYMM01-V1.xls' workbook for the month of 'd'."""
+    return os.path.join(BASE_NEA, str(d.year), month_folder(d),
+                        f"{prefix}-{d.year}{d.month:02d}01-V1.xls")
+
+def supporting_doc(name: str, d: datetime) -> str:
+    """Path of a file in the month's SUPPORTING DOCS folder."""
+    return os.path.join(BASE_NEA, str(d.year), month_folder(d), "SUPPORTING DOCS", name)
+
+def erc_patterns(d: datetime) -> tuple[str, str]:
+    """Glob patterns of the (planned, unplanned) ERC interruption files for 'd'."""
+    folder = os.path.join(BASE_ERC, f"{d.year} POWER INTERRUPTIONS")
+    month  = f"{d.month:02d}_{d.strftime('%B').upper()}"
+    return (os.path.join(folder, f"*{month}*PLANNED*.xlsx"),
+            os.path.join(folder, f"*{month}*UNPLANNED*.xlsx"))
+
+def carry_forward(path_prev: str, path_cur: str, sheets: list[str]) -> None:
+    """Start this month's workbook from last month's, or from a blank one."""
+    with run_stats.span("copy-forward"):
+        os.makedirs(os.path.dirname(path_cur), exist_ok=True)
+        if CATALOG.exists(path_prev):
+            shutil.copy2(path_prev, path_cur)
+        else:
+            BOOKS.create(path_cur, sheets)
+        CATALOG.add(path_cur)
+
 def send_email(subject: str, body: str, paths: list[str], reply_to_msgid: str | None = None) -> str:
     """
-    Send an email with the given subject, body, and attachments.
-    Returns the Message-ID so callers can reply in-thread.
+    Queue an email with the given subject, body, and attachments
+    (identical files are sent once; zipped with MAIL_ZIP_ATTACHMENTS).
+    Returns the Message-ID right away so callers can reply in-thread;
+    delivery and retries are handled by ``OUTBOX``.
     """
-    print(f"Sending email '{subject}' to {RECIPIENT_EMAILS}")
+    print(f"Queueing email '{subject}' to {RECIPIENT_EMAILS}")
     msg = EmailMessage()
     msg["From"]    = SENDER_EMAIL
     msg["To"]      = ", ".join(RECIPIENT_EMAILS)
@@ -76,28 +127,15 @@ def send_email(subject: str, body: str, paths: list[str], reply_to_msgid: str |
     msg_id = make_msgid()
     msg["Message-ID"] = msg_id
     msg.set_content(body)
-    for p in paths:
-        mime, _ = mimetypes.guess_type(p)
-        maintype, subtype = (mime or "application/octet-stream").split("/", 1)
-        with open(p, "rb") as f:
-            msg.add_attachment(
-                f.read(),
-                maintype=maintype,
-                subtype=subtype,
-                filename=os.path.basename(p)
-            )
-    ctx = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=ctx) as s:
-        s.login(SENDER_EMAIL, SENDER_PASSWORD)
-        s.send_message(msg)
-    return msg_id
+    zip_name = re.sub(r"[^\w.-]+", "_", subject).strip("_") + ".zip" if MAIL_ZIP_ATTACHMENTS else None
+    return OUTBOX.enqueue(msg, attachments=paths, zip_name=zip_name)
 
 def send_simple(subject: str, body: str, reply_to_msgid: str | None = None) -> str:
     """
-    Send a simple email with the given subject and body.
-    Returns the Message-ID so callers can thread replies.
+    Queue a simple email with the given subject and body.
+    Returns the Message-ID right away so callers can thread replies.
     """
-    print(f"Sending email '{subject}'")
+    print(f"Queueing email '{subject}'")
     msg = EmailMessage()
     msg["From"]    = SENDER_EMAIL
     msg["To"]      = ", ".join(RECIPIENT_EMAILS)
@@ -108,11 +146,7 @@ def send_simple(subject: str, body: str, reply_to_msgid: str | None = None) -> s
     msg_id = make_msgid()
     msg["Message-ID"] = msg_id
     msg.set_content(body)
-    ctx = ssl.create_default_context()
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=ctx) as s:
-        s.login(SENDER_EMAIL, SENDER_PASSWORD)
-        s.send_message(msg)
-    return msg_id
+    return OUTBOX.enqueue(msg)
 
 def wait_reply(
     pos_keywords: list[str],
@@ -122,67 +156,70 @@ def wait_reply(
     thread_msgid: str | None = None,
 ) -> str | None:
     """
-    Poll the inbox indefinitely until a reply contains one of the
-    ``pos_keywords`` or ``neg_keywords`` (case-insensitive).
-    
+    Wait until a reply contains one of the ``pos_keywords`` or
+    ``neg_keywords`` (case-insensitive), or ``POLL_TIMEOUT_MIN`` passes.
+
     If ``after`` is provided, only emails received after this timestamp
     are considered. If ``thread_msgid`` is provided, only messages whose
     ``In-Reply-To`` or ``References`` header contains that value are
-    checked. Returns ``"yes"`` for a positive match or ``"no`` for a
-    negative one.
+    checked. Returns ``"yes"`` for a positive match, ``"no"`` for a
+    negative one, or ``None`` on timeout. Use ``APPROVALS.watch`` to wait
+    without blocking.
     """
-    yes_keys = set(k.lower() for k in pos_keywords)
-    no_keys = set(k.lower() for k in (neg_keywords or []))
-    whitelist = set(e.lower() for e in RECIPIENT_EMAILS)
     print("Waiting for email reply...")
-    while True:
-        with imaplib.IMAP4_SSL("imap.gmail.com") as imap:
-            imap.login(SENDER_EMAIL, SENDER_PASSWORD)
-            imap.select("INBOX")
-            _, data = imap.search(None, "UNSEEN")
-            for num in data[0].split():
-                _, md = imap.fetch(num, "(RFC822)")
-                m = email.message_from_bytes(md[0][1])
-                frm = email.utils.parseaddr(m["From"])[1].lower()
-                imap.store(num, "+FLAGS", "\\Seen")
-                if frm not in whitelist:
-                    continue
-                # Skip messages not matching thread or timestamp
-                if thread_msgid:
-                    refs = " ".join(
-                        filter(None, [m.get("In-Reply-To"), m.get("References")])
-                    )
-                    if thread_msgid not in refs:
-                        continue
-                if after:
-                    try:
-                        msg_dt = email.utils.parsedate_to_datetime(m["Date"])
-                        if msg_dt <= after.astimezone(msg_dt.tzinfo):
-                            continue
-                    except Exception:
-                        pass
-                txt = m.get("Subject", "")
-                if m.is_multipart():
-                    for part in m.walk():
-                        if part.get_content_type() == "text/plain":
-                            txt += " " + part.get_payload(decode=True).decode(errors="ignore")
-                else:
-                    txt += " " + m.get_payload(decode=True).decode(errors="ignore")
-                words = set(w.strip(".,!?;:()[]\"'") for w in txt.lower().split())
-                if words & yes_keys:
-                    print("Positive reply received:", txt)
-                    imap.logout()
-                    return "yes"
-                if no_keys and (words & no_keys):
-                    print("Negative reply received:", txt)
-                    imap.logout()
-                    return "no"
-            imap.logout()
-        print(f"No matching reply; checking again in {POLL_INTERVAL_SEC} seconds")
-        time.sleep(POLL_INTERVAL_SEC)
+    return APPROVALS.watch(
+        pos_keywords, neg_keywords,
+        after=after, thread_msgid=thread_msgid, timeout_min=POLL_TIMEOUT_MIN,
+    ).result()
 
 # ─────────── Report Steps (Task Functions) ───────────
 
+def build_key(fn_name: str, d: datetime) -> str:
+    """Build manifest key of a report step for the month of 'd'."""
+    return f"{fn_name} {d:%Y-%m}"
+
+def cached(fn: Callable[[int], list[str]]) -> Callable[..., list[str]]:
+    """
+    Skip a report step whose inputs and outputs (from its ``Step.io``)
+    are unchanged since it last succeeded for that month, returning the
+    paths it built then. ``force=True`` always rebuilds.
+    """
+    @wraps(fn)
+    def wrapper(offset: int = 1, force: bool = False) -> list[str]:
+        d = target_date(offset)
+        # Pick up files dropped on the share since the last look; steps starting together share one refresh
+        CATALOG.refresh(max_age=5)
+        inputs, outputs = STEPS_BY_FUNCTION[fn.__name__].io(d)
+        key = build_key(fn.__name__, d)
+        fingerprint = BUILD.fingerprint(inputs)
+        if BUILD_CACHE and not force:
+            paths = BUILD.lookup(key, fingerprint, outputs)
+            if paths is not None:
+                run_stats.incr("build cache hits")
+                print(f"{fn.__name__}: inputs unchanged for {d:%B %Y}, keeping {len(paths)} file(s)")
+                return paths
+
+        run_stats.incr("build cache misses")
+        # Last month's workbooks are copied forward and edited; fail now if they can't be saved here
+        for path in STEPS_BY_FUNCTION[fn.__name__].io(prev_month(d))[1]:
+            if CATALOG.exists(path):
+                BOOKS.check_writable(path)
+        paths = fn(offset)
+        if paths:
+            BUILD.record(key, fingerprint, outputs, paths)
+        else:
+            BUILD.forget(key)
+        return paths
+    return wrapper
+
+# workbook name prefix -> sheet holding the month/year header
+PDC_REPORTS = {
+    "Compliance to PDC":     "PDC",
+    "Compliance to PGC":     "PGC",
+    "Power Supplier Report": "Power Supplier Report",
+}
+
+@cached
 def process_pdc(offset: int = 1) -> list[str]:
     """
     Generate PDC/PGC/PSR workbooks for 'offset' months back.
@@ -190,49 +227,25 @@ def process_pdc(offset: int = 1) -> list[str]:
     """
     d = target_date(offset)
     pm = prev_month(d)
-    stamp_cur  = f"{d.year}{d.month:02d}01-V1.xls"
-    stamp_prev = f"{pm.year}{pm.month:02d}01-V1.xls"
 
-    codes = [("PDC","PDC"), ("PGC","PGC"), ("PSR","Power Supplier Report")]
     out = []
-    for code, sheet in codes:
-        base_cur  = os.path.join(BASE_NEA, str(d.year), month_folder(d))
-        base_prev = os.path.join(BASE_NEA, str(pm.year), month_folder(pm))
+    for prefix, sheet in PDC_REPORTS.items():
+        path_prev = report_path(prefix, pm)
+        path_cur  = report_path(prefix, d)
 
-        if code in ("PDC","PGC"):
-            name_cur  = f"Compliance to {code}-{stamp_cur}"
-            name_prev = f"Compliance to {code}-{stamp_prev}"
-        else:
-            name_cur  = f"Power Supplier Report-{stamp_cur}"
-            name_prev = f"Power Supplier Report-{stamp_prev}"
+        with BOOKS.session():
+            carry_forward(path_prev, path_cur, [sheet])
 
-        path_prev = os.path.join(base_prev, name_prev)
-        path_cur  = os.path.join(base_cur, name_cur)
-
-        os.makedirs(os.path.dirname(path_cur), exist_ok=True)
-        if os.path.exists(path_prev):
-            shutil.copy2(path_prev, path_cur)
-        else:
-            app = xw.App(visible=False)
-            wb  = app.books.add()
-            wb.sheets[0].name = sheet
-            wb.save(path_cur)
-            wb.close()
-            app.quit()
-
-        app = xw.App(visible=False)
-        wb  = app.books.open(path_cur)
-        sh  = wb.sheets[sheet]
-        sh.range("C3").value = d.strftime("%B")
-        sh.range("C4").value = d.year
-        wb.save()
-        wb.close()
-        app.quit()
+            with BOOKS.open(path_cur) as wb:
+                sh = wb.sheet(sheet)
+                sh["C3"] = d.strftime("%B")
+                sh["C4"] = d.year
 
         out.append(path_cur)
 
     return out
 
+@cached
 def process_interruption(offset: int = 1) -> list[str]:
     """
     Generate Energy and Interruption Data workbook for 'offset' months back.
@@ -240,67 +253,39 @@ def process_interruption(offset: int = 1) -> list[str]:
     """
     d = target_date(offset)
     pm = prev_month(d)
-    stamp_cur  = f"{d.year}{d.month:02d}01-V1.xls"
-    stamp_prev = f"{pm.year}{pm.month:02d}01-V1.xls"
-    name_cur  = f"Energy and Interruption Data-{stamp_cur}"
-    name_prev = f"Energy and Interruption Data-{stamp_prev}"
-
-    base_cur  = os.path.join(BASE_NEA, str(d.year), month_folder(d))
-    base_prev = os.path.join(BASE_NEA, str(pm.year), month_folder(pm))
-
-    path_prev = os.path.join(base_prev, name_prev)
-    path_cur  = os.path.join(base_cur, name_cur)
-
-    os.makedirs(os.path.dirname(path_cur), exist_ok=True)
-    if os.path.exists(path_prev):
-        shutil.copy2(path_prev, path_cur)
-    else:
-        app = xw.App(visible=False)
-        wb  = app.books.add()
-        wb.sheets[0].name = "interruption"
-        wb.sheets.add("Energy Input and Output", after=wb.sheets[0])
-        wb.save(path_cur)
-        wb.close()
-        app.quit()
-
-    plan_pat   = os.path.join(BASE_ERC, f"{d.year} POWER INTERRUPTIONS",
-                              f"*{d.month:02d}_{d.strftime('%B').upper()}*PLANNED*.xlsx")
-    unplan_pat = os.path.join(BASE_ERC, f"{d.year} POWER INTERRUPTIONS",
-                              f"*{d.month:02d}_{d.strftime('%B').upper()}*UNPLANNED*.xlsx")
-    planned   = next(iter(glob.glob(plan_pat)), None)
-    unplanned = next(iter(glob.glob(unplan_pat)), None)
+    path_prev = report_path("Energy and Interruption Data", pm)
+    path_cur  = report_path("Energy and Interruption Data", d)
+
+    carry_forward(path_prev, path_cur, ["interruption", "Energy Input and Output"])
+
+    # From the catalog's (kind, year, month) index: the PLANNED pattern also matches UNPLANNED files
+    planned   = next(iter(CATALOG.lookup("ERC PLANNED", d.year, d.month)), None)
+    unplanned = next(iter(CATALOG.lookup("ERC UNPLANNED", d.year, d.month)), None)
     if not planned or not unplanned:
         return []
 
-    df1 = pd.read_excel(planned, skiprows=11)
-    df2 = pd.read_excel(unplanned, skiprows=11)
-    df  = pd.concat([df1, df2])
-    df  = df[~df.iloc[:,0].astype(str).str.contains("Totals", na=False)].dropna()
-    df.iloc[:,0] = pd.to_datetime(df.iloc[:,0], format="%m/%d/%y", errors="coerce")
+    # Each file is parsed and cleaned once, then loaded from erc_cache/. They are
+    # cleaned separately, which matches cleaning the concat only if the columns agree
+    df_planned, df_unplanned = erc_ingest.load(planned), erc_ingest.load(unplanned)
+    if list(df_planned.columns) != list(df_unplanned.columns):
+        raise ValueError(
+            f"{os.path.basename(planned)} and {os.path.basename(unplanned)} have different columns: "
+            f"{list(df_planned.columns)} vs {list(df_unplanned.columns)}"
+        )
+    df = pd.concat([df_planned, df_unplanned])
     df = df.sort_values(df.columns[0]).reset_index(drop=True)
 
-    app = xw.App(visible=False)
-    wb  = app.books.open(path_cur)
-    out = wb.sheets["Energy Input and Output"]
-    out.range("C3").value = d.strftime("%B")
-    out.range("C4").value = d.year
-    sh = wb.sheets["interruption"]
-    sh.range("B19:G1000").clear_contents()
-    sh.range("I19:M1000").clear_contents()
-    start_row, start_col = 19, 2
-    protected = {8, 16}
-    for i, row in enumerate(df.itertuples(index=False)):
-        for j, val in enumerate(row):
-            col = start_col + j
-            while col in protected:
-                col += 1
-            sh.range((start_row + i, col)).value = val
-    wb.save()
-    wb.close()
-    app.quit()
+    with BOOKS.open(path_cur) as wb:
+        out = wb.sheet("Energy Input and Output")
+        out["C3"] = d.strftime("%B")
+        out["C4"] = d.year
+        sh = wb.sheet("interruption")
+        # Columns H and P hold formulas; the data fills B:G, I:M, ... around them
+        write_frame(sh, df, start_row=19, start_col=2, protected={8, 16}, clear_to=1000)
 
     return [path_cur]
 
+@cached
 def process_supply(offset: int = 1) -> list[str]:
     """
     Generate Power Supply workbook (OCR-based) for 'offset' months back.
@@ -310,35 +295,12 @@ def process_supply(offset: int = 1) -> list[str]:
 
     d = target_date(offset)
     pm = prev_month(d)
-    stamp_cur  = f"{d.year}{d.month:02d}01-V1.xls"
-    stamp_prev = f"{pm.year}{pm.month:02d}01-V1.xls"
-
-    base_sup   = os.path.join(BASE_NEA, str(d.year), month_folder(d), "SUPPORTING DOCS")
-    pdf17      = os.path.join(base_sup, "17MW.pdf")
-    pdfEx      = os.path.join(base_sup, "Excess.pdf")
-
-    base_cur   = os.path.join(BASE_NEA, str(d.year), month_folder(d))
-    base_prev  = os.path.join(BASE_NEA, str(pm.year), month_folder(pm))
-
-    name_cur   = f"Power Supply-{stamp_cur}"
-    name_prev  = f"Power Supply-{stamp_prev}"
-    path_prev  = os.path.join(base_prev, name_prev)
-    path_cur   = os.path.join(base_cur, name_cur)
-
-    os.makedirs(os.path.dirname(path_cur), exist_ok=True)
-    if os.path.exists(path_prev):
-        shutil.copy2(path_prev, path_cur)
-    else:
-        app = xw.App(visible=False)
-        w   = app.books.add()
-        w.sheets[0].name = "Power Supply"
-        w.save(path_cur)
-        w.close()
-        app.quit()
-
-    pages17 = convert_from_path(pdf17, dpi=JPG_DPI, first_page=2, last_page=2, userpw=PDF_PASSWORD)
-    pagesEx = convert_from_path(pdfEx, dpi=JPG_DPI, first_page=2, last_page=2, userpw=PDF_PASSWORD)
-    img17, imgEx = pages17[0], pagesEx[0]
+    pdf17      = supporting_doc("17MW.pdf", d)
+    pdfEx      = supporting_doc("Excess.pdf", d)
+    path_prev  = report_path("Power Supply", pm)
+    path_cur   = report_path("Power Supply", d)
+
+    carry_forward(path_prev, path_cur, ["Power Supply"])
 
     BOX_SI  = (3720, 1335, 4550, 1440)
     BOX_SD  = (1110, 2484, 1772, 2580)
@@ -346,56 +308,65 @@ def process_supply(offset: int = 1) -> list[str]:
     BOX_SUM = (4193, 3837, 4783, 4033)
     BOX_TX  = (4260, 4176, 4781, 4259)
 
-    def ocr_img(pil_img: Image.Image, box: tuple[int,int,int,int], psm: str = "7") -> str:
-        crop = pil_img.crop(box)
-        bw   = crop.convert("L").filter(ImageFilter.MedianFilter(3)).point(lambda x: 0 if x < 140 else 255)
-        return pytesseract.image_to_string(bw, config=f"--psm {psm}").strip()
+    LINE = "--psm 7"
+    SUMS = "--psm 6 -c tessedit_char_whitelist=0123456789.,"
+
+    # (pdf, box on page 2 at JPG_DPI, tesseract config); only the boxes are rendered
+    fields = {
+        "si17":  (pdf17, BOX_SI,  LINE),
+        "siEx":  (pdfEx, BOX_SI,  LINE),
+        "sd":    (pdf17, BOX_SD,  LINE),
+        "ed":    (pdf17, BOX_ED,  LINE),
+        "gt17":  (pdf17, BOX_SUM, SUMS),
+        "gtEx":  (pdfEx, BOX_SUM, SUMS),
+        "tx17":  (pdf17, BOX_TX,  SUMS),
+        "txEx":  (pdfEx, BOX_TX,  SUMS),
+    }
+    crops = render_regions([(pdf, 2, box) for pdf, box, _ in fields.values()],
+                           dpi=JPG_DPI, userpw=PDF_PASSWORD)
+    texts = dict(zip(fields, ocr_batch(
+        [(crop, cfg) for crop, (_, _, cfg) in zip(crops, fields.values())]
+    )))
 
-    def ocr_sum_img(pil_img: Image.Image, box: tuple[int,int,int,int]) -> Decimal:
-        raw = ocr_img(pil_img, box, "6 -c tessedit_char_whitelist=0123456789.,")
+    def sum_lines(raw: str) -> Decimal:
         return sum(Decimal(x.replace(",", "")) for x in raw.splitlines() if x.strip())
 
-    si = f"{ocr_img(img17, BOX_SI)} & {ocr_img(imgEx, BOX_SI)}"
-    sd = ocr_img(img17, BOX_SD)
-    ed = ocr_img(img17, BOX_ED)
-    gt = ocr_sum_img(img17, BOX_SUM) + ocr_sum_img(imgEx, BOX_SUM)
-    tx = ocr_sum_img(img17, BOX_TX)  + ocr_sum_img(imgEx, BOX_TX)
+    si = f"{texts['si17']} & {texts['siEx']}"
+    sd = texts["sd"]
+    ed = texts["ed"]
+    gt = sum_lines(texts["gt17"]) + sum_lines(texts["gtEx"])
+    tx = sum_lines(texts["tx17"]) + sum_lines(texts["txEx"])
 
-    fsc = os.path.join(base_sup, f"Fscsrd{d.year}.xlsx")
+    fsc = supporting_doc(f"Fscsrd{d.year}.xlsx", d)
     csrd_l = 0
     csrd_k = 0
-    if os.path.exists(fsc):
+    if CATALOG.exists(fsc):
         try:
             col = MONTH_TO_COL[d.month]
-            app_xw = xw.App(visible=False)
-            wb_xw = app_xw.books.open(fsc)
-            sh_xw = wb_xw.sheets["CSRDDetails"]
-            csrd_l = sh_xw.range(f"{col}105").value or 0
-            csrd_k = sh_xw.range(f"{col}192").value or 0
-            wb_xw.close()
-            app_xw.quit()
+            # Read straight from the file; no workbook session needed
+            cells  = read_cells(fsc, "CSRDDetails", [f"{col}105", f"{col}192"])
+            csrd_l = cells[f"{col}105"] or 0
+            csrd_k = cells[f"{col}192"] or 0
         except Exception:
             csrd_l = 0
             csrd_k = 0
 
-    app = xw.App(visible=False)
-    w   = app.books.open(path_cur)
-    sh  = w.sheets["Power Supply"]
-    sh.range("C3").value = d.strftime("%B")
-    sh.range("C4").value = d.year
-    sh.range("D12").value = si
-    sh.range("E12").value = sd
-    sh.range("F12").value = ed
-    sh.range("H12").value = str(gt)
-    sh.range("I12").value = str(tx)
-    sh.range("K12").value = str(csrd_k)
-    sh.range("L12").value = str(csrd_l)
-    w.save()
-    w.close()
-    app.quit()
+    with BOOKS.session():
+        with BOOKS.open(path_cur) as w:
+            sh = w.sheet("Power Supply")
+            sh["C3"] = d.strftime("%B")
+            sh["C4"] = d.year
+            sh["D12"] = si
+            sh["E12"] = sd
+            sh["F12"] = ed
+            sh["H12"] = str(gt)
+            sh["I12"] = str(tx)
+            sh["K12"] = str(csrd_k)
+            sh["L12"] = str(csrd_l)
 
     return [path_cur]
 
+@cached
 def process_ngcp(offset: int = 1) -> list[str]:
     """
     Generate NGCP Bill workbook (OCR-based) for 'offset' months back.
@@ -403,34 +374,11 @@ def process_ngcp(offset: int = 1) -> list[str]:
     """
     d  = target_date(offset)
     pm = prev_month(d)
-    stamp_cur  = f"{d.year}{d.month:02d}01-V1.xls"
-    stamp_prev = f"{pm.year}{pm.month:02d}01-V1.xls"
-
-    base_sup   = os.path.join(BASE_NEA, str(d.year), month_folder(d), "SUPPORTING DOCS")
-    pdf_path   = os.path.join(base_sup, "NGCP BILL.pdf")
-    base_cur   = os.path.join(BASE_NEA, str(d.year), month_folder(d))
-    base_prev  = os.path.join(BASE_NEA, str(pm.year), month_folder(pm))
-
-    name_cur   = f"NGCP Bill-{stamp_cur}"
-    name_prev  = f"NGCP Bill-{stamp_prev}"
-    path_prev  = os.path.join(base_prev, name_prev)
-    path_cur   = os.path.join(base_cur, name_cur)
-
-    os.makedirs(os.path.dirname(path_cur), exist_ok=True)
-    if os.path.exists(path_prev):
-        shutil.copy2(path_prev, path_cur)
-    else:
-        app = xw.App(visible=False)
-        w   = app.books.add()
-        w.sheets[0].name = "NGCP Bill"
-        w.save(path_cur)
-        w.close()
-        app.quit()
+    pdf_path   = supporting_doc("NGCP BILL.pdf", d)
+    path_prev  = report_path("NGCP Bill", pm)
+    path_cur   = report_path("NGCP Bill", d)
 
-    try:
-        pages = convert_from_path(pdf_path, dpi=JPG_DPI, userpw=PDF_PASSWORD)
-    except Exception:
-        return []
+    carry_forward(path_prev, path_cur, ["NGCP Bill"])
 
     FIELD_MAP = {
         "C11": (0, (4330,  477, 4730,  542)),  # statement date (page 1)
@@ -445,34 +393,30 @@ def process_ngcp(offset: int = 1) -> list[str]:
         "C25": (2, (3877, 4925, 4220, 4986)),  # total taxes   (page 3)
     }
 
-    def ocr_val(img: Image.Image, box: tuple[int,int,int,int], page_idx: int, total_pages: int) -> str:
-        if page_idx >= total_pages:
-            return "[PAGE MISSING]"
-        crop = img.crop(box)
-        bw   = (crop.convert("L")
-                      .filter(ImageFilter.MedianFilter(3))
-                      .point(lambda x: 0 if x < 140 else 255))
-        return pytesseract.image_to_string(bw, config="--psm 7").strip()
-
-    total_pages = len(pages)
-    results = {}
-    for cell, (page_idx, box) in FIELD_MAP.items():
-        val = ocr_val(pages[page_idx if page_idx < total_pages else 0], box, page_idx, total_pages)
-        results[cell] = val
-
-    app = xw.App(visible=False)
-    w   = app.books.open(path_cur)
-    sh  = w.sheets["NGCP Bill"]
-    sh.range("C3").value = d.strftime("%B")
-    sh.range("C4").value = d.year
-    for cell, val in results.items():
-        sh.range(cell).value = val
-    w.save()
-    w.close()
-    app.quit()
+    # Only the FIELD_MAP boxes are rendered, straight from the PDF
+    try:
+        total_pages = page_count(pdf_path, PDF_PASSWORD)
+        present = [cell for cell, (page_idx, _) in FIELD_MAP.items() if page_idx < total_pages]
+        crops = render_regions(
+            [(pdf_path, FIELD_MAP[cell][0] + 1, FIELD_MAP[cell][1]) for cell in present],
+            dpi=JPG_DPI, userpw=PDF_PASSWORD,
+        )
+    except Exception:
+        return []
+
+    texts   = dict(zip(present, ocr_batch([(crop, "--psm 7") for crop in crops])))
+    results = {cell: texts.get(cell, "[PAGE MISSING]") for cell in FIELD_MAP}
+
+    with BOOKS.open(path_cur) as w:
+        sh = w.sheet("NGCP Bill")
+        sh["C3"] = d.strftime("%B")
+        sh["C4"] = d.year
+        for cell, val in results.items():
+            sh[cell] = val
 
     return [path_cur]
 
+@cached
 def process_distribution(offset: int = 1) -> list[str]:
     """
     Generate Distribution Lines Substation & Power Quality workbook for 'offset' months back.
@@ -480,33 +424,10 @@ def process_distribution(offset: int = 1) -> list[str]:
     """
     d  = target_date(offset)
     pm = prev_month(d)
-    stamp_cur  = f"{d.year}{d.month:02d}01-V1.xls"
-    stamp_prev = f"{pm.year}{pm.month:02d}01-V1.xls"
-
-    base_sup   = os.path.join(BASE_NEA, str(d.year), month_folder(d), "SUPPORTING DOCS")
-    base_cur   = os.path.join(BASE_NEA, str(d.year), month_folder(d))
-    base_prev  = os.path.join(BASE_NEA, str(pm.year), month_folder(pm))
-
-    name_cur   = f"Distribution Lines Substation & Power Quality-{stamp_cur}"
-    name_prev  = f"Distribution Lines Substation & Power Quality-{stamp_prev}"
-    path_prev  = os.path.join(base_prev, name_prev)
-    path_cur   = os.path.join(base_cur, name_cur)
-    comp       = os.path.join(base_sup, f"COMPLETE DATA {d.year}.xlsx")
-
-    os.makedirs(os.path.dirname(path_cur), exist_ok=True)
-    if os.path.exists(path_prev):
-        shutil.copy2(path_prev, path_cur)
-    else:
-        app = xw.App(visible=False)
-        w   = app.books.add()
-        w.sheets[0].name = "DistLines,Subs,and PowerQuality"
-        w.save(path_cur)
-        w.close()
-        app.quit()
-
-    app = xw.App(visible=False)
-    wb  = app.books.open(comp)
-    sh  = wb.sheets["DATA"]
+    path_prev  = report_path("Distribution Lines Substation & Power Quality", pm)
+    path_cur   = report_path("Distribution Lines Substation & Power Quality", d)
+    comp       = supporting_doc(f"COMPLETE DATA {d.year}.xlsx", d)
+
     row = 3 + d.month
     areas = [
         ("Toledo",      "BI", "BJ", 70),
@@ -515,10 +436,12 @@ def process_distribution(offset: int = 1) -> list[str]:
         ("Asturias",    "DQ", "DR", 73),
         ("Pinamungajan","FD", "FE", 74)
     ]
+    # Only the month's row of the DATA sheet is parsed, straight from the file
+    cells = read_cells(comp, "DATA", [f"{c}{row}" for _, pc, oc, _ in areas for c in (pc, oc)])
     data = {}
     for nm, pc, oc, _ in areas:
-        pk = sh.range(f"{pc}{row}").value or 0
-        op = sh.range(f"{oc}{row}").value or 0
+        pk = cells[f"{pc}{row}"] or 0
+        op = cells[f"{oc}{row}"] or 0
         s3 = math.sqrt(3)
         if nm in ("Toledo","Lutupan","Pinamungajan"):
             pc_v = (pk * s3) / 1000
@@ -531,50 +454,130 @@ def process_distribution(offset: int = 1) -> list[str]:
             pc_v = sp_v * (67000 / 13200)
             oc_v = so_v * (67000 / 13200)
         data[nm] = (pc_v, oc_v, sp_v, so_v)
-    wb.close()
-    app.quit()
-
-    app = xw.App(visible=False)
-    wb  = app.books.open(path_cur)
-    sh  = wb.sheets["DistLines,Subs,and PowerQuality"]
-    sh.range("C3").value = d.strftime("%B")
-    sh.range("C4").value = d.year
-    for nm, _, _, rw in areas:
-        pc_v, oc_v, sp_v, so_v = data[nm]
-        sh.range(f"D{rw}").value = pc_v
-        sh.range(f"E{rw}").value = oc_v
-        sh.range(f"F{rw}").value = sp_v
-        sh.range(f"G{rw}").value = so_v
-    wb.save()
-    wb.close()
-    app.quit()
+
+    with BOOKS.session():
+        carry_forward(path_prev, path_cur, ["DistLines,Subs,and PowerQuality"])
+
+        with BOOKS.open(path_cur) as wb:
+            sh = wb.sheet("DistLines,Subs,and PowerQuality")
+            sh["C3"] = d.strftime("%B")
+            sh["C4"] = d.year
+            for nm, _, _, rw in areas:
+                pc_v, oc_v, sp_v, so_v = data[nm]
+                sh[f"D{rw}"] = pc_v
+                sh[f"E{rw}"] = oc_v
+                sh[f"F{rw}"] = sp_v
+                sh[f"G{rw}"] = so_v
 
     return [path_cur]
 
+# ─────────── Step Graph ───────────
+
+@dataclass
+class Step:
+    """
+    A report step and the files it reads and writes for a given month,
+    so ``dag.run`` can order dependent steps and run the rest concurrently.
+    """
+    name: str
+    fn: Callable[[int], list[str]]
+    pool: str                                              # "excel" or "cpu", see dag.py
+    io: Callable[[datetime], tuple[list[str], list[str]]]  # d -> (inputs, outputs)
+
+    def node(self, offset: int, name: str | None = None,
+             fn: Callable[[], object] | None = None, force: bool = False) -> dag.Node:
+        """Build the DAG node for 'offset'; ``fn`` replaces the plain step call."""
+        inputs, outputs = self.io(target_date(offset))
+        return dag.Node(
+            name=name or self.name,
+            fn=fn or partial(self._call, offset, force),
+            inputs=inputs,
+            outputs=outputs,
+            pool=self.pool,
+        )
+
+    def up_to_date(self, offset: int) -> bool:
+        """Whether the build manifest says this step needn't run for 'offset'."""
+        d = target_date(offset)
+        inputs, outputs = self.io(d)
+        return BUILD.lookup(build_key(self.fn.__name__, d), BUILD.fingerprint(inputs), outputs) is not None
+
+    def _call(self, offset: int, force: bool = False) -> list[str]:
+        # One workbook session per step, in the worker thread that runs it
+        with BOOKS.session():
+            return self.fn(offset, force=force)
+
+def _carried(prefix: str, *sources):
+    """io() for a step that updates '<prefix>' from last month's copy plus ``sources``."""
+    def io(d: datetime) -> tuple[list[str], list[str]]:
+        inputs = [report_path(prefix, prev_month(d))] + [src(d) for src in sources]
+        return inputs, [report_path(prefix, d)]
+    return io
+
+def _io_pdc(d: datetime) -> tuple[list[str], list[str]]:
+    pm = prev_month(d)
+    return ([report_path(p, pm) for p in PDC_REPORTS],
+            [report_path(p, d) for p in PDC_REPORTS])
+
+def _io_interruption(d: datetime) -> tuple[list[str], list[str]]:
+    # The ERC inputs are glob patterns; they never match another step's output
+    name = "Energy and Interruption Data"
+    return [report_path(name, prev_month(d)), *erc_patterns(d)], [report_path(name, d)]
+
+STEPS = [
+    Step("PDC/PGC/PSR",  process_pdc,          "excel", _io_pdc),
+    Step("Interruption", process_interruption, "excel", _io_interruption),
+    Step("Supply OCR",   process_supply,       "cpu",
+         _carried("Power Supply", partial(supporting_doc, "17MW.pdf"),
+                  partial(supporting_doc, "Excess.pdf"),
+                  lambda d: supporting_doc(f"Fscsrd{d.year}.xlsx", d))),
+    Step("NGCP OCR",     process_ngcp,         "cpu",
+         _carried("NGCP Bill", partial(supporting_doc, "NGCP BILL.pdf"))),
+    Step("Distribution", process_distribution, "excel",
+         _carried("Distribution Lines Substation & Power Quality",
+                  lambda d: supporting_doc(f"COMPLETE DATA {d.year}.xlsx", d))),
+]
+# Task.function_name -> Step, for the dashboard
+STEPS_BY_FUNCTION = {step.fn.__name__: step for step in STEPS}
+
+def missing_inputs(offset: int = 1, steps: list[Step] | None = None) -> dict[str, list[tuple[str, bool]]]:
+    """
+    {step name: [(path or pattern, required)]} for the inputs of each step
+    (default: all of them) that aren't on the share yet, answered from
+    ``CATALOG``. Last month's
+    copy of a step's own workbook is optional: without it the step
+    starts from a blank workbook.
+    """
+    d = target_date(offset)
+    missing = {}
+    for step in steps or STEPS:
+        inputs, _ = step.io(d)
+        carried   = set(step.io(prev_month(d))[1])
+        # glob() covers plain paths too
+        absent  = [(p, p not in carried) for p in inputs if not CATALOG.glob(p)]
+        if absent:
+            missing[step.name] = absent
+    return missing
+
 # ─────────── Combined Runner Function ───────────
 
-def run_all(offset: int = 1) -> list[str]:
+def run_all(offset: int = 1, force: bool = False) -> list[str]:
     """
-    Run all five reports in sequence using the given offset.
-    Returns a combined list of all generated file paths.
+    Run all five reports for the given offset. Steps that don't read each
+    other's files run at the same time (see dag.py), and steps whose
+    inputs are unchanged are skipped unless 'force' is set.
+    Returns a combined list of all generated file paths, in step order.
     """
-    steps = [
-        ("PDC/PGC/PSR",   process_pdc),
-        ("Interruption",  process_interruption),
-        ("Supply OCR",    process_supply),
-        ("NGCP OCR",      process_ngcp),
-        ("Distribution",  process_distribution),
-    ]
+    results = dag.run([step.node(offset, force=force) for step in STEPS])
 
     all_paths: list[str] = []
-    for name, fn in steps:
-        try:
-            pts = fn(offset)
-            if pts:
-                all_paths.extend(pts)
-        except Exception as e:
+    for step in STEPS:
+        res = results[step.name]
+        if res.status != "SUCCESS":
             # Let the caller catch or log this exception as needed
-            raise RuntimeError(f"Error in step '{name}': {e}") from e
+            raise RuntimeError(f"Error in step '{step.name}': {res.error}") from res.error
+        if res.value:
+            all_paths.extend(res.value)
 
     # If no files were produced, return empty list
     return all_paths
@@ -0,0 +1,286 @@
+# ocr.py
+
+"""
+Batch OCR for the report steps.
+
+``ocr_batch`` takes a list of (image, tesseract config) jobs and returns
+the recognised strings in the same order. Jobs are spread over a shared
+process pool of ``OCR_WORKERS`` workers (default: one per CPU), so the
+~10 fields of a bill are read in parallel rather than one after another.
+
+Recognition goes through an ``OcrEngine``. The default ``tesserocr``
+engine keeps one libtesseract handle per worker thread and per config
+(page segmentation mode, ``-c`` variables) alive between calls, so a
+single-line field doesn't pay for starting tesseract.exe, writing temp
+files and reloading the language model. ``pytesseract`` (a subprocess per
+call) is used when tesserocr isn't installed, or with
+``OCR_ENGINE=pytesseract``.
+
+Crops are preprocessed in the calling process, as one batch, by the
+shared ``ocr_preprocess`` pipeline and looked up in ``ocr_cache`` first;
+only cache misses are sent to the workers.
+
+Run ``python ocr.py`` to benchmark the engines on the report's box sizes.
+"""
+
+import atexit
+import os
+import shlex
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytesseract
+from PIL import Image
+
+import ocr_cache
+import ocr_preprocess
+import run_stats
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "0")) or (os.cpu_count() or 1)
+# "auto" (tesserocr when available), "tesserocr" or "pytesseract"
+OCR_ENGINE  = os.environ.get("OCR_ENGINE", "auto").lower()
+OCR_LANG    = os.environ.get("OCR_LANG", "eng")
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+# ─────────── Engines ───────────
+
+def parse_config(config: str) -> tuple[int, dict[str, str]]:
+    """Split '--psm 6 -c a=b' into (6, {'a': 'b'}). The psm defaults to 3."""
+    psm, variables = 3, {}
+    args = shlex.split(config)
+    for i, arg in enumerate(args):
+        if arg == "--psm" and i + 1 < len(args):
+            psm = int(args[i + 1])
+        elif arg == "-c" and i + 1 < len(args):
+            name, _, value = args[i + 1].partition("=")
+            variables[name] = value
+    return psm, variables
+
+
+class OcrEngine:
+    name = ""
+
+    def recognize(self, img: Image.Image, config: str) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    """Runs tesseract.exe once per call."""
+    name = "pytesseract"
+
+    def recognize(self, img, config):
+        return pytesseract.image_to_string(img, config=config)
+
+
+class TesserocrEngine(OcrEngine):
+    """Long-lived libtesseract handles, one per distinct config."""
+    name = "tesserocr"
+
+    def __init__(self, lang: str = OCR_LANG):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self._lang      = lang
+        self._tessdata  = self._tessdata_path()
+        self._apis: dict[tuple, object] = {}
+
+    @staticmethod
+    def _tessdata_path() -> str | None:
+        if os.environ.get("TESSDATA_PREFIX"):
+            return os.environ["TESSDATA_PREFIX"]
+        # Windows installs keep tessdata next to tesseract.exe
+        cand = os.path.join(os.path.dirname(pytesseract.pytesseract.tesseract_cmd), "tessdata")
+        return cand if os.path.isdir(cand) else None
+
+    def _api(self, config: str):
+        psm, variables = parse_config(config)
+        key = (psm, tuple(sorted(variables.items())))
+        api = self._apis.get(key)
+        if api is None:
+            kwargs = {"lang": self._lang, "psm": psm}
+            if self._tessdata:
+                kwargs["path"] = self._tessdata
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            for name, value in variables.items():
+                api.SetVariable(name, value)
+            self._apis[key] = api
+        return api
+
+    def recognize(self, img, config):
+        api = self._api(config)
+        api.SetImage(img)
+        return api.GetUTF8Text()
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+ENGINES: dict[str, type[OcrEngine]] = {
+    TesserocrEngine.name:   TesserocrEngine,
+    PytesseractEngine.name: PytesseractEngine,
+}
+
+_engines = threading.local()
+_engine_name: str | None = None
+
+def make_engine(name: str = OCR_ENGINE) -> OcrEngine:
+    """Create an engine; "auto" falls back to pytesseract without tesserocr."""
+    if name != "auto":
+        return ENGINES[name]()
+    try:
+        return TesserocrEngine()
+    except (ImportError, RuntimeError):
+        return PytesseractEngine()
+
+def engine_name() -> str:
+    """The name of the engine ``make_engine()`` picks here, resolving "auto"."""
+    global _engine_name
+    if _engine_name is None:
+        engine = make_engine()
+        _engine_name = engine.name
+        engine.close()
+    return _engine_name
+
+def get_engine() -> OcrEngine:
+    """Return this thread's engine, creating it on first use."""
+    engine = getattr(_engines, "engine", None)
+    if engine is None:
+        engine = _engines.engine = make_engine()
+    return engine
+
+
+# ─────────── Batches ───────────
+
+def _ocr_job(job: tuple[Image.Image, str]) -> str:
+    bw, config = job
+    try:
+        return get_engine().recognize(bw, config).strip()
+    except Exception as e:
+        # Engine exceptions don't always survive pickling back to the parent
+        raise RuntimeError(f"OCR failed: {type(e).__name__}: {e}") from None
+
+def _init_worker(tesseract_cmd: str) -> None:
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                initializer=_init_worker,
+                initargs=(pytesseract.pytesseract.tesseract_cmd,),
+            )
+        return _pool
+
+def shutdown() -> None:
+    """Stop the worker processes (they are restarted on the next batch)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+atexit.register(shutdown)
+
+
+@run_stats.timed("ocr")
+def ocr_batch(jobs: list[tuple[Image.Image, str]]) -> list[str]:
+    """
+    OCR every (image, config) job and return the texts in job order.
+    Cached results are reused; small batches, or ``OCR_WORKERS=1``, run
+    inline.
+    """
+    images   = ocr_preprocess.DEFAULT([crop for crop, _ in jobs])
+    prepared = [(bw, config) for bw, (_, config) in zip(images, jobs)]
+    if not ocr_cache.OCR_CACHE:
+        return _recognize_all(prepared)
+
+    # Engines and languages read text differently, so their results are cached apart
+    engine = engine_name()
+    keys   = [ocr_cache.crop_key(bw, config, engine, OCR_LANG) for bw, config in prepared]
+    cached = ocr_cache.CACHE.get_many(keys)
+    todo   = [i for i, key in enumerate(keys) if key not in cached]
+    texts  = _recognize_all([prepared[i] for i in todo])
+    ocr_cache.CACHE.put_many([(keys[i], prepared[i][1], text) for i, text in zip(todo, texts)])
+
+    results = dict(cached)
+    results.update((keys[i], text) for i, text in zip(todo, texts))
+    return [results[key] for key in keys]
+
+def _recognize_all(prepared: list[tuple[Image.Image, str]]) -> list[str]:
+    if OCR_WORKERS <= 1 or len(prepared) <= 1:
+        return [_ocr_job(job) for job in prepared]
+    try:
+        return list(_get_pool().map(_ocr_job, prepared))
+    except BrokenProcessPool:
+        # A worker died (e.g. tesseract crashed); start fresh next time
+        shutdown()
+        raise
+
+
+# ─────────── Benchmark ───────────
+
+# Width x height of the supply (BOX_*) and NGCP (FIELD_MAP) boxes at 600 DPI
+BENCH_BOXES = [
+    (830, 105, "--psm 7"), (662, 96, "--psm 7"), (680, 104, "--psm 7"),
+    (590, 196, "--psm 6 -c tessedit_char_whitelist=0123456789.,"),
+    (521, 83, "--psm 6 -c tessedit_char_whitelist=0123456789.,"),
+    (400, 65, "--psm 7"), (665, 81, "--psm 7"), (235, 83, "--psm 7"),
+    (314, 77, "--psm 7"), (87, 78, "--psm 7"), (378, 65, "--psm 7"),
+]
+
+def _bench_image(width: int, height: int) -> Image.Image:
+    from PIL import ImageDraw, ImageFont
+    img  = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.load_default(size=int(height * 0.6))
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    draw.text((8, height // 6), "1,234,567.89", fill=0, font=font)
+    return img
+
+def benchmark(rounds: int = 10) -> dict[str, float]:
+    """
+    OCR every benchmark box ``rounds`` times with each available engine on
+    a single thread and print the mean milliseconds per field.
+    """
+    jobs    = [(_bench_image(w, h), cfg) for w, h, cfg in BENCH_BOXES]
+    results = {}
+    for name in ENGINES:
+        try:
+            engine = make_engine(name)
+            engine.recognize(*jobs[0])  # warm up
+        except Exception as e:
+            print(f"{name:12s} unavailable ({type(e).__name__}: {e})")
+            continue
+        prepared = ocr_preprocess.DEFAULT([img for img, _ in jobs])
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for img, (_, cfg) in zip(prepared, jobs):
+                engine.recognize(img, cfg)
+        per_field = (time.perf_counter() - start) * 1000 / (rounds * len(jobs))
+        engine.close()
+        results[name] = per_field
+        print(f"{name:12s} {per_field:8.1f} ms/field")
+    if len(results) == 2:
+        print(f"speed-up     {results['pytesseract'] / results['tesserocr']:8.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    if os.environ.get("TESSERACT_CMD"):
+        pytesseract.pytesseract.tesseract_cmd = os.environ["TESSERACT_CMD"]
+    benchmark()
@@ -0,0 +1,171 @@
+# ocr_cache.py
+
+"""
+Persistent cache of OCR results.
+
+The key is the SHA-256 of the *preprocessed* (binarised) crop plus the
+tesseract config string, the OCR engine and the language, so re-running
+a month whose supporting PDFs haven't changed does no OCR at all, while
+any change to the pixels, the threshold, the config, ``OCR_ENGINE`` or
+``OCR_LANG`` is a miss. Results live in a small SQLite file next to
+``dashboard.sqlite`` (``OCR_CACHE_DB``). Entries not used for
+``OCR_CACHE_MAX_AGE_DAYS`` are purged every
+``OCR_CACHE_PURGE_INTERVAL_HOURS`` by the dashboard scheduler
+(``ocr_cache:purge_expired``), and the cache's size and lifetime hits are
+exported on ``/metrics``.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+import metrics
+import run_stats
+
+OCR_CACHE              = os.environ.get("OCR_CACHE", "True").lower() in ("1", "true", "yes")
+OCR_CACHE_DB           = os.environ.get(
+    "OCR_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_cache.sqlite"),
+)
+OCR_CACHE_MAX_AGE_DAYS = int(os.environ.get("OCR_CACHE_MAX_AGE_DAYS", "180"))
+OCR_CACHE_PURGE_INTERVAL_HOURS = float(os.environ.get("OCR_CACHE_PURGE_INTERVAL_HOURS", "24"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    key        TEXT PRIMARY KEY,
+    config     TEXT NOT NULL,
+    text       TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def crop_key(img: Image.Image, config: str, engine: str = "", lang: str = "") -> str:
+    """Hash of the image mode, size, pixels, the tesseract config, the engine name and language."""
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:{engine}:{lang}:{config}\0".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, path: str = OCR_CACHE_DB, max_age_days: int = OCR_CACHE_MAX_AGE_DAYS):
+        self.path         = path
+        self.max_age_days = max_age_days
+        self.hits         = 0
+        self.misses       = 0
+        self._lock        = threading.Lock()
+        self._ready       = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    conn.execute(_SCHEMA)
+                    conn.commit()
+                    self._ready = True
+        return conn
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Return {key: text} for the keys that are cached, and count hits/misses."""
+        if not keys:
+            return {}
+        conn = self._connect()
+        try:
+            found: dict[str, str] = {}
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                rows  = conn.execute(
+                    f"SELECT key, text FROM ocr_results WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                conn.executemany(
+                    "UPDATE ocr_results SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                    [(time.time(), k) for k in found],
+                )
+                conn.commit()
+        finally:
+            conn.close()
+        hits = sum(1 for k in keys if k in found)
+        with self._lock:
+            self.hits   += hits
+            self.misses += len(keys) - hits
+        run_stats.incr("ocr cache hits", hits)
+        run_stats.incr("ocr cache misses", len(keys) - hits)
+        return found
+
+    def put_many(self, items: list[tuple[str, str, str]]) -> None:
+        """Store (key, config, text) rows."""
+        if not items:
+            return
+        now  = time.time()
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ocr_results (key, config, text, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                [(k, cfg, text, now, now) for k, cfg, text in items],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def purge(self, max_age_days: int | None = None, conn: sqlite3.Connection | None = None) -> int:
+        """Delete entries unused for ``max_age_days``; returns the number removed."""
+        age   = self.max_age_days if max_age_days is None else max_age_days
+        owned = conn is None
+        conn  = conn or self._connect()
+        try:
+            cur = conn.execute("DELETE FROM ocr_results WHERE last_used < ?",
+                               (time.time() - age * 86400,))
+            conn.commit()
+            return cur.rowcount
+        finally:
+            if owned:
+                conn.close()
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counts for this process plus the size of the cache."""
+        conn = self._connect()
+        try:
+            entries, total_hits = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM ocr_results"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": entries, "lifetime_hits": total_hits}
+
+
+CACHE = OcrCache()
+
+
+def purge_expired() -> int:
+    """Scheduled purge of ``CACHE`` (``OCR_CACHE_MAX_AGE_DAYS``)."""
+    if not OCR_CACHE:
+        return 0
+    removed = CACHE.purge()
+    if removed:
+        print(f"Purged {removed} OCR cache entries unused for {CACHE.max_age_days} days")
+    return removed
+
+@metrics.collect
+def _export_stats() -> None:
+    if not OCR_CACHE or not os.path.exists(CACHE.path):
+        return
+    stats = CACHE.stats()
+    metrics.set_gauge("nea_ocr_cache_entries", stats["entries"])
+    metrics.set_gauge("nea_ocr_cache_lifetime_hits", stats["lifetime_hits"])
+
+metrics.describe("nea_ocr_cache_entries", "gauge", "OCR results stored in the OCR cache.")
+metrics.describe("nea_ocr_cache_lifetime_hits", "gauge", "Hits recorded on the stored OCR results, across processes.")
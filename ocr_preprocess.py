@@ -0,0 +1,127 @@
+# ocr_preprocess.py
+
+"""
+Array-based preprocessing for OCR crops.
+
+A ``Pipeline`` turns a batch of crops into black-and-white images in one
+vectorised pass: the crops are converted to grayscale, edge-padded to a
+common size, stacked into one (N, H, W) array and every step runs on the
+whole stack. The default pipeline (grayscale -> 3x3 median -> threshold
+at 140) gives exactly the same pixels as the old
+``crop.convert("L").filter(MedianFilter(3)).point(lambda x: 0 if x < 140 else 255)``.
+
+``OCR_THRESHOLD`` selects the threshold step: a number for a fixed cutoff,
+``otsu`` for a per-crop Otsu threshold, or ``adaptive`` for a local mean
+threshold that copes with uneven scans.
+"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+OCR_THRESHOLD = os.environ.get("OCR_THRESHOLD", "140").lower()
+
+
+# ─────────── Steps ───────────
+# Each step takes (stack, mask): ``stack`` is an (N, H, W) uint8 array and
+# ``mask`` is True where a pixel belongs to the original crop (the rest
+# is edge padding). Steps return the new stack.
+
+def to_gray(img: Image.Image) -> np.ndarray:
+    """Grayscale array using Pillow's own fixed-point ITU-R 601-2 weights."""
+    if img.mode == "L":
+        return np.asarray(img, dtype=np.uint8)
+    rgb = np.asarray(img.convert("RGB"), dtype=np.uint32)
+    lum = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000
+    return (lum >> 16).astype(np.uint8)
+
+def median3(stack: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """3x3 median with replicated edges (what ImageFilter.MedianFilter(3) does)."""
+    n, h, w = stack.shape
+    padded  = np.pad(stack, ((0, 0), (1, 1), (1, 1)), mode="edge")
+    windows = np.stack(
+        [padded[:, dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)], axis=-1
+    )
+    return np.partition(windows, 4, axis=-1)[..., 4]
+
+def threshold_fixed(cutoff: int = 140):
+    def step(stack: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        return np.where(stack < cutoff, 0, 255).astype(np.uint8)
+    step.__name__ = f"threshold_{cutoff}"
+    return step
+
+def threshold_otsu(stack: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Per-crop Otsu threshold, computed from the crop's own pixels only."""
+    out = np.empty_like(stack)
+    levels = np.arange(256, dtype=np.float64)
+    for i in range(stack.shape[0]):
+        hist  = np.bincount(stack[i][mask[i]], minlength=256).astype(np.float64)
+        w0    = np.cumsum(hist)
+        w1    = w0[-1] - w0
+        sum0  = np.cumsum(hist * levels)
+        mu0   = np.divide(sum0, w0, out=np.zeros(256), where=w0 > 0)
+        mu1   = np.divide(sum0[-1] - sum0, w1, out=np.zeros(256), where=w1 > 0)
+        cut   = int(np.argmax(w0 * w1 * (mu0 - mu1) ** 2))
+        out[i] = np.where(stack[i] <= cut, 0, 255)
+    return out
+
+def threshold_adaptive(block: int = 31, offset: int = 10):
+    """Black where a pixel is ``offset`` darker than its ``block`` x ``block`` mean."""
+    r = block // 2
+
+    def step(stack: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        n, h, w = stack.shape
+        padded  = np.pad(stack.astype(np.int64), ((0, 0), (r + 1, r), (r + 1, r)), mode="edge")
+        padded[:, 0, :] = 0
+        padded[:, :, 0] = 0
+        integral = padded.cumsum(axis=1).cumsum(axis=2)
+        b = 2 * r + 1
+        total = (integral[:, b:b + h, b:b + w] - integral[:, :h, b:b + w]
+                 - integral[:, b:b + h, :w] + integral[:, :h, :w])
+        mean = total / (b * b)
+        return np.where(stack < mean - offset, 0, 255).astype(np.uint8)
+    step.__name__ = f"threshold_adaptive_{block}"
+    return step
+
+
+# ─────────── Pipeline ───────────
+
+class Pipeline:
+    def __init__(self, steps: list):
+        self.steps = steps
+
+    @classmethod
+    def from_env(cls, threshold: str = OCR_THRESHOLD) -> "Pipeline":
+        if threshold == "otsu":
+            last = threshold_otsu
+        elif threshold == "adaptive":
+            last = threshold_adaptive()
+        else:
+            last = threshold_fixed(int(threshold))
+        return cls([median3, last])
+
+    def __repr__(self):
+        return "Pipeline(" + " -> ".join(s.__name__ for s in self.steps) + ")"
+
+    def __call__(self, crops: list[Image.Image]) -> list[Image.Image]:
+        """Run every step over the whole batch; returns mode "L" images."""
+        if not crops:
+            return []
+        grays = [to_gray(c) for c in crops]
+        h = max(g.shape[0] for g in grays)
+        w = max(g.shape[1] for g in grays)
+        stack = np.empty((len(grays), h, w), dtype=np.uint8)
+        mask  = np.zeros((len(grays), h, w), dtype=bool)
+        for i, g in enumerate(grays):
+            gh, gw = g.shape
+            # Edge padding keeps neighbourhood steps exact at the crop border
+            stack[i] = np.pad(g, ((0, h - gh), (0, w - gw)), mode="edge")
+            mask[i, :gh, :gw] = True
+        for step in self.steps:
+            stack = step(stack, mask)
+        return [Image.fromarray(stack[i, :g.shape[0], :g.shape[1]], mode="L")
+                for i, g in enumerate(grays)]
+
+
+DEFAULT = Pipeline.from_env()
@@ -0,0 +1,225 @@
+# pdf_render.py
+
+"""
+Cached PDF region rendering for the OCR steps.
+
+Rasterizing at 600 DPI is expensive, and dashboard re-runs (another
+offset, a retry after a failed save) used to redo it every time. Rendered
+regions are stored as PNG files under ``PDF_CACHE_DIR``, keyed by the PDF's
+content hash, the page number, the DPI, the colour mode and the box, so a
+changed PDF never returns a stale image. The cache is bounded by
+``PDF_CACHE_MAX_MB``; the least recently used files are evicted first.
+
+The OCR steps only read a few small boxes per page, so ``render_region``
+asks poppler for just that box instead of the whole page. A 600 DPI A4
+page is ~5000x6600 RGB (~100 MB); a field box is a few hundred KB.
+"""
+
+import contextvars
+import hashlib
+import io
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf2image import pdfinfo_from_path
+from PIL import Image
+
+import run_stats
+
+PDF_CACHE_DIR    = os.environ.get(
+    "PDF_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_cache"),
+)
+PDF_CACHE_MAX_MB = int(os.environ.get("PDF_CACHE_MAX_MB", "2048"))
+# pdftoppm processes run at once by render_regions
+PDF_RENDER_THREADS = int(os.environ.get("PDF_RENDER_THREADS", "4"))
+# Folder holding pdftoppm/pdfinfo when poppler is not on PATH
+POPPLER_PATH     = os.environ.get("POPPLER_PATH") or None
+
+_digests: dict[tuple[str, int, int], str] = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """
+    Return the SHA-256 of a file's content. Results are memoised by
+    (path, size, mtime) so an unchanged file is only read once per process.
+    """
+    st  = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digests[key] = digest
+    return digest
+
+
+class RenderCache:
+    """
+    Size-bounded LRU directory of rendered region images. The total size
+    is counted once and then kept up to date by ``put()``; the directory
+    is only walked again when it goes over ``max_bytes``, and eviction
+    then goes down to 90% of it so the next puts don't walk it again.
+    """
+
+    def __init__(self, root: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_MB << 20):
+        self.root      = root
+        self.max_bytes = max_bytes
+        self._lock     = threading.Lock()
+        self._size: int | None = None   # bytes of .png files, None until first counted
+
+    @staticmethod
+    def key(digest: str, page: int, dpi: int, mode: str, box: tuple[int, int, int, int]) -> str:
+        return f"{digest}-p{page}-{dpi}dpi-{mode}-" + "_".join(str(v) for v in box)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".png")
+
+    def get(self, key: str) -> Image.Image | None:
+        path = self._path(key)
+        try:
+            img = Image.open(path)
+            img.load()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            # Missing, unreadable, or evicted by another worker meanwhile
+            return None
+        return img
+
+    def put(self, key: str, img: Image.Image) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp, format="PNG", compress_level=1)
+        added = os.path.getsize(tmp)
+        try:
+            added -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += added
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".png"):
+                    continue
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Recount the cache and, if it is over ``max_bytes``, delete least
+        recently used files until it fits in 90% of it.
+        """
+        with self._lock:
+            entries = self._scan()
+            total   = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                target = self.max_bytes * 9 // 10
+                for _, size, p in sorted(entries):
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+            self._size = total
+
+
+CACHE = RenderCache()
+
+
+def page_count(pdf_path: str, userpw: str | None = None) -> int:
+    """Return the number of pages in ``pdf_path``."""
+    return int(pdfinfo_from_path(pdf_path, userpw=userpw, poppler_path=POPPLER_PATH)["Pages"])
+
+def render_region(
+    pdf_path: str,
+    page: int,
+    box: tuple[int, int, int, int],
+    dpi: int,
+    userpw: str | None = None,
+) -> Image.Image:
+    """
+    Rasterize only ``box`` = (left, top, right, bottom), in pixels at
+    ``dpi``, of the 1-based ``page`` and return it as a grayscale image.
+
+    The result is pixel-identical to
+    ``convert_from_path(...)[0].crop(box).convert("L")``: poppler renders
+    the slice with the same transform as the full page, the RGB->L step
+    is done by Pillow (poppler's own -gray output uses different luma
+    weights), and parts of the box outside the page are black, as with
+    ``crop``.
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(2, "No such file", pdf_path)
+    left, top, right, bottom = box
+    key = RenderCache.key(file_digest(pdf_path), page, dpi, "L", box)
+    img = CACHE.get(key)
+    if img is not None:
+        run_stats.incr("render cache hits")
+        return img
+    run_stats.incr("render cache misses")
+
+    exe = os.path.join(POPPLER_PATH, "pdftoppm") if POPPLER_PATH else "pdftoppm"
+    cmd = [
+        exe, "-f", str(page), "-l", str(page), "-r", str(dpi),
+        "-x", str(left), "-y", str(top),
+        "-W", str(right - left), "-H", str(bottom - top),
+    ]
+    if userpw:
+        cmd += ["-upw", userpw]
+    cmd.append(pdf_path)
+    proc = subprocess.run(cmd, capture_output=True, check=False)
+    if proc.returncode != 0 or not proc.stdout:
+        raise RuntimeError(
+            f"pdftoppm failed on {os.path.basename(pdf_path)} page {page}: "
+            + proc.stderr.decode(errors="ignore").strip()
+        )
+    rendered = Image.open(io.BytesIO(proc.stdout)).convert("L")
+
+    img = Image.new("L", (right - left, bottom - top), 0)
+    img.paste(rendered, (0, 0))
+    CACHE.put(key, img)
+    return img
+
+@run_stats.timed("render")
+def render_regions(
+    regions: list[tuple[str, int, tuple[int, int, int, int]]],
+    dpi: int,
+    userpw: str | None = None,
+) -> list[Image.Image]:
+    """
+    Render many (pdf_path, page, box) regions, possibly from different
+    PDFs, concurrently. Returns the images in the order given.
+    """
+    if len(regions) <= 1 or PDF_RENDER_THREADS <= 1:
+        return [render_region(pdf, page, box, dpi, userpw) for pdf, page, box in regions]
+    with ThreadPoolExecutor(max_workers=min(PDF_RENDER_THREADS, len(regions))) as ex:
+        # Each job gets its own context copy so run_stats counters still land
+        futures = [
+            ex.submit(contextvars.copy_context().run, render_region, pdf, page, box, dpi, userpw)
+            for pdf, page, box in regions
+        ]
+        return [f.result() for f in futures]
@@ -23,6 +23,7 @@ with app.app_context():
                 function_name=func,
                 schedule="0 0 28 * *",   # always run on the 28th at 00:00
                 default_offset=1,
+                watch_inputs=True,        # ...or earlier, once the month's inputs are in
             )
             db.session.add(new_task)
 
@@ -3,7 +3,10 @@
 import sys
 from dashboard.app import create_app
 
-app = create_app()
+# OCR worker processes re-import the main module when they are spawned
+# (Windows); they must not build a second app and scheduler.
+if __name__ != "__mp_main__":
+    app = create_app()
 
 def init_db():
     # Simply ensures that the SQLite file and tables are created.
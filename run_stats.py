@@ -0,0 +1,92 @@
+# run_stats.py
+
+"""
+Per-run counters and phase timings.
+
+Library code calls ``incr("render cache hits")`` or wraps work in
+``span("ocr")`` (or ``@timed("ocr")``) without knowing who is listening.
+``dashboard.scheduler.run_task_by_id`` wraps each task in ``collect()``,
+appends ``summary()`` to the TaskLog message and stores ``timings`` per
+run. Outside a ``collect()`` block only the process-wide totals in
+``metrics`` are kept.
+"""
+
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+import metrics
+
+_current: contextvars.ContextVar["RunStats | None"] = contextvars.ContextVar(
+    "run_stats", default=None
+)
+
+
+class RunStats:
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self.counters = Counter()
+        # phase -> [seconds, calls]; overlapping phases (e.g. a read inside a write) each count in full
+        self.timings: dict[str, list] = {}
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.timings.setdefault(phase, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def summary(self) -> str:
+        """Return e.g. 'render cache hits: 3, render cache misses: 1'."""
+        with self._lock:
+            return ", ".join(f"{k}: {v}" for k, v in sorted(self.counters.items()))
+
+    def __bool__(self):
+        return bool(self.counters)
+
+
+@contextmanager
+def collect():
+    """Collect counters bumped in this context (and threads it hands off to)."""
+    stats = RunStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+def incr(name: str, n: int = 1) -> None:
+    """Bump ``name`` on the active collector, if any."""
+    metrics.inc("nea_run_events_total", {"event": name}, n)
+    stats = _current.get()
+    if stats is not None:
+        stats.incr(name, n)
+
+@contextmanager
+def span(phase: str):
+    """Time the block as ``phase``, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("nea_phase_seconds", seconds, {"phase": phase})
+        stats = _current.get()
+        if stats is not None:
+            stats.add_time(phase, seconds)
+
+def timed(phase: str):
+    """Decorator form of ``span(phase)``."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,42 @@
+# tests/conftest.py
+
+"""
+Shared setup for the test modules: the repository root goes on
+``sys.path`` so the top-level modules import as they do under run.py,
+Excel is replaced by the in-process fake backend (see excel_session.py),
+and the settings nea_reports requires point at a scratch directory, so
+importing it (as the dashboard modules do) touches neither the shares
+nor the caches next to the code.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_scratch = tempfile.mkdtemp(prefix="neabit-tests-")
+for name in ("nea", "erc"):
+    os.makedirs(os.path.join(_scratch, name), exist_ok=True)
+
+for key, value in {
+    "EXCEL_BACKEND":    "fake",
+    "WORKBOOK_BACKEND": "python",
+    "SENDER_EMAIL":     "reports@example.com",
+    "SENDER_PASSWORD":  "",
+    "RECIPIENT_EMAILS": "boss@example.com",
+    "BASE_NEA":         os.path.join(_scratch, "nea"),
+    "BASE_ERC":         os.path.join(_scratch, "erc"),
+    "PDF_PASSWORD":     "",
+    "TESSERACT_CMD":    "tesseract",
+    "DATABASE_URL":     "sqlite:///" + os.path.join(_scratch, "dashboard.sqlite"),
+    "MAIL_OUTBOX_DB":   os.path.join(_scratch, "mail_outbox.sqlite"),
+    "MAIL_SPOOL_DIR":   os.path.join(_scratch, "mail_spool"),
+    "BUILD_MANIFEST":   os.path.join(_scratch, "build_manifest.json"),
+    "OCR_CACHE_DB":     os.path.join(_scratch, "ocr_cache.sqlite"),
+    "PDF_CACHE_DIR":    os.path.join(_scratch, "render_cache"),
+    "ERC_CACHE_DIR":    os.path.join(_scratch, "erc_cache"),
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,307 @@
+# tests/imap_stub.py
+
+"""
+Plain-text IMAP stand-in on localhost for the approval watcher tests.
+
+Speaks just enough IMAP4rev1 for ``mail_watch.ApprovalWatcher``: LOGIN,
+SELECT (with UIDVALIDITY/UIDNEXT), UID SEARCH over UID ranges, FROM,
+SINCE, HEADER and OR, UID FETCH of header fields, BODYSTRUCTURE and
+partial BODY.PEEK sections of single-part text/plain messages, UID
+STORE, NOOP, IDLE and LOGOUT. Every command is recorded in
+``commands``.
+"""
+
+import email
+import email.utils
+import re
+import select
+import socketserver
+import threading
+from datetime import datetime
+
+
+class Message:
+    def __init__(self, uid: int, raw: bytes):
+        self.uid   = uid
+        self.raw   = raw
+        self.msg   = email.message_from_bytes(raw)
+        self.flags: set[str] = set()
+
+    @property
+    def body(self) -> bytes:
+        return self.raw.split(b"\r\n\r\n", 1)[1] if b"\r\n\r\n" in self.raw else b""
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\(|\)|[^\s()]+', text)
+
+def _unquote(token: str) -> str:
+    if token.startswith('"'):
+        return re.sub(r"\\(.)", r"\1", token[1:-1])
+    return token
+
+def _uid_range(spec: str, uids: list[int]) -> set[int]:
+    top = max(uids, default=0)
+    out = set()
+    for part in spec.split(","):
+        lo, _, hi = part.partition(":")
+        lo = top if lo == "*" else int(lo)
+        hi = lo if not hi else (top if hi == "*" else int(hi))
+        lo, hi = min(lo, hi), max(lo, hi)
+        out.update(u for u in uids if lo <= u <= hi)
+    return out
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, idle: bool = True):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.idle        = idle
+        self.uidvalidity = 1
+        self.messages: list[Message] = []
+        self.commands: list[str] = []
+        self.connections = 0
+        self.lock        = threading.Condition()
+        self._next_uid   = 1
+        self._handlers: list["_Handler"] = []
+        # Messages delivered right after the next "UID n:*" SEARCH reply, announced in the
+        # same write, so imaplib buffers the EXISTS without reading it
+        self.trailing: list[bytes] = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "FakeImapServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.drop()
+        self.shutdown()
+        self.server_close()
+
+    def _add(self, raw: bytes) -> int:
+        # Caller holds the lock
+        uid = self._next_uid
+        self._next_uid += 1
+        self.messages.append(Message(uid, raw))
+        return uid
+
+    def deliver(self, raw: bytes) -> int:
+        """Add a message and wake IDLE-ing connections; returns its UID."""
+        with self.lock:
+            uid = self._add(raw)
+            self.lock.notify_all()
+        return uid
+
+    def drop(self) -> None:
+        """Close every client connection, as a server restart would."""
+        with self.lock:
+            handlers, self._handlers = self._handlers, []
+        for h in handlers:
+            h.close()
+
+    def seen(self, uid: int) -> bool:
+        with self.lock:
+            return any(m.uid == uid and "\\Seen" in m.flags for m in self.messages)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.closed    = False
+        self.announced = 0
+        with self.server.lock:
+            self.server.connections += 1
+            self.server._handlers.append(self)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.request.shutdown(2)
+        except OSError:
+            pass
+
+    def send(self, *lines: bytes | str) -> None:
+        data = b"".join((l.encode() if isinstance(l, str) else l) + b"\r\n" for l in lines)
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def handle(self):
+        caps = "IMAP4rev1 IDLE" if self.server.idle else "IMAP4rev1"
+        self.send(f"* OK [CAPABILITY {caps}] stub ready")
+        while not self.closed:
+            try:
+                line = self.rfile.readline()
+            except OSError:
+                return
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            cmd, _, args = rest.partition(" ")
+            cmd = cmd.upper()
+            if cmd == "UID":
+                sub, _, args = args.partition(" ")
+                cmd = "UID " + sub.upper()
+            with self.server.lock:
+                self.server.commands.append(cmd)
+            handler = getattr(self, "do_" + cmd.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command")
+                continue
+            try:
+                if handler(tag, args) is False:
+                    return
+            except OSError:
+                return
+
+    # ─────────── Commands ───────────
+
+    def do_CAPABILITY(self, tag, args):
+        self.send("* CAPABILITY IMAP4rev1" + (" IDLE" if self.server.idle else ""), f"{tag} OK done")
+
+    def do_LOGIN(self, tag, args):
+        self.send(f"{tag} OK logged in")
+
+    def do_SELECT(self, tag, args):
+        with self.server.lock:
+            n, uidnext = len(self.server.messages), self.server._next_uid
+            self.announced = n
+            validity = self.server.uidvalidity
+        self.send(f"* {n} EXISTS", f"* OK [UIDVALIDITY {validity}] ok",
+                  f"* OK [UIDNEXT {uidnext}] ok", f"{tag} OK [READ-WRITE] selected")
+
+    def do_NOOP(self, tag, args):
+        self.send(*self._news(), f"{tag} OK noop")
+
+    def do_LOGOUT(self, tag, args):
+        self.send("* BYE", f"{tag} OK bye")
+        return False
+
+    def do_UID_SEARCH(self, tag, args):
+        with self.server.lock:
+            msgs  = list(self.server.messages)
+            found = self._search(_tokens(args), msgs)
+            extra = []
+            if self.server.trailing and ":*" in args:
+                for raw in self.server.trailing:
+                    self.server._add(raw)
+                self.server.trailing = []
+                self.announced = len(self.server.messages)
+                extra = [f"* {self.announced} EXISTS"]
+        self.send("* SEARCH " + " ".join(str(u) for u in sorted(found)), f"{tag} OK search", *extra)
+
+    def do_UID_FETCH(self, tag, args):
+        uid_spec, _, items = args.partition(" ")
+        with self.server.lock:
+            msgs = [m for m in self.server.messages
+                    if m.uid in _uid_range(uid_spec, [m.uid for m in self.server.messages])]
+            seqs = {m.uid: i + 1 for i, m in enumerate(self.server.messages)}
+        for m in msgs:
+            self._fetch(seqs[m.uid], m, items.strip("()"))
+        self.send(f"{tag} OK fetch")
+
+    def do_UID_STORE(self, tag, args):
+        uid, _, rest = args.partition(" ")
+        with self.server.lock:
+            for i, m in enumerate(self.server.messages):
+                if m.uid == int(uid):
+                    m.flags.update(re.findall(r"\\\w+", rest))
+                    self.send(f"* {i + 1} FETCH (UID {m.uid} FLAGS ({' '.join(sorted(m.flags))}))")
+        self.send(f"{tag} OK store")
+
+    def do_IDLE(self, tag, args):
+        self.send("+ idling")
+        while not self.closed:
+            news = self._news()
+            if news:
+                self.send(*news)
+            # The client waits for "+" before DONE, so nothing is buffered in rfile yet
+            if select.select([self.request], [], [], 0.05)[0]:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    self.send(f"{tag} OK idle done")
+                    return
+            with self.server.lock:
+                if len(self.server.messages) == self.announced:
+                    self.server.lock.wait(0.05)
+        return False
+
+    # ─────────── Helpers ───────────
+
+    def _news(self) -> list[str]:
+        with self.server.lock:
+            n = len(self.server.messages)
+            if n == self.announced:
+                return []
+            self.announced = n
+        return [f"* {n} EXISTS", "* 1 RECENT"]
+
+    def _search(self, tokens: list[str], msgs: list[Message]) -> set[int]:
+        uids = [m.uid for m in msgs]
+        pos  = 0
+
+        def key() -> set[int]:
+            nonlocal pos
+            tok = tokens[pos].upper()
+            pos += 1
+            if tok == "(":
+                out = set(uids)
+                while tokens[pos] != ")":
+                    out &= key()
+                pos += 1
+                return out
+            if tok == "ALL":
+                return set(uids)
+            if tok == "OR":
+                return key() | key()
+            if tok == "UID":
+                pos += 1
+                return _uid_range(tokens[pos - 1], uids)
+            if tok == "FROM":
+                pos += 1
+                want = _unquote(tokens[pos - 1]).lower()
+                return {m.uid for m in msgs if want in (m.msg["From"] or "").lower()}
+            if tok == "SINCE":
+                pos += 1
+                since = datetime.strptime(_unquote(tokens[pos - 1]), "%d-%b-%Y").date()
+                return {m.uid for m in msgs
+                        if email.utils.parsedate_to_datetime(m.msg["Date"]).date() >= since}
+            if tok == "HEADER":
+                name, value = tokens[pos], _unquote(tokens[pos + 1])
+                pos += 2
+                return {m.uid for m in msgs if value in (m.msg[name] or "")}
+            raise ValueError(f"unsupported search key {tok}")
+
+        result = set(uids)
+        while pos < len(tokens):
+            result &= key()
+        return result
+
+    def _fetch(self, seq: int, m: Message, items: str) -> None:
+        fields = re.match(r"BODY\.PEEK\[HEADER\.FIELDS \(([^)]*)\)\]", items)
+        if fields:
+            names = fields.group(1).split()
+            head  = "".join(f"{n}: {m.msg[n]}\r\n" for n in m.msg.keys() if n.upper() in names)
+            data  = (head + "\r\n").encode()
+            self.send(f"* {seq} FETCH (UID {m.uid} BODY[HEADER.FIELDS ({fields.group(1)})] "
+                      f"{{{len(data)}}}", data + b")")
+            return
+        if items == "BODYSTRUCTURE":
+            charset = m.msg.get_content_charset() or "us-ascii"
+            cte     = (m.msg["Content-Transfer-Encoding"] or "7bit").upper()
+            lines   = m.body.count(b"\r\n")
+            self.send(f'* {seq} FETCH (UID {m.uid} BODYSTRUCTURE ("TEXT" "PLAIN" '
+                      f'("CHARSET" "{charset}") NIL NIL "{cte}" {len(m.body)} {lines}))')
+            return
+        part = re.match(r"BODY\.PEEK\[1\]<0\.(\d+)>", items)
+        if part:
+            data = m.body[:int(part.group(1))]
+            self.send(f"* {seq} FETCH (UID {m.uid} BODY[1]<0> {{{len(data)}}}", data + b")")
+            return
+        raise ValueError(f"unsupported fetch {items}")
@@ -0,0 +1,95 @@
+# tests/smtp_stub.py
+
+"""
+Plain-text SMTP stand-in on localhost for the outbox tests.
+
+Speaks EHLO (offering SIZE, no AUTH), MAIL, RCPT, DATA, RSET, NOOP and
+QUIT. Replies can be scripted per attempt: ``rcpt_replies`` maps an
+address to the codes for its next RCPTs (the last one stays), and
+``data_replies`` lists the codes for the next DATA results (then 250). Accepted
+messages are kept in ``messages`` as (sender, recipients, data) with the
+dot-stuffing undone.
+"""
+
+import socketserver
+import threading
+
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock         = threading.Lock()
+        self.messages: list[tuple[str, list[str], bytes]] = []
+        self.rcpt_replies: dict[str, list[int]] = {}
+        self.data_replies: list[int] = []
+        self.connections  = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "FakeSmtpServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        sender, rcpts = None, []
+        self.send("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd, _, arg = line.decode().rstrip("\r\n").partition(" ")
+            cmd = cmd.upper()
+            if cmd == "EHLO":
+                self.wfile.write(b"250-stub\r\n250 SIZE 10485760\r\n")
+                self.wfile.flush()
+            elif cmd == "HELO" or cmd == "NOOP":
+                self.send("250 ok")
+            elif cmd == "MAIL":
+                sender, rcpts = arg.split(":", 1)[1].split()[0].strip("<>"), []
+                self.send("250 ok")
+            elif cmd == "RCPT":
+                addr = arg.split(":", 1)[1].strip().strip("<>")
+                with self.server.lock:
+                    codes = self.server.rcpt_replies.get(addr) or [250]
+                    code  = codes.pop(0) if len(codes) > 1 else codes[0]
+                if code == 250:
+                    rcpts.append(addr)
+                self.send(f"{code} {addr}")
+            elif cmd == "DATA":
+                self.send("354 go ahead")
+                data = bytearray()
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b".\r\n", b""):
+                        break
+                    data += line[1:] if line.startswith(b"..") else line
+                with self.server.lock:
+                    code = self.server.data_replies.pop(0) if self.server.data_replies else 250
+                    if code == 250:
+                        self.server.messages.append((sender, rcpts, bytes(data)))
+                self.send(f"{code} data")
+            elif cmd == "RSET":
+                sender, rcpts = None, []
+                self.send("250 ok")
+            elif cmd == "QUIT":
+                self.send("221 bye")
+                return
+            else:
+                self.send("502 not implemented")
@@ -0,0 +1,102 @@
+# tests/test_build_cache.py
+
+import hashlib
+import os
+
+import pytest
+
+import build_cache
+from file_catalog import Catalog
+
+
+@pytest.fixture(params=["filesystem", "catalog"])
+def setup(request, tmp_path):
+    """(manifest, month folder) with and without a file catalog in front of the share."""
+    folder = tmp_path / "nea" / "NGCP" / "09. SEP 2025"
+    folder.mkdir(parents=True)
+    (tmp_path / "erc").mkdir()
+    catalog = Catalog(str(tmp_path / "nea"), str(tmp_path / "erc")) if request.param == "catalog" else None
+    manifest = build_cache.BuildManifest(str(tmp_path / "manifest.json"), catalog=catalog)
+    return manifest, folder
+
+def write(path, data: bytes, mtime_ns: int | None = None) -> str:
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+def build(manifest, inputs, outputs, key="Supply|2025-09"):
+    """Record a build of ``key`` the way nea_reports.cached does."""
+    fp = manifest.fingerprint(inputs)
+    manifest.record(key, fp, outputs, outputs)
+    return fp
+
+
+def test_unchanged_inputs_and_outputs_are_a_hit(setup):
+    manifest, folder = setup
+    src = write(folder / "17MW.pdf", b"pdf")
+    out = write(folder / "Power Supply-20250901-V1.xlsx", b"xlsx")
+    build(manifest, [src], [out])
+    assert manifest.lookup("Supply|2025-09", manifest.fingerprint([src]), [out]) == [out]
+
+    # Also after a restart, from the manifest on disk
+    reloaded = build_cache.BuildManifest(manifest.path, catalog=manifest.catalog)
+    assert reloaded.lookup("Supply|2025-09", reloaded.fingerprint([src]), [out]) == [out]
+
+def test_an_input_edited_in_place_is_a_miss(setup):
+    manifest, folder = setup
+    src = write(folder / "17MW.pdf", b"pdf v1", mtime_ns=1_700_000_000_000_000_000)
+    out = write(folder / "Power Supply-20250901-V1.xlsx", b"xlsx")
+    build(manifest, [src], [out])
+
+    # Same size and a new mtime; the folder's own mtime doesn't change
+    dir_mtime = os.stat(folder).st_mtime_ns
+    write(folder / "17MW.pdf", b"pdf v2", mtime_ns=1_700_000_100_000_000_000)
+    os.utime(folder, ns=(dir_mtime, dir_mtime))
+    assert manifest.lookup("Supply|2025-09", manifest.fingerprint([src]), [out]) is None
+
+def test_changed_or_missing_outputs_are_a_miss(setup):
+    manifest, folder = setup
+    src = write(folder / "17MW.pdf", b"pdf")
+    out = write(folder / "Power Supply-20250901-V1.xlsx", b"xlsx")
+    build(manifest, [src], [out])
+
+    write(folder / "Power Supply-20250901-V1.xlsx", b"edited by hand")
+    assert manifest.lookup("Supply|2025-09", manifest.fingerprint([src]), [out]) is None
+    os.remove(out)
+    assert manifest.lookup("Supply|2025-09", manifest.fingerprint([src]), [out]) is None
+
+def test_a_new_file_matching_an_input_pattern_is_a_miss(setup):
+    manifest, folder = setup
+    write(folder / "NGCP BILL part 1.pdf", b"one")
+    pattern = str(folder / "NGCP BILL*.pdf")
+    out = write(folder / "NGCP Bill-20250901-V1.xlsx", b"xlsx")
+    fp  = build(manifest, [pattern], [out])
+    assert list(fp) == [str(folder / "NGCP BILL part 1.pdf")]
+
+    write(folder / "NGCP BILL part 2.pdf", b"two")
+    assert manifest.lookup("Supply|2025-09", manifest.fingerprint([pattern]), [out]) is None
+
+def test_missing_inputs_fingerprint_as_none(setup):
+    manifest, folder = setup
+    missing = str(folder / "Excess.pdf")
+    assert manifest.fingerprint([missing]) == {missing: None}
+
+def test_hashes_are_reused_while_size_and_mtime_match(setup, monkeypatch):
+    manifest, folder = setup
+    src = write(folder / "17MW.pdf", b"pdf" * 1000)
+    first = manifest.digest(src)
+
+    calls = []
+    real  = hashlib.sha256
+    monkeypatch.setattr(hashlib, "sha256", lambda *a: calls.append(1) or real(*a))
+    assert manifest.digest(src) == first
+    assert calls == []
+
+def test_forget_drops_the_entry(setup):
+    manifest, folder = setup
+    src = write(folder / "17MW.pdf", b"pdf")
+    out = write(folder / "Power Supply-20250901-V1.xlsx", b"xlsx")
+    fp  = build(manifest, [src], [out])
+    manifest.forget("Supply|2025-09")
+    assert manifest.lookup("Supply|2025-09", fp, [out]) is None
@@ -0,0 +1,94 @@
+# tests/test_dag.py
+
+import threading
+import time
+
+import pytest
+
+import dag
+
+
+def test_nodes_wait_for_the_producers_of_their_inputs(tmp_path):
+    a, b = str(tmp_path / "a.xlsx"), str(tmp_path / "b.xlsx")
+    order = []
+
+    def step(name, delay=0.0):
+        def fn():
+            time.sleep(delay)
+            order.append(name)
+            return name
+        return fn
+
+    nodes = [
+        dag.Node("report", step("report"), inputs=[b]),
+        dag.Node("source", step("source", 0.1), outputs=[a]),
+        dag.Node("middle", step("middle"), inputs=[a], outputs=[b]),
+        dag.Node("other", step("other")),
+    ]
+    assert dag.dependencies(nodes) == {"report": {"middle"}, "source": set(),
+                                       "middle": {"source"}, "other": set()}
+    results = dag.run(nodes)
+    assert list(results) == ["report", "source", "middle", "other"]
+    assert order.index("source") < order.index("middle") < order.index("report")
+    assert all(r.status == "SUCCESS" and r.value == r.name for r in results.values())
+
+def test_independent_nodes_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    nodes   = [dag.Node(name, barrier.wait) for name in ("one", "two")]
+    results = dag.run(nodes, workers={"cpu": 2})
+    assert all(r.status == "SUCCESS" for r in results.values())
+
+def test_dependents_of_a_failed_node_are_skipped(tmp_path):
+    out    = str(tmp_path / "out.xlsx")
+    called = []
+
+    def broken():
+        raise FileNotFoundError("17MW.pdf")
+
+    results = dag.run([
+        dag.Node("broken", broken, outputs=[out]),
+        dag.Node("after", lambda: called.append(1), inputs=[out]),
+        dag.Node("unrelated", lambda: "ok"),
+    ])
+    assert results["broken"].status == "FAILED"
+    assert isinstance(results["broken"].error, FileNotFoundError)
+    assert results["after"].status == "SKIPPED" and called == []
+    assert results["unrelated"].status == "SUCCESS"
+
+def test_on_result_sees_every_node_in_the_calling_thread():
+    seen = []
+    dag.run([dag.Node(str(i), lambda: None) for i in range(4)],
+            on_result=lambda r: seen.append((r.name, threading.current_thread())))
+    assert sorted(name for name, _ in seen) == ["0", "1", "2", "3"]
+    assert all(t is threading.current_thread() for _, t in seen)
+
+def test_cycles_duplicates_and_clashing_outputs_are_rejected(tmp_path):
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    with pytest.raises(ValueError, match="cycle"):
+        dag.dependencies([dag.Node("x", None, inputs=[a], outputs=[b]),
+                          dag.Node("y", None, inputs=[b], outputs=[a])])
+    with pytest.raises(ValueError, match="Duplicate"):
+        dag.dependencies([dag.Node("x", None), dag.Node("x", None)])
+    with pytest.raises(ValueError, match="written by both"):
+        dag.dependencies([dag.Node("x", None, outputs=[a]), dag.Node("y", None, outputs=[a])])
+
+def test_runs_share_the_lane_pools():
+    threads = set()
+
+    def record():
+        threads.add(threading.current_thread())
+
+    for _ in range(5):
+        dag.run([dag.Node(str(i), record, pool="excel") for i in range(3)])
+    assert len(threads) <= dag.DAG_EXCEL_WORKERS
+    assert all(t.name.startswith("dag-excel") for t in threads)
+
+def test_a_run_inside_a_node_gets_its_own_pool():
+    def outer():
+        inner = dag.run([dag.Node("inner", lambda: "done")])
+        return inner["inner"].value
+
+    # Every shared cpu slot is held by an outer node, so inner nodes queued
+    # there would never start
+    results = dag.run([dag.Node(f"outer {i}", outer) for i in range(dag.DAG_CPU_WORKERS)])
+    assert all(r.value == "done" for r in results.values())
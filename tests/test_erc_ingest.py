@@ -0,0 +1,61 @@
+# tests/test_erc_ingest.py
+
+import openpyxl
+import pytest
+
+import erc_ingest
+
+
+def _workbook(path, rows):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for i in range(erc_ingest.ERC_SKIPROWS):
+        ws.append([f"banner {i}"])
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return str(path)
+
+HEADER = ["Date", "Area", "Feeder", "Cause", "Start", "End", "Hours", "Type", "Customers", "kW", "Remarks"]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(erc_ingest, "ERC_CACHE_DIR", str(tmp_path / "erc_cache"))
+    monkeypatch.setattr(erc_ingest, "ERC_USECOLS", "A:K")
+    monkeypatch.setattr(erc_ingest, "ERC_EXCEL_ENGINE", "default")
+
+
+def test_every_column_is_read_as_object(tmp_path):
+    path = _workbook(tmp_path / "planned.xlsx", [
+        HEADER,
+        ["09/01/25", "North", "F1", "Maintenance", "08:00", "12:00", 4, "P", 120, 35.5, "ok"],
+        ["09/02/25", "South", 12, "Storm", "13:00", "14:30", 1.5, "U", 80, 20, "-"],
+        ["Totals", None, None, None, None, None, 5.5, None, 200, 55.5, None],
+    ])
+    df = erc_ingest.parse(path)
+    assert list(df.columns) == HEADER
+    assert all(dtype == object for dtype in df.dtypes)
+    # A feeder number in a text column stays the number the workbook holds
+    assert df["Feeder"].tolist()[:2] == ["F1", 12]
+
+    cleaned = erc_ingest.clean(df)
+    assert len(cleaned) == 2
+    assert cleaned["Date"].dt.day.tolist() == [1, 2]
+
+def test_narrower_file_is_rejected(tmp_path):
+    path = _workbook(tmp_path / "narrow.xlsx", [HEADER[:3], ["09/01/25", "North", "F1"]])
+    with pytest.raises(ValueError, match=r"narrow\.xlsx doesn't have the columns A:K"):
+        erc_ingest.parse(path)
+
+def test_load_reuses_the_cached_frame(tmp_path, monkeypatch):
+    path = _workbook(tmp_path / "planned.xlsx", [
+        HEADER, ["09/01/25", "North", "F1", "Maintenance", "08:00", "12:00", 4, "P", 120, 35.5, "ok"],
+    ])
+    first = erc_ingest.load(path)
+
+    def fail(_):
+        raise AssertionError("parsed again")
+    monkeypatch.setattr(erc_ingest, "parse", fail)
+    second = erc_ingest.load(path)
+    assert second.equals(first)
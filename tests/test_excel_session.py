@@ -0,0 +1,112 @@
+# tests/test_excel_session.py
+
+import threading
+import time
+
+import pytest
+
+import dag
+from excel_session import ExcelError, ExcelPool, FakeApp
+
+
+@pytest.fixture
+def pool():
+    pool = ExcelPool(factory=FakeApp, idle_sec=300)
+    yield pool
+    pool.shutdown()
+
+
+def test_a_thread_gets_its_own_session_back(pool):
+    with pool.borrow() as first:
+        app = first.app
+    with pool.borrow() as second:
+        assert second is first and second.app is app
+    assert pool.live_count() == 1
+
+def test_nested_borrows_share_the_session(pool):
+    with pool.borrow() as outer:
+        with pool.borrow() as inner:
+            assert inner is outer
+    assert pool.live_count() == 1
+
+def test_threads_never_share_a_session(pool):
+    seen = []
+
+    def work():
+        with pool.borrow() as sess:
+            seen.append((sess, sess.thread))
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for t in threads:
+        t.start()
+        t.join()
+    assert len({id(s) for s, _ in seen}) == 3
+    assert all(owner is t for (_, owner), t in zip(seen, threads))
+
+def test_runs_on_the_dag_workers_reuse_their_instances(pool):
+    started = FakeApp.started
+
+    def step():
+        with pool.borrow() as sess:
+            sess.app
+            time.sleep(0.05)
+
+    for _ in range(3):
+        nodes   = [dag.Node(f"step {i}", step, pool="excel") for i in range(dag.DAG_EXCEL_WORKERS)]
+        results = dag.run(nodes)
+        assert all(r.status == "SUCCESS" for r in results.values())
+    assert pool.live_count() <= dag.DAG_EXCEL_WORKERS
+    assert FakeApp.started - started <= dag.DAG_EXCEL_WORKERS
+
+def test_excel_errors_discard_the_session(pool):
+    with pytest.raises(ExcelError):
+        with pool.borrow() as sess:
+            app = sess.app
+            raise ExcelError("RPC server unavailable")
+    assert pool.live_count() == 0
+    assert not app.alive
+    with pool.borrow() as fresh:
+        assert fresh is not sess
+
+def test_caller_errors_return_the_session(pool):
+    with pytest.raises(ValueError):
+        with pool.borrow() as sess:
+            app = sess.app
+            raise ValueError("bad cell value")
+    with pool.borrow() as again:
+        assert again is sess and again.app is app and app.alive
+
+def test_reaper_quits_idle_sessions_and_those_of_ended_threads():
+    pool = ExcelPool(factory=FakeApp, idle_sec=0.2)
+    try:
+        apps = []
+
+        def work():
+            with pool.borrow() as sess:
+                apps.append(sess.app)
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+        with pool.borrow() as sess:
+            apps.append(sess.app)
+        assert pool.live_count() == 2
+
+        deadline = time.monotonic() + 5
+        while pool.live_count() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert pool.live_count() == 0
+        assert not any(app.alive for app in apps)
+    finally:
+        pool.shutdown()
+
+def test_sessions_restart_excel_after_recycle_after_workbooks(tmp_path):
+    pool = ExcelPool(factory=FakeApp, recycle_after=2)
+    try:
+        with pool.borrow() as sess:
+            first = sess.app
+            sess.create(str(tmp_path / "a.json"), ["Sheet"])
+            with sess.open(str(tmp_path / "a.json")) as wb:
+                wb.sheets["Sheet"].range("A1").value = 1
+            assert not first.alive
+            assert sess.app is not first
+    finally:
+        pool.shutdown()
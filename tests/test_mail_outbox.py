@@ -0,0 +1,133 @@
+# tests/test_mail_outbox.py
+
+import email
+import email.policy
+import os
+import sqlite3
+import time
+from email.message import EmailMessage
+
+import pytest
+
+import mail_outbox
+from smtp_stub import FakeSmtpServer
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(mail_outbox, "SMTP_RETRY_BASE_SEC", 0.05)
+    monkeypatch.setattr(mail_outbox, "SMTP_IDLE_SEC", 0.2)
+    srv = FakeSmtpServer().start()
+    yield srv
+    srv.stop()
+
+@pytest.fixture
+def outbox(smtp, tmp_path):
+    return mail_outbox.Outbox("me@example.com", "", host="127.0.0.1", port=smtp.port, use_ssl=False,
+                              db_path=str(tmp_path / "outbox.sqlite"),
+                              spool_dir=str(tmp_path / "spool"))
+
+def _message(to="boss@example.com", subject="Monthly reports") -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"]    = "me@example.com"
+    msg["To"]      = to
+    msg["Subject"] = subject
+    msg.set_content("Reports attached.\n.\nA line that starts with a dot.")
+    return msg
+
+
+def test_streams_attachments_and_removes_the_spool_file(outbox, smtp, tmp_path):
+    report = tmp_path / "report.xlsx"
+    report.write_bytes(bytes(range(256)) * 1000)
+    msg_id = outbox.enqueue(_message(), [str(report)])
+
+    row = outbox.wait(msg_id, timeout=10)
+    assert row["status"] == "SENT" and row["attempts"] == 1
+    assert "1 attachments, 256000 bytes" in row["attachments"]
+    assert not os.path.exists(row["path"])
+
+    sender, rcpts, data = smtp.messages[0]
+    assert (sender, rcpts) == ("me@example.com", ["boss@example.com"])
+    sent = email.message_from_bytes(data, policy=email.policy.default)
+    assert ".\nA line that starts with a dot." in sent.get_body().get_content().replace("\r\n", "\n")
+    part = next(sent.iter_attachments())
+    assert part.get_filename() == "report.xlsx"
+    assert part.get_content() == report.read_bytes()
+
+def test_transient_failure_is_retried(outbox, smtp):
+    smtp.data_replies = [451]
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "SENT" and row["attempts"] == 2
+    assert len(smtp.messages) == 1
+
+def test_permanent_failure_is_not_retried(outbox, smtp):
+    smtp.data_replies = [554]
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "FAILED" and row["attempts"] == 1
+    assert "554" in row["last_error"]
+
+def test_recipients_refused_with_4xx_are_retried(outbox, smtp):
+    smtp.rcpt_replies["boss@example.com"] = [450, 250]
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "SENT" and row["attempts"] == 2
+
+def test_recipients_refused_with_5xx_fail_at_once(outbox, smtp):
+    smtp.rcpt_replies["boss@example.com"] = [550]
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "FAILED" and row["attempts"] == 1
+    assert smtp.messages == []
+
+def test_retries_stop_after_max_attempts(outbox, smtp, monkeypatch):
+    monkeypatch.setattr(mail_outbox, "SMTP_MAX_ATTEMPTS", 3)
+    smtp.data_replies = [451] * 5
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "FAILED" and row["attempts"] == 3
+
+def test_spooled_mail_is_sent_on_the_next_start(outbox, smtp, monkeypatch):
+    # A process that stopped before its sender thread ran
+    monkeypatch.setattr(outbox, "start", lambda: None)
+    msg_id = outbox.enqueue(_message())
+    time.sleep(0.2)
+    assert outbox.status(msg_id)["status"] == "QUEUED" and smtp.messages == []
+
+    restarted = mail_outbox.Outbox("me@example.com", "", host="127.0.0.1", port=smtp.port,
+                                   use_ssl=False, db_path=outbox.db_path, spool_dir=outbox.spool_dir)
+    restarted.start()
+    assert restarted.wait(msg_id, timeout=10)["status"] == "SENT"
+
+def test_sender_survives_a_locked_database(outbox, smtp, monkeypatch):
+    due, calls = outbox._due, []
+
+    def locked_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return due()
+    monkeypatch.setattr(outbox, "_due", locked_once)
+
+    row = outbox.wait(outbox.enqueue(_message()), timeout=10)
+    assert row["status"] == "SENT"
+    assert len(calls) > 1
+
+def test_one_connection_is_shared_by_queued_mail(outbox, smtp):
+    ids = [outbox.enqueue(_message(subject=f"Report {i}")) for i in range(3)]
+    assert all(outbox.wait(i, timeout=10)["status"] == "SENT" for i in ids)
+    assert smtp.connections == 1
+
+def test_dedupe_keeps_equal_content_under_another_name(outbox, smtp, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first  = tmp_path / "a" / "17MW.pdf"
+    again  = tmp_path / "b" / "17MW.pdf"
+    other  = tmp_path / "a" / "Excess.pdf"
+    for p in (first, again, other):
+        p.write_bytes(b"%PDF-1.4 same bytes")
+
+    unique, dropped = mail_outbox.dedupe([str(first), str(other), str(again)])
+    assert unique == [str(first), str(other)]
+    assert dropped == [(str(again), str(first))]
+
+    row = outbox.wait(outbox.enqueue(_message(), [str(first), str(other), str(again)]), timeout=10)
+    assert "not attached, listed twice: 17MW.pdf (= 17MW.pdf)" in row["attachments"]
+    sent = email.message_from_bytes(smtp.messages[0][2], policy=email.policy.default)
+    assert [p.get_filename() for p in sent.iter_attachments()] == ["17MW.pdf", "Excess.pdf"]
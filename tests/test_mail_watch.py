@@ -0,0 +1,130 @@
+# tests/test_mail_watch.py
+
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+
+import pytest
+
+import mail_watch
+from imap_stub import FakeImapServer
+
+THREAD = "<reports-2025-09@example.com>"
+
+
+def reply(text: str, sender="boss@example.com", in_reply_to=THREAD) -> bytes:
+    msg = EmailMessage()
+    msg["From"]       = sender
+    msg["To"]         = "me@example.com"
+    msg["Subject"]    = "Re: Monthly reports"
+    msg["Date"]       = format_datetime(datetime.now(timezone.utc))
+    msg["Message-ID"] = make_msgid()
+    if in_reply_to:
+        msg["In-Reply-To"] = in_reply_to
+    msg.set_content(text)
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.02)
+
+def idles(srv) -> int:
+    return srv.commands.count("IDLE")
+
+
+@pytest.fixture
+def server():
+    srv = FakeImapServer().start()
+    yield srv
+    srv.stop()
+
+@pytest.fixture
+def watcher(server):
+    w = mail_watch.ApprovalWatcher("me@example.com", "secret", ["Boss@example.com"],
+                                   host="127.0.0.1", port=server.port, use_ssl=False, idle_sec=30)
+    yield w
+    w.stop()
+
+
+def test_reply_in_the_thread_resolves_the_approval(server, watcher):
+    server.deliver(reply("yes, from before the watch", in_reply_to=None))
+    future = watcher.watch(["yes", "approved"], ["no"], thread_msgid=THREAD, timeout_min=1)
+    wait_for(lambda: idles(server) >= 1)
+
+    unrelated = server.deliver(reply("yes", in_reply_to="<other@example.com>"))
+    stranger  = server.deliver(reply("approved", sender="someone@example.com"))
+    answer    = server.deliver(reply("Approved, thanks."))
+    assert future.result(5) == "yes"
+    assert server.seen(answer)
+    assert not server.seen(unrelated) and not server.seen(stranger)
+    # Candidates are narrowed by the server; bodies are only read with PEEK
+    assert server.connections == 1
+
+def test_negative_reply(server, watcher):
+    future = watcher.watch(["yes"], ["no", "hold"], thread_msgid=THREAD, timeout_min=1)
+    wait_for(lambda: idles(server) >= 1)
+    server.deliver(reply("Please hold these until Monday."))
+    assert future.result(5) == "no"
+
+def test_reply_that_arrived_before_the_watch_started(server, watcher):
+    answer = server.deliver(reply("yes"))
+    future = watcher.watch(["yes"], thread_msgid=THREAD, timeout_min=1,
+                           after=datetime.now(timezone.utc) - timedelta(minutes=5))
+    assert future.result(5) == "yes"
+    assert server.seen(answer)
+
+def test_no_reply_resolves_to_none_at_the_deadline(server, watcher):
+    future = watcher.watch(["yes"], thread_msgid=THREAD, timeout_min=0.01)
+    assert future.result(5) is None
+
+def test_resumes_from_the_last_uid_after_a_dropped_connection(server, watcher):
+    server.deliver(reply("yes, an old approval for another month"))
+    future = watcher.watch(["yes"], thread_msgid="<reports-2025-10@example.com>", timeout_min=1)
+    wait_for(lambda: idles(server) >= 1)
+    last_uid = watcher.last_uid
+
+    server.drop()
+    answer = server.deliver(reply("yes", in_reply_to="<reports-2025-10@example.com>"))
+    assert future.result(10) == "yes"
+    assert server.connections == 2
+    assert watcher.last_uid == answer > last_uid
+    assert server.seen(answer)
+
+def test_mail_announced_behind_a_command_reply_is_not_missed(server, watcher):
+    # Keeps the connection (and imaplib's read buffer) across the next watch
+    keep = watcher.watch(["yes"], thread_msgid="<unanswered@example.com>", timeout_min=1)
+    wait_for(lambda: idles(server) >= 1)
+
+    # The reply lands right after the next "UID n:*" SEARCH, and its EXISTS
+    # arrives in the same packet as the search result, so imaplib buffers it
+    server.trailing.append(reply("yes"))
+    start  = time.monotonic()
+    future = watcher.watch(["yes"], thread_msgid=THREAD, timeout_min=1)
+    assert future.result(10) == "yes"
+    assert time.monotonic() - start < 5
+    assert not keep.done()
+
+def test_servers_without_idle_are_polled(monkeypatch):
+    monkeypatch.setattr(mail_watch, "POLL_INTERVAL_SEC", 0.1)
+    srv = FakeImapServer(idle=False).start()
+    w   = mail_watch.ApprovalWatcher("me@example.com", "secret", ["boss@example.com"],
+                                     host="127.0.0.1", port=srv.port, use_ssl=False)
+    try:
+        future = w.watch(["yes"], thread_msgid=THREAD, timeout_min=1)
+        wait_for(lambda: "NOOP" in srv.commands)
+        srv.deliver(reply("yes"))
+        assert future.result(5) == "yes"
+        assert "IDLE" not in srv.commands and srv.connections == 1
+    finally:
+        w.stop()
+        srv.stop()
+
+def test_stop_cancels_pending_approvals(server, watcher):
+    future = watcher.watch(["yes"], thread_msgid=THREAD, timeout_min=1)
+    wait_for(lambda: idles(server) >= 1)
+    watcher.stop()
+    assert future.cancelled()
+    assert "LOGOUT" in server.commands
@@ -0,0 +1,85 @@
+# tests/test_task_logs.py
+
+import re
+from datetime import datetime, timedelta
+from urllib.parse import unquote
+
+import pytest
+from flask import Flask
+
+from dashboard import retention, views
+from dashboard.models import db, now_local, Task, TaskLog, TaskLogDay, TaskLogPhase
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The dashboard's views and models without the scheduler, job workers and outbox of create_app()
+    app = Flask("dashboard.app")
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'dashboard.sqlite'}",
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False, SECRET_KEY="test")
+    db.init_app(app)
+    app.register_blueprint(views.main_bp)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Task(name="Supply", module_path="nea_reports", function_name="not_a_step"))
+        db.session.commit()
+    monkeypatch.setattr(views, "TASK_LOG_PAGE_SIZE", 3)
+    monkeypatch.setattr(retention, "_app", app)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+def add_logs(app, run_times: list[datetime], status="SUCCESS") -> list[int]:
+    with app.app_context():
+        logs = [TaskLog(task_id=1, run_time=t, status=status, message=f"run {i}")
+                for i, t in enumerate(run_times)]
+        db.session.add_all(logs)
+        db.session.commit()
+        return [log.id for log in logs]
+
+def page(client, before=None) -> tuple[list[str], str | None]:
+    """The run messages on one task page and its "Older" cursor."""
+    html = client.get("/task/1", query_string={"before": before} if before else None).get_data(as_text=True)
+    older = re.search(r'href="/task/1\?before=([^"]+)"', html)
+    return re.findall(r"run \d+", html), older and unquote(older.group(1))
+
+
+def test_pages_walk_every_run_newest_first(app):
+    base = datetime(2025, 9, 1, 8, 0)
+    # Two runs share a run time: the id breaks the tie, so neither is skipped or shown twice
+    add_logs(app, [base + timedelta(minutes=m) for m in (0, 10, 10, 20, 30, 40, 50)])
+    client = app.test_client()
+
+    seen, before = [], None
+    for _ in range(5):
+        runs, before = page(client, before)
+        seen.extend(runs)
+        if before is None:
+            break
+    assert seen == [f"run {i}" for i in (6, 5, 4, 3, 2, 1, 0)]
+
+def test_a_malformed_cursor_shows_the_first_page(app):
+    add_logs(app, [datetime(2025, 9, 1, 8, m) for m in range(5)])
+    runs, older = page(app.test_client(), before="not-a-cursor")
+    assert runs == ["run 4", "run 3", "run 2"] and older
+
+def test_prune_rolls_old_runs_up_into_daily_totals(app):
+    old = (now_local() - timedelta(days=120)).replace(hour=9, minute=0, second=0, microsecond=0)
+    ids = add_logs(app, [old, old + timedelta(hours=1), old + timedelta(hours=2)])
+    add_logs(app, [now_local()])
+    with app.app_context():
+        failed = db.session.get(TaskLog, ids[1])
+        failed.status, failed.message = "FAILED", "17MW.pdf missing"
+        db.session.add(TaskLogPhase(log_id=ids[0], phase="ocr", seconds=1.5))
+        db.session.commit()
+
+    assert retention.prune(days=90) == 3
+    with app.app_context():
+        assert TaskLog.query.count() == 1
+        assert TaskLogPhase.query.count() == 0
+        day = TaskLogDay.query.one()
+        assert (day.day, day.runs, day.succeeded, day.failed) == (old.date(), 3, 2, 1)
+        assert day.last_message == "17MW.pdf missing"
+    # A second pass finds nothing left to prune
+    assert retention.prune(days=90) == 0
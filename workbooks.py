@@ -0,0 +1,521 @@
+# workbooks.py
+
+"""
+Pluggable workbook backends used by the report steps.
+
+The steps only copy last month's workbook forward and write a handful of
+cells, so they talk to a small ``Workbook``/``Sheet`` interface instead of
+Excel directly:
+
+    books = get_backend()
+    with books.session():
+        books.create(path, ["Sheet"])
+        with books.open(path) as wb:
+            sh = wb.sheet("Sheet")
+            sh["C3"] = "January"
+
+Two backends are available, selected with ``WORKBOOK_BACKEND``:
+
+* ``python`` (default) — pure Python. ``.xlsx`` files go through openpyxl,
+  legacy ``.xls`` files through xlrd + xlwt with the original cell styles
+  carried over. Runs anywhere, no Excel required. xlrd cannot read
+  ``.xls`` formulas, so a save through xlwt would replace them with empty
+  cells. An ``.xls`` that contains formulas is therefore edited through
+  Excel (the xlwings backend) instead; without xlwings, or with
+  ``EXCEL_BACKEND`` other than ``xlwings``, opening one for writing raises
+  ``XlsFormulaError`` rather than saving it without its formulas. The
+  report steps call ``check_writable()`` on the workbook they carry
+  forward before doing anything, so such a step fails up front instead
+  of partway through. Headless Linux workers can therefore only update
+  ``.xls`` reports that have no formulas.
+* ``xlwings`` — drives a real Excel instance borrowed from
+  ``excel_session.POOL``. Optional; only needed on Windows.
+
+The file format is detected from the file header rather than the
+extension, so an OOXML workbook saved under a "-V1.xls" name still opens.
+"""
+
+import importlib.util
+import math
+import os
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+
+import run_stats
+from excel_session import EXCEL_BACKEND, index_to_col, parse_ref
+
+WORKBOOK_BACKEND = os.environ.get("WORKBOOK_BACKEND", "python")
+
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_ZIP_MAGIC  = b"PK\x03\x04"
+
+# BIFF records that hold cell formulas: FORMULA (BIFF2, 3, 4, 5/8), ARRAY and SHRFMLA
+_FORMULA_RECORDS = {0x0006, 0x0206, 0x0406, 0x0221, 0x04BC, 0x00BC}
+
+
+class XlsFormulaError(RuntimeError):
+    """An .xls with formulas was opened for writing without Excel to save it."""
+
+
+def parse_range(ref: str) -> tuple[tuple[int, int], tuple[int, int]]:
+    """Return ((row1, col1), (row2, col2)) for 'B19:G1000' or a single cell."""
+    first, _, last = ref.partition(":")
+    return parse_ref(first), parse_ref(last or first)
+
+def file_format(path: str) -> str:
+    """Return 'xls' or 'xlsx' for an existing workbook, else guess from the extension."""
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            head = f.read(8)
+        if head.startswith(_OLE2_MAGIC):
+            return "xls"
+        if head.startswith(_ZIP_MAGIC):
+            return "xlsx"
+    return "xls" if path.lower().endswith(".xls") else "xlsx"
+
+def xls_has_formulas(path: str) -> bool:
+    """Whether the .xls at ``path`` has any formula cell, from its BIFF records."""
+    from xlrd.compdoc import CompDoc
+    with open(path, "rb") as f:
+        mem = f.read()
+    with open(os.devnull, "w") as log:
+        doc    = CompDoc(mem, logfile=log)
+        stream = doc.get_named_stream("Workbook") or doc.get_named_stream("Book")
+    if stream is None:
+        raise ValueError(f"{path} has no BIFF workbook stream")
+    pos = 0
+    while pos + 4 <= len(stream):
+        rec    = int.from_bytes(stream[pos:pos + 2], "little")
+        length = int.from_bytes(stream[pos + 2:pos + 4], "little")
+        if rec in _FORMULA_RECORDS:
+            return True
+        pos += 4 + length
+    return False
+
+def _plain(value):
+    """Convert numpy/pandas scalars to plain Python values; NaN/NaT become None."""
+    if value is None:
+        return None
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        try:
+            value = value.item()
+        except (ValueError, AttributeError):
+            pass
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, datetime):
+        # pandas.NaT is a datetime subclass that compares unequal to itself
+        if value != value:
+            return None
+        if hasattr(value, "to_pydatetime"):
+            value = value.to_pydatetime()
+    return value
+
+
+# ─────────── Interface ───────────
+
+class Sheet:
+    """A worksheet addressed with 'C3' or (row, col) references."""
+
+    name: str
+
+    def __getitem__(self, ref):
+        return self.get(ref)
+
+    def __setitem__(self, ref, value):
+        self.set(ref, value)
+
+    def get(self, ref):
+        raise NotImplementedError
+
+    def set(self, ref, value) -> None:
+        raise NotImplementedError
+
+    def clear(self, ref: str) -> None:
+        """Clear the values (not the formatting) of a range like 'B19:G1000'."""
+        raise NotImplementedError
+
+    def last_row(self) -> int:
+        """Return the last row that holds (or held) a value."""
+        raise NotImplementedError
+
+    def write_block(self, ref, rows: list[list]) -> None:
+        """
+        Write a 2-D list of values with its top-left corner at ``ref``.
+        Backends that pay per call (Excel over COM) do this in one
+        assignment; the default writes cell by cell.
+        """
+        row, col = parse_ref(ref)
+        for i, values in enumerate(rows):
+            for j, value in enumerate(values):
+                self.set((row + i, col + j), value)
+
+
+class Workbook:
+    def sheet(self, name: str) -> Sheet:
+        raise NotImplementedError
+
+
+class WorkbookBackend:
+    name = ""
+
+    def create(self, path: str, sheet_names: list[str]) -> None:
+        """Create a new workbook at ``path`` containing ``sheet_names``."""
+        raise NotImplementedError
+
+    def open(self, path: str, save: bool = True):
+        """
+        Context manager yielding a ``Workbook``. The workbook is saved on a
+        clean exit unless ``save=False`` (read-only use).
+        """
+        raise NotImplementedError
+
+    def session(self):
+        """Context manager that shares backend resources across many opens."""
+        return nullcontext(self)
+
+    def check_writable(self, path: str) -> None:
+        """Raise if ``path`` exists but this backend couldn't save it intact."""
+
+
+# ─────────── xlwings backend ───────────
+
+class _XwSheet(Sheet):
+    def __init__(self, sh):
+        self._sh  = sh
+        self.name = sh.name
+
+    def get(self, ref):
+        return self._sh.range(ref).value
+
+    def set(self, ref, value):
+        self._sh.range(ref).value = value
+
+    def clear(self, ref):
+        self._sh.range(ref).clear_contents()
+
+    def last_row(self):
+        return self._sh.used_range.last_cell.row
+
+    def write_block(self, ref, rows):
+        if rows:
+            self._sh.range(ref).value = [[_plain(v) for v in values] for values in rows]
+
+
+class _XwWorkbook(Workbook):
+    def __init__(self, wb):
+        self._wb = wb
+
+    def sheet(self, name):
+        return _XwSheet(self._wb.sheets[name])
+
+
+class XlwingsBackend(WorkbookBackend):
+    name = "xlwings"
+
+    def session(self):
+        from excel_session import excel_session
+        return excel_session()
+
+    def create(self, path, sheet_names):
+        with self.session() as xl:
+            xl.create(path, sheet_names)
+
+    @contextmanager
+    def open(self, path, save=True):
+        with self.session() as xl, xl.open(path, save=save) as wb:
+            yield _XwWorkbook(wb)
+
+
+# ─────────── Pure-Python backend ───────────
+
+class _XlsxSheet(Sheet):
+    def __init__(self, ws):
+        self._ws  = ws
+        self.name = ws.title
+
+    def get(self, ref):
+        row, col = parse_ref(ref)
+        return self._ws.cell(row=row, column=col).value
+
+    def set(self, ref, value):
+        row, col = parse_ref(ref)
+        self._ws.cell(row=row, column=col).value = _plain(value)
+
+    def clear(self, ref):
+        (r1, c1), (r2, c2) = parse_range(ref)
+        r2 = min(r2, self._ws.max_row)
+        c2 = min(c2, self._ws.max_column)
+        for row in self._ws.iter_rows(min_row=r1, max_row=r2, min_col=c1, max_col=c2):
+            for cell in row:
+                if cell.value is not None:
+                    cell.value = None
+
+    def last_row(self):
+        return self._ws.max_row
+
+
+class _XlsxWorkbook(Workbook):
+    def __init__(self, wb):
+        self._wb = wb
+
+    def sheet(self, name):
+        return _XlsxSheet(self._wb[name])
+
+
+class _XlsSheet(Sheet):
+    """
+    An xlwt sheet copied from an xlrd sheet. Reads fall back to the xlrd
+    values for cells that haven't been written in this session, and
+    writes keep the original cell's style.
+    """
+
+    def __init__(self, rsheet, wsheet, styles):
+        self._r      = rsheet
+        self._w      = wsheet
+        self._styles = styles
+        self._cells: dict[tuple[int, int], object] = {}
+        self.name    = rsheet.name
+
+    def _style(self, r: int, c: int):
+        if self._r is not None and self._styles and r < self._r.nrows and c < self._r.ncols:
+            return self._styles[self._r.cell_xf_index(r, c)]
+        return None
+
+    def get(self, ref):
+        row, col = parse_ref(ref)
+        r, c = row - 1, col - 1
+        if (r, c) in self._cells:
+            return self._cells[(r, c)]
+        if self._r is not None and r < self._r.nrows and c < self._r.ncols:
+            value = self._r.cell_value(r, c)
+            return None if value == "" else value
+        return None
+
+    def set(self, ref, value):
+        row, col = parse_ref(ref)
+        r, c  = row - 1, col - 1
+        value = _plain(value)
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.replace(tzinfo=None)
+        self._cells[(r, c)] = value
+        style = self._style(r, c)
+        if value is None:
+            value = ""
+        if style is not None:
+            self._w.write(r, c, value, style)
+        elif isinstance(value, (datetime, date)):
+            import xlwt
+            self._w.write(r, c, value, xlwt.easyxf(num_format_str="mm/dd/yyyy"))
+        else:
+            self._w.write(r, c, value)
+
+    def clear(self, ref):
+        (r1, c1), (r2, c2) = parse_range(ref)
+        targets = {(r, c) for (r, c) in self._cells
+                   if r1 - 1 <= r < r2 and c1 - 1 <= c < c2}
+        if self._r is not None:
+            for r in range(r1 - 1, min(r2, self._r.nrows)):
+                for c in range(c1 - 1, min(c2, self._r.ncols)):
+                    if self._r.cell_value(r, c) != "":
+                        targets.add((r, c))
+        for r, c in targets:
+            self.set((r + 1, c + 1), None)
+
+    def last_row(self):
+        rows = [r + 1 for (r, _), v in self._cells.items() if v is not None]
+        if self._r is not None:
+            rows.append(self._r.nrows)
+        return max(rows, default=0)
+
+
+class _XlsWorkbook(Workbook):
+    def __init__(self, rbook, wbook, styles):
+        self._rbook  = rbook
+        self._wbook  = wbook
+        self._styles = styles
+        self._sheets: dict[str, _XlsSheet] = {}
+
+    def sheet(self, name):
+        if name not in self._sheets:
+            names = self._rbook.sheet_names()
+            idx   = names.index(name)
+            self._sheets[name] = _XlsSheet(
+                self._rbook.sheet_by_index(idx), self._wbook.get_sheet(idx), self._styles
+            )
+        return self._sheets[name]
+
+
+class _XlsReadOnlyWorkbook(Workbook):
+    def __init__(self, rbook):
+        self._rbook = rbook
+
+    def sheet(self, name):
+        return _XlsSheet(self._rbook.sheet_by_name(name), None, None)
+
+
+class PythonBackend(WorkbookBackend):
+    name = "python"
+
+    def create(self, path, sheet_names):
+        if file_format(path) == "xls":
+            import xlwt
+            wb = xlwt.Workbook()
+            for name in sheet_names:
+                wb.add_sheet(name)
+            wb.save(path)
+        else:
+            import openpyxl
+            wb = openpyxl.Workbook()
+            wb.active.title = sheet_names[0]
+            for name in sheet_names[1:]:
+                wb.create_sheet(name)
+            wb.save(path)
+
+    @contextmanager
+    def open(self, path, save=True):
+        if not os.path.exists(path):
+            raise FileNotFoundError(2, "No such file", path)
+        if file_format(path) == "xls":
+            if save and xls_has_formulas(path):
+                # xlwt would write the formula cells back empty
+                with self._open_xls_in_excel(path) as wb:
+                    yield wb
+                return
+            with self._open_xls(path, save) as wb:
+                yield wb
+        else:
+            with self._open_xlsx(path, save) as wb:
+                yield wb
+
+    @contextmanager
+    def _open_xlsx(self, path, save):
+        import openpyxl
+        if not save:
+            # Read cached formula results, like Excel would show them
+            wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            try:
+                yield _XlsxWorkbook(wb)
+            finally:
+                wb.close()
+            return
+        with run_stats.span("workbook open"):
+            wb = openpyxl.load_workbook(path)
+        with run_stats.span("workbook write"):
+            yield _XlsxWorkbook(wb)
+        # Cached values of formulas are dropped on save; have Excel recompute
+        wb.calculation.fullCalcOnLoad = True
+        with run_stats.span("save"):
+            wb.save(path)
+
+    def check_writable(self, path):
+        if (os.path.exists(path) and file_format(path) == "xls"
+                and not self._excel_available() and xls_has_formulas(path)):
+            raise self._formula_error(path)
+
+    @staticmethod
+    def _excel_available() -> bool:
+        return EXCEL_BACKEND == "xlwings" and importlib.util.find_spec("xlwings") is not None
+
+    @staticmethod
+    def _formula_error(path: str) -> XlsFormulaError:
+        return XlsFormulaError(
+            f"{os.path.basename(path)} contains formulas, which the python backend can't "
+            "save in .xls files; install xlwings and Excel (EXCEL_BACKEND=xlwings) to edit it"
+        )
+
+    @contextmanager
+    def _open_xls_in_excel(self, path):
+        if not self._excel_available():
+            raise self._formula_error(path)
+        with XlwingsBackend().open(path, save=True) as wb:
+            yield wb
+
+    @contextmanager
+    def _open_xls(self, path, save):
+        import xlrd
+        if not save:
+            rbook = xlrd.open_workbook(path, on_demand=True)
+            try:
+                yield _XlsReadOnlyWorkbook(rbook)
+            finally:
+                rbook.release_resources()
+            return
+        from xlutils.filter import process, XLRDReader, XLWTWriter
+        with run_stats.span("workbook open"):
+            rbook  = xlrd.open_workbook(path, formatting_info=True)
+            writer = XLWTWriter()
+            process(XLRDReader(rbook, os.path.basename(path)), writer)
+            wbook  = writer.output[0][1]
+        with run_stats.span("workbook write"):
+            yield _XlsWorkbook(rbook, wbook, writer.style_list)
+        with run_stats.span("save"):
+            wbook.save(path)
+
+
+# ─────────── Bulk writes ───────────
+
+def column_blocks(n_cols: int, start_col: int, protected: set[int]) -> list[tuple[int, int, int]]:
+    """
+    Map ``n_cols`` consecutive data columns onto sheet columns starting at
+    ``start_col``, skipping the ``protected`` ones (formula columns).
+    Returns (sheet_col, first_data_col, width) for every contiguous block.
+    """
+    blocks: list[tuple[int, int, int]] = []
+    col = start_col
+    for j in range(n_cols):
+        while col in protected:
+            col += 1
+        if blocks and blocks[-1][0] + blocks[-1][2] == col:
+            sheet_col, first, width = blocks[-1]
+            blocks[-1] = (sheet_col, first, width + 1)
+        else:
+            blocks.append((col, j, 1))
+        col += 1
+    return blocks
+
+def write_frame(sheet: Sheet, df, start_row: int, start_col: int,
+                protected: set[int] = frozenset(), clear_to: int = 0,
+                clear_used: bool = False) -> int:
+    """
+    Write DataFrame ``df`` (without header/index) at ``start_row``/``start_col``
+    as one 2-D block per run of unprotected columns. Each block's columns
+    are cleared first, from ``start_row`` down to ``clear_to`` or the end of
+    the new data, whichever is further down, so leftovers from a longer
+    previous month never survive. Rows below that are left alone unless
+    ``clear_used`` extends the clearing to the sheet's last used row.
+    Returns the last row written.
+    """
+    values  = df.astype(object).values.tolist()
+    blocks  = column_blocks(df.shape[1], start_col, set(protected))
+    end_row = start_row + len(values) - 1
+    last    = max(clear_to, end_row)
+    if clear_used:
+        last = max(last, sheet.last_row())
+
+    for sheet_col, first, width in blocks:
+        if last >= start_row:
+            sheet.clear(f"{index_to_col(sheet_col)}{start_row}:"
+                        f"{index_to_col(sheet_col + width - 1)}{last}")
+        if values:
+            sheet.write_block((start_row, sheet_col),
+                              [row[first:first + width] for row in values])
+    return end_row
+
+
+# ─────────── Registry ───────────
+
+BACKENDS: dict[str, type[WorkbookBackend]] = {
+    PythonBackend.name:  PythonBackend,
+    XlwingsBackend.name: XlwingsBackend,
+}
+
+def get_backend(name: str | None = None) -> WorkbookBackend:
+    """Return the backend called ``name`` (defaults to ``WORKBOOK_BACKEND``)."""
+    name = (name or WORKBOOK_BACKEND).lower()
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown WORKBOOK_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}"
+        ) from None
@@ -0,0 +1,222 @@
+# xlsx_cells.py
+
+"""
+Read-only cell extraction from .xlsx files, without Excel or openpyxl.
+
+``read_cells(path, "DATA", ["BI15", "BJ15"])`` opens the zip, finds the
+sheet's XML part and streams it with ``iterparse``. It keeps only the
+rows that hold a requested cell and stops after the last one, so reading
+ten cells near the top of a large workbook touches a few kilobytes.
+Shared strings are resolved the same way, up to the highest index
+needed.
+
+Values are what Excel last saved: numbers come back as int or float and
+formulas as their cached result. Error cells (``#N/A`` …) and empty
+cells come back as None, so ``value or 0`` works as it does with
+the workbook backends. Date cells come back as plain serial numbers.
+
+Parsed rows are cached per (path, size, mtime, sheet), keeping the last
+``XLSX_CACHE_FILES`` workbooks, so a re-run or another offset reading the
+same yearly file doesn't parse it again.
+"""
+
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from xml.etree.ElementTree import iterparse
+
+import run_stats
+
+XLSX_CACHE_FILES = int(os.environ.get("XLSX_CACHE_FILES", "32"))
+
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_CELL   = re.compile(r"([A-Za-z]+)(\d+)$")
+
+_lock  = threading.Lock()
+# (path, size, mtime_ns, sheet) -> ({row number: {cell ref: value}}, rows already parsed)
+_cache: "OrderedDict[tuple, tuple[dict[int, dict[str, object]], set[int]]]" = OrderedDict()
+
+
+def _local(tag: str) -> str:
+    # Transitional and strict OOXML use different namespaces; only the local name matters
+    return tag.rsplit("}", 1)[-1]
+
+def _col_number(letters: str) -> int:
+    n = 0
+    for ch in letters.upper():
+        n = n * 26 + ord(ch) - 64
+    return n
+
+def _col_letters(n: int) -> str:
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def _split(ref: str) -> tuple[str, int]:
+    m = _CELL.match(ref.replace("$", ""))
+    if not m:
+        raise ValueError(f"Not a cell reference: {ref!r}")
+    return m.group(1).upper(), int(m.group(2))
+
+
+def _sheet_part(zf: zipfile.ZipFile, sheet: str) -> str:
+    """Zip member name of the worksheet called ``sheet``."""
+    book = "xl/workbook.xml"
+    with zf.open("_rels/.rels") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) == "Relationship" and el.get("Type", "").endswith("/officeDocument"):
+                book = el.get("Target").lstrip("/")
+                break
+
+    rid = None
+    with zf.open(book) as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) == "sheet" and el.get("name") == sheet:
+                rid = el.get(f"{{{_REL_NS}}}id") or el.get("id")
+                break
+    if rid is None:
+        raise KeyError(f"No sheet named {sheet!r}")
+
+    base = posixpath.dirname(book)
+    rels = posixpath.join(base, "_rels", posixpath.basename(book) + ".rels")
+    with zf.open(rels) as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) == "Relationship" and el.get("Id") == rid:
+                target = el.get("Target")
+                if target.startswith("/"):
+                    return target.lstrip("/")
+                return posixpath.normpath(posixpath.join(base, target))
+    raise KeyError(f"Sheet {sheet!r} has no worksheet part")
+
+def _shared_strings(zf: zipfile.ZipFile, wanted: set[int]) -> dict[int, str]:
+    """The shared strings at the indices in ``wanted``."""
+    found: dict[int, str] = {}
+    if not wanted or "xl/sharedStrings.xml" not in zf.namelist():
+        return found
+    last = max(wanted)
+    i = 0
+    with zf.open("xl/sharedStrings.xml") as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) != "si":
+                continue
+            if i in wanted:
+                found[i] = _text(el)
+            el.clear()
+            if i >= last:
+                break
+            i += 1
+    return found
+
+def _text(el) -> str:
+    """Text of an <si> or <is> element: plain <t>, or rich-text <r><t> runs (skipping phonetic <rPh>)."""
+    parts = []
+    for child in el:
+        tag = _local(child.tag)
+        if tag == "t":
+            parts.append(child.text or "")
+        elif tag == "r":
+            parts.extend(t.text or "" for t in child if _local(t.tag) == "t")
+    return "".join(parts)
+
+def _number(text: str) -> int | float:
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _parse_rows(zf: zipfile.ZipFile, part: str, rows: set[int]) -> dict[int, dict[str, object]]:
+    """
+    {row number: {cell ref: value}} for ``rows``, streaming the sheet
+    and stopping after the last of them.
+    """
+    out: dict[int, dict[str, object]] = {r: {} for r in rows}
+    strings: dict[str, int] = {}     # cell ref -> shared string index
+    last    = max(rows)
+    row_no  = 0
+    with zf.open(part) as f:
+        for _, el in iterparse(f):
+            if _local(el.tag) != "row":
+                continue
+            row_no = int(el.get("r") or row_no + 1)
+            if row_no in out:
+                col = 0
+                for c in el:
+                    if _local(c.tag) != "c":
+                        continue
+                    ref = c.get("r")
+                    if ref:
+                        letters, _ = _split(ref)
+                        col = _col_number(letters)
+                    else:
+                        col += 1
+                    ref   = f"{_col_letters(col)}{row_no}"
+                    kind  = c.get("t", "n")
+                    value = None
+                    if kind == "inlineStr":
+                        value = next((_text(x) for x in c if _local(x.tag) == "is"), None)
+                    else:
+                        v = next((x.text for x in c if _local(x.tag) == "v"), None)
+                        if v is not None:
+                            if kind == "s":
+                                strings[ref] = int(v)
+                            elif kind in ("str", "d"):
+                                value = v
+                            elif kind == "b":
+                                value = v == "1"
+                            elif kind == "n":
+                                value = _number(v)
+                            # "e": errors read as None
+                    out[row_no][ref] = value
+            el.clear()
+            if row_no >= last:
+                break
+
+    if strings:
+        resolved = _shared_strings(zf, set(strings.values()))
+        for ref, idx in strings.items():
+            _, r = _split(ref)
+            out[r][ref] = resolved.get(idx)
+    return out
+
+
+@run_stats.timed("source read")
+def read_cells(path: str, sheet: str, cells: list[str]) -> dict[str, object]:
+    """
+    {cell ref: value} for ``cells`` (e.g. "BI15") on ``sheet`` of the
+    .xlsx/.xlsm at ``path``. Missing cells read as None. Raises
+    FileNotFoundError, KeyError for an unknown sheet and
+    zipfile.BadZipFile for files that aren't OOXML workbooks.
+    """
+    st   = os.stat(path)
+    key  = (os.path.normcase(os.path.abspath(path)), st.st_size, st.st_mtime_ns, sheet)
+    refs = {ref: _split(ref) for ref in cells}
+
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    values, parsed = entry if entry is not None else ({}, set())
+    missing = {r for _, r in refs.values()} - parsed
+
+    if missing:
+        run_stats.incr("xlsx cache misses")
+        with zipfile.ZipFile(path) as zf:
+            new = _parse_rows(zf, _sheet_part(zf, sheet), missing)
+        with _lock:
+            values, parsed = _cache.get(key, (values, parsed))
+            values = {**values, **new}
+            parsed = parsed | missing
+            _cache[key] = (values, parsed)
+            _cache.move_to_end(key)
+            while len(_cache) > XLSX_CACHE_FILES:
+                _cache.popitem(last=False)
+    else:
+        run_stats.incr("xlsx cache hits")
+
+    return {ref: values.get(r, {}).get(f"{letters}{r}") for ref, (letters, r) in refs.items()}